@@ -0,0 +1,329 @@
+"""
+Benchmarks for the chimaera codegen. Synthesizes module repositories of
+a given size and times each codegen entry point on them.
+"""
+
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from chimaera_util.codegen import ChimaeraCodegen
+from chimaera_util.reformat import RepoReformat
+from chimaera_util.util.config import reset_cache
+
+BENCH_VERSION = 1
+NAMESPACE = 'bench'
+
+
+class SyntheticRepo:
+    """
+    Writes module repositories for benchmarking. Each repo has n_mods
+    modules with n_methods methods. filler is the number of lines in
+    each method body, which sets the size of tasks.h, client.h and
+    runtime.cc.
+    """
+
+    def __init__(self, n_mods, n_methods, filler):
+        self.n_mods = n_mods
+        self.n_methods = n_methods
+        self.filler = filler
+
+    def mod_names(self):
+        return [f'mod{i}' for i in range(self.n_mods)]
+
+    def write_repo(self, root, legacy=False):
+        """
+        Writes a repo whose sources contain every method. With legacy,
+        the modules use the file names chi_repo_reformat migrates from.
+        """
+        os.makedirs(root, exist_ok=True)
+        with open(f'{root}/chimaera_repo.yaml', 'w') as fp:
+            fp.write(f'namespace: {NAMESPACE}\n')
+        for mod_name in self.mod_names():
+            self.write_mod(f'{root}/{mod_name}', legacy)
+
+    def write_mod(self, MOD_ROOT, legacy=False):
+        mod_name = os.path.basename(MOD_ROOT)
+        inc = f'{MOD_ROOT}/include/{mod_name}'
+        os.makedirs(inc, exist_ok=True)
+        os.makedirs(f'{MOD_ROOT}/src', exist_ok=True)
+        methods = [f'Method{i}' for i in range(self.n_methods)]
+        with open(f'{MOD_ROOT}/chimaera_mod.yaml', 'w') as fp:
+            fp.write(f'name: {mod_name}\n')
+        with open(f'{inc}/{mod_name}_methods.yaml', 'w') as fp:
+            fp.write('kCreate: 0\nkDestroy: 1\nkMonitor: 2\n')
+            for i, method in enumerate(methods):
+                fp.write(f'k{method}: {10 + i}\n')
+
+        client_h = f'{mod_name}.h' if legacy else f'{mod_name}_client.h'
+        runtime_cc = f'{mod_name}.cc' if legacy else f'{mod_name}_runtime.cc'
+        self._write_src(f'{inc}/{mod_name}_tasks.h', methods, '',
+                        [f'#include "{mod_name}/{client_h}"\n',
+                         f'lib_name_ = "{NAMESPACE}_{mod_name}";\n'])
+        self._write_src(f'{inc}/{client_h}', methods, '  ',
+                        ['class Client {\n'], ['};\n'])
+        self._write_src(f'{MOD_ROOT}/src/{runtime_cc}', methods, '  ',
+                        [f'#include "{mod_name}/{client_h}"\n',
+                         'class Server {\n'], ['};\n'])
+        with open(f'{MOD_ROOT}/src/CMakeLists.txt', 'w') as fp:
+            if legacy:
+                fp.write(f'add_chimod_library(${{MOD_NAMESPACE}} {mod_name} {mod_name}.cc)\n')
+            else:
+                fp.write(f'add_chimod_runtime_lib(${{REPO_NAMESPACE}} {mod_name} {mod_name}_runtime.cc)\n'
+                         f'add_chimod_client_lib(${{REPO_NAMESPACE}} {mod_name} {mod_name}_client.cc)\n')
+        if not legacy:
+            with open(f'{MOD_ROOT}/src/{mod_name}_client.cc', 'w') as fp:
+                fp.write(f'#include "{mod_name}/{mod_name}_client.h"\n')
+
+    def _write_src(self, path, methods, indent, head, tail=None):
+        filler = [f'{indent}  // filler line for benchmarking\n'] * self.filler
+        with open(path, 'w') as fp:
+            fp.writelines(head)
+            for method in methods:
+                fp.write(f'{indent}CHI_BEGIN({method})\n')
+                fp.write(f'{indent}struct {method}Task : public Task {{\n')
+                fp.writelines(filler)
+                fp.write(f'{indent}}};\n')
+                fp.write(f'{indent}CHI_END({method})\n')
+            fp.write(f'{indent}CHI_AUTOGEN_METHODS\n')
+            fp.writelines(tail or [])
+
+    def add_method(self, MOD_ROOT):
+        """
+        Adds a method to a module's methods yaml, as a developer would.
+        """
+        mod_name = os.path.basename(MOD_ROOT)
+        with open(f'{MOD_ROOT}/include/{mod_name}/{mod_name}_methods.yaml', 'a') as fp:
+            fp.write(f'kBenchNewMethod: {10 + self.n_methods}\n')
+
+    def write_templates(self, templ_dir):
+        """
+        Writes a module template like ~/.chimaera/MOD_NAME.
+        """
+        self.write_mod(templ_dir)
+        with open(f'{templ_dir}/CMakeLists.txt', 'w') as fp:
+            fp.write('add_subdirectory(src)\n'
+                     'install(DIRECTORY include/MOD_NAME DESTINATION chimaera_MOD_NAME)\n')
+
+    def write_configs(self, CHI_ROOT):
+        """
+        Writes default client and server configs for make_configs.
+        """
+        os.makedirs(f'{CHI_ROOT}/config', exist_ok=True)
+        os.makedirs(f'{CHI_ROOT}/include/chimaera/config', exist_ok=True)
+        lines = [f'key_{i}: "value {i}"  # it\'s a comment\n'
+                 for i in range(self.filler * self.n_methods)]
+        for kind in ['client', 'server']:
+            with open(f'{CHI_ROOT}/config/chimaera_{kind}_default.yaml', 'w') as fp:
+                fp.writelines(lines)
+
+
+class CodegenBench:
+    """
+    Times the codegen entry points on synthetic repositories. Every run
+    gets a freshly prepared directory; preparation is not timed.
+    """
+
+    CASES = [
+        'make_repo', 'make_mod',
+        'refresh_cold', 'refresh_warm', 'refresh_warm_changed', 'refresh_force',
+        'clear_autogen_temp', 'make_configs',
+        'reformat_cold', 'reformat_warm',
+    ]
+
+    def __init__(self, work_dir, repeat=3, jobs=1, cases=None):
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.jobs = jobs
+        self.cases = cases or self.CASES
+        self.results = []
+
+    def run(self, mods_list, methods_list, filler_list):
+        with self.private_config_cache():
+            for n_mods, n_methods, filler in itertools.product(
+                    mods_list, methods_list, filler_list):
+                synth = SyntheticRepo(n_mods, n_methods, filler)
+                for case in self.cases:
+                    self.results.append(self.run_case(case, synth))
+        return self.results
+
+    @contextlib.contextmanager
+    def private_config_cache(self):
+        """
+        Points the YAML config cache (and that of worker processes) at a
+        directory in work_dir, removed afterwards, so the synthetic repos
+        do not fill the user's cache.
+        """
+        cache_dir = tempfile.mkdtemp(prefix='yaml_cache_', dir=self.work_dir)
+        old = os.environ.get('CHIMAERA_CACHE_DIR')
+        os.environ['CHIMAERA_CACHE_DIR'] = cache_dir
+        reset_cache()
+        try:
+            yield
+        finally:
+            if old is None:
+                del os.environ['CHIMAERA_CACHE_DIR']
+            else:
+                os.environ['CHIMAERA_CACHE_DIR'] = old
+            reset_cache()
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def run_case(self, case, synth):
+        setup = getattr(self, f'setup_{case}')
+        bench = getattr(self, f'bench_{case}')
+        runs = []
+        for i in range(self.repeat):
+            root = tempfile.mkdtemp(prefix=f'{case}_', dir=self.work_dir)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    state = setup(root, synth)
+                    start = time.perf_counter()
+                    bench(state)
+                    runs.append(time.perf_counter() - start)
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+        result = {
+            'case': case,
+            'mods': synth.n_mods,
+            'methods': synth.n_methods,
+            'filler': synth.filler,
+            'jobs': self.jobs,
+            'runs': runs,
+            'min': min(runs),
+            'median': statistics.median(runs),
+        }
+        print(f"{case:<22} mods={synth.n_mods:<4} methods={synth.n_methods:<5} "
+              f"filler={synth.filler:<5} median={result['median'] * 1e3:9.2f}ms "
+              f"min={result['min'] * 1e3:9.2f}ms")
+        return result
+
+    # Setup functions return the state handed to the timed function
+
+    def _refreshed_repo(self, root, synth):
+        repo = f'{root}/repo'
+        synth.write_repo(repo)
+        ChimaeraCodegen().refresh_repo(repo, jobs=self.jobs)
+        return repo
+
+    def setup_make_repo(self, root, synth):
+        return f'{root}/repo'
+
+    def bench_make_repo(self, repo):
+        ChimaeraCodegen().make_repo(repo, NAMESPACE)
+
+    def setup_make_mod(self, root, synth):
+        templ_dir = f'{root}/MOD_NAME'
+        synth.write_templates(templ_dir)
+        repo = f'{root}/repo'
+        ChimaeraCodegen().make_repo(repo, NAMESPACE)
+        return repo, templ_dir, synth.mod_names()
+
+    def bench_make_mod(self, state):
+        repo, templ_dir, mod_names = state
+        for mod_name in mod_names:
+            ChimaeraCodegen().make_mod(f'{repo}/{mod_name}', templ_dir)
+
+    def setup_refresh_cold(self, root, synth):
+        repo = f'{root}/repo'
+        synth.write_repo(repo)
+        return repo
+
+    def bench_refresh_cold(self, repo):
+        ChimaeraCodegen().refresh_repo(repo, jobs=self.jobs)
+
+    def setup_refresh_warm(self, root, synth):
+        return self._refreshed_repo(root, synth)
+
+    def bench_refresh_warm(self, repo):
+        ChimaeraCodegen().refresh_repo(repo, jobs=self.jobs)
+
+    def setup_refresh_warm_changed(self, root, synth):
+        repo = self._refreshed_repo(root, synth)
+        synth.add_method(f'{repo}/{synth.mod_names()[0]}')
+        return repo
+
+    def bench_refresh_warm_changed(self, repo):
+        ChimaeraCodegen().refresh_repo(repo, jobs=self.jobs)
+
+    def setup_refresh_force(self, root, synth):
+        return self._refreshed_repo(root, synth)
+
+    def bench_refresh_force(self, repo):
+        ChimaeraCodegen().refresh_repo(repo, force=True, jobs=self.jobs)
+
+    def setup_clear_autogen_temp(self, root, synth):
+        return self._refreshed_repo(root, synth)
+
+    def bench_clear_autogen_temp(self, repo):
+        ChimaeraCodegen().clear_autogen_temp(repo)
+
+    def setup_make_configs(self, root, synth):
+        synth.write_configs(root)
+        return root
+
+    def bench_make_configs(self, CHI_ROOT):
+        ChimaeraCodegen().make_configs(CHI_ROOT)
+
+    def setup_reformat_cold(self, root, synth):
+        repo = f'{root}/repo'
+        synth.write_repo(repo, legacy=True)
+        return repo
+
+    def bench_reformat_cold(self, repo):
+        RepoReformat(repo).process()
+
+    def setup_reformat_warm(self, root, synth):
+        repo = self.setup_reformat_cold(root, synth)
+        RepoReformat(repo).process()
+        return repo
+
+    def bench_reformat_warm(self, repo):
+        RepoReformat(repo).process()
+
+    def report(self):
+        return {
+            'version': BENCH_VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': self.repeat,
+            'results': self.results,
+        }
+
+
+def _result_key(result):
+    return (result['case'], result['mods'], result['methods'],
+            result['filler'], result['jobs'])
+
+
+def compare_to_baseline(results, baseline, threshold, min_delta):
+    """
+    Returns the results whose median is more than threshold times the
+    baseline median, and slower by at least min_delta seconds.
+    """
+    base = {_result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = base.get(_result_key(result))
+        if old is None:
+            continue
+        if result['median'] > old['median'] * threshold and \
+                result['median'] - old['median'] >= min_delta:
+            regressions.append((result, old))
+    return regressions
+
+
+def save_report(report, path):
+    with open(path, 'w') as fp:
+        json.dump(report, fp, indent=2)
+
+
+def load_report(path):
+    with open(path) as fp:
+        return json.load(fp)
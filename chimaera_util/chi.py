@@ -0,0 +1,70 @@
+"""
+The chi entry point. Dispatches "chi <command> ..." to the modules in
+chimaera_util.commands, importing only the module of the command run.
+"""
+
+import argparse
+import importlib
+import sys
+from chimaera_util.commands import COMMANDS, ALIASES
+
+
+def usage():
+    lines = ['USAGE: chi <command> [args...]', '', 'Commands:']
+    lines += [f'  {name:<12} {summary}' for name, (_, summary) in COMMANDS.items()]
+    lines += ['', 'Run "chi <command> --help" for the arguments of a command.']
+    return '\n'.join(lines)
+
+
+def split_doc(doc):
+    """
+    Splits the docstring of a command module into its usage, the first
+    paragraph without its "USAGE:" prefix, and the rest as description.
+    """
+    usage, _, description = doc.strip().partition('\n\n')
+    if usage.startswith('USAGE:'):
+        usage = usage[len('USAGE:'):].lstrip()
+    return usage, description.strip() or None
+
+
+def make_parser(name, prog=None):
+    """
+    Imports the module of command name and builds its argument parser.
+    """
+    module = importlib.import_module(f'chimaera_util.commands.{COMMANDS[name][0]}')
+    usage, description = split_doc(module.__doc__)
+    parser = argparse.ArgumentParser(prog=prog or f'chi {name}', usage=usage,
+                                     description=description,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    module.add_args(parser)
+    return module, parser
+
+
+def run_command(name, argv, prog=None):
+    """
+    Runs one command and returns its exit status. Commands that exit
+    (argparse errors, declined prompts) return their status instead of
+    ending the process, so a batch can continue.
+    """
+    name = ALIASES.get(name, name)
+    if name not in COMMANDS:
+        print(f'chi: unknown command {name}\n\n{usage()}', file=sys.stderr)
+        return 2
+    try:
+        module, parser = make_parser(name, prog)
+        return module.run(parser.parse_args(argv)) or 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+
+
+def main(argv=None, prog=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ['-h', '--help']:
+        print(usage())
+        return 0 if argv else 2
+    return run_command(argv[0], argv[1:], prog)
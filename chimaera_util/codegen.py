@@ -4,53 +4,104 @@ Generate code for chimaera
 
 import os
 import sys
-import yaml
-from chimaera_util.util.templates import task_template, client_method_template, runtime_method_template, BASE_REPO_CMAKE
+from chimaera_util.util.templates import BASE_REPO_CMAKE, REPO_TARGETS_CMAKE, \
+    REPO_LIB_EXEC_CMAKE, REPO_BUILD_CMAKE
+from chimaera_util.util.build import build_settings, accelerate_cmake
 from chimaera_util.util.paths import CHIMAERA_TASK_TEMPL
 from chimaera_util.util.naming import to_camel_case
-import re
+from chimaera_util.util.manifest import RefreshManifest, saved_settings
+from chimaera_util.util.artifacts import Artifact, ArtifactManifest
+from chimaera_util.util.output import write_if_changed, stream_if_changed, RepoLock
+from chimaera_util.util.embed import macro_name, write_macro, write_embedded
+from chimaera_util.util.scaffold import ModuleTemplate, ModSpec, ON_EXISTS, add_methods
+from chimaera_util.util.config import load_yaml
+from chimaera_util.util.config_blob import encode_config, check_config_blob, blob_to_c_array, \
+    BLOB_VERSION
+from chimaera_util.util.profile import PROFILER
+from chimaera_util.module import ModuleCodegen, ModuleResult, refresh_module
 
 class ChimaeraCodegen:
+    def __init__(self):
+        # Module templates read by make_mods, by template directory
+        self.templates = {}
+
     def make_macro(self, PATH):
         """
         Converts the file at PATH into a C macro. The name of the
         file is used as the name of the macro. The macro name will
         be made all caps. You can use any extension on the file.
         """
-        MACRO_NAME = os.path.basename(PATH).upper().split('.')[0]
-        self.print_macro(PATH, MACRO_NAME)
+        MACRO_NAME = macro_name(PATH)
+        with PROFILER.phase('make_macro'):
+            self.print_macro(PATH, MACRO_NAME)
 
     def print_macro(self, path, macro_name):
         """
         Prints the C macro conversion
         """
-        with open(path) as fp:
-            lines = fp.read().splitlines()
-        macro_def = f'#define {macro_name} \\\n'
-        macro_body = ' \\\n'.join(lines)
-        print(f'{macro_def}{macro_body}')
+        write_macro(path, macro_name, sys.stdout)
 
-    def make_configs(self, CHI_ROOT):
+    def make_macros(self, PATHS, out_path=None, mode='macro'):
+        """
+        Embeds every file in PATHS into one header, written to out_path
+        (only if it changed) or printed. Each file is streamed, so inputs
+        of any size use a fixed amount of memory. See
+        chimaera_util.util.embed for the modes.
         """
-        Creates the default chimaera client and server configurations
+        names = [macro_name(PATH) for PATH in PATHS]
+        dup = {name for name in names if names.count(name) > 1}
+        if dup:
+            raise ValueError(f'Inputs map to the same name: {sorted(dup)}')
+        if out_path is None:
+            self._write_macros(PATHS, names, sys.stdout, mode)
+            return
+        guard = f'CHI_EMBED_{macro_name(out_path)}_H_'
+        with stream_if_changed(out_path) as out:
+            out.write(f'#ifndef {guard}\n#define {guard}\n')
+            self._write_macros(PATHS, names, out, mode,
+                               os.path.dirname(os.path.abspath(out_path)))
+            out.write(f'#endif  // {guard}\n')
+
+    def _write_macros(self, PATHS, names, out, mode, out_dir=None):
+        if mode != 'macro':
+            out.write('#include <cstddef>\n')
+        for PATH, name in zip(PATHS, names):
+            with PROFILER.module(name), PROFILER.phase('make_macro'):
+                write_embedded(PATH, name, out, mode, out_dir)
+
+    def make_configs(self, CHI_ROOT, binary=False):
+        """
+        Creates the default chimaera client and server configurations.
+        With binary, the pre-parsed binary form of each configuration is
+        also written to config_*_default_bin.h.
         """
         self._create_config(
             path=f"{CHI_ROOT}/config/chimaera_client_default.yaml",
             var_name="kChiDefaultClientConfigStr",
             config_path=f"{CHI_ROOT}/include/chimaera/config/config_client_default.h",
-            macro_name="CHI_CLIENT"
+            macro_name="CHI_CLIENT",
+            binary=binary
         )
         self._create_config(
             path=f"{CHI_ROOT}/config/chimaera_server_default.yaml",
             var_name="kChiServerDefaultConfigStr",
             config_path=f"{CHI_ROOT}/include/chimaera/config/config_server_default.h",
-            macro_name="CHI_SERVER"
+            macro_name="CHI_SERVER",
+            binary=binary
         )
 
-    def _create_config(self, path, var_name, config_path, macro_name):
+    def _create_config(self, path, var_name, config_path, macro_name, binary=False):
         """
         Creates a chimaera configuration file. Either the server or the client.
         """
+        with PROFILER.module(macro_name):
+            with PROFILER.phase('create_config'):
+                self._create_config_h(path, var_name, config_path, macro_name)
+            if binary:
+                with PROFILER.phase('create_config_bin'):
+                    self._create_config_bin_h(path, var_name, config_path, macro_name)
+
+    def _create_config_h(self, path, var_name, config_path, macro_name):
         with open(path) as fp:
             yaml_config_lines = fp.read().splitlines()
 
@@ -72,8 +123,35 @@ class ChimaeraCodegen:
 
         # Persist
         config = "\n".join(config_lines)
-        with open(config_path, 'w') as fp:
-            fp.write(config)
+        write_if_changed(config_path, config)
+
+    def _create_config_bin_h(self, path, var_name, config_path, macro_name):
+        """
+        Parses the configuration now and embeds it as a binary blob (see
+        chimaera_util.util.config_blob), so it can be loaded without a
+        YAML parser. The blob is decoded again and checked against the
+        parsed config before it is written next to config_path as *_bin.h.
+        """
+        config = load_yaml(path)
+        blob, hash_val = encode_config(config)
+        check_config_blob(blob, config, hash_val)
+        var_name = var_name[:-len('Str')] if var_name.endswith('Str') else var_name
+        guard = f"CHI_SRC_CONFIG_{macro_name}_DEFAULT_BIN_H_"
+        config_lines = []
+        config_lines.append(f"#ifndef {guard}")
+        config_lines.append(f"#define {guard}")
+        config_lines.append("#include <cstddef>")
+        config_lines.append("#include <cstdint>")
+        config_lines.append(f"/** {os.path.basename(path)} in the chimaera config blob format */")
+        config_lines.append(f"constexpr uint16_t {var_name}BinVersion = {BLOB_VERSION};")
+        config_lines.append(f"constexpr uint64_t {var_name}SchemaHash = 0x{hash_val:016x}ULL;")
+        config_lines.append(f"constexpr size_t {var_name}BinSize = {len(blob)};")
+        config_lines.append(f"alignas(8) constexpr uint8_t {var_name}Bin[] = {{")
+        config_lines += blob_to_c_array(blob)
+        config_lines.append("};")
+        config_lines.append(f"#endif  // {guard}")
+        bin_path = f"{os.path.splitext(config_path)[0]}_bin.h"
+        write_if_changed(bin_path, "\n".join(config_lines))
 
     def make_repo(self, MOD_REPO_DIR, namespace):
         """
@@ -83,178 +161,261 @@ class ChimaeraCodegen:
         self.namespace = namespace
         os.makedirs(MOD_REPO_DIR, exist_ok=True)
         repo_conf = {'namespace': namespace}
-        self.save_repo_config(MOD_REPO_DIR, repo_conf)
-        self.refresh_repo_cmake(MOD_REPO_DIR)
+        with RepoLock(MOD_REPO_DIR):
+            self.save_repo_config(MOD_REPO_DIR, repo_conf)
+            self.refresh_repo_cmake(MOD_REPO_DIR)
         print(f'Created module repository at {MOD_REPO_DIR}')
 
     def load_repo_config(self, MOD_REPO_DIR):
         try:
             MOD_REPO_DIR = os.path.abspath(MOD_REPO_DIR)
-            with open(f'{MOD_REPO_DIR}/chimaera_repo.yaml') as fp:
-                config = yaml.load(fp, Loader=yaml.FullLoader)
+            config = load_yaml(f'{MOD_REPO_DIR}/chimaera_repo.yaml')
             self.namespace = config['namespace']
         except:
             print(f'{MOD_REPO_DIR} does not have a chimaera_repo.yaml file.')
         return config
 
     def save_repo_config(self, MOD_REPO_DIR, repo_conf):
-        with open(f'{MOD_REPO_DIR}/chimaera_repo.yaml', 'w') as fp:
-            yaml.dump(repo_conf, fp)
+        import yaml
+        write_if_changed(f'{MOD_REPO_DIR}/chimaera_repo.yaml',
+                         yaml.dump(repo_conf))
 
-    def make_mod(self, MOD_ROOT):
+    def make_mod(self, MOD_ROOT, templ_dir=CHIMAERA_TASK_TEMPL, on_exists='prompt'):
         """
         Bootstraps a task. Copies all the necessary files and replaces. This
-        is an aggressive operation.
+        is an aggressive operation. templ_dir is the module template,
+        ~/.chimaera/MOD_NAME by default. on_exists is the policy for a
+        module that is already bootstrapped (see make_mods).
         """
-        MOD_REPO_DIR = os.path.dirname(MOD_ROOT)
-        self.load_repo_config(MOD_REPO_DIR)
-        self.mod_name = os.path.basename(MOD_ROOT)
-        if os.path.exists(f'{MOD_ROOT}/src'):
-            ret = input('This task seems bootstrapped, do you really want to continue? (yes/no): ')
-            if ret != 'yes':
-                print('Skipping...')
-                sys.exit(0)
-        os.makedirs(f'{MOD_ROOT}/src', exist_ok=True)
-        os.makedirs(f'{MOD_ROOT}/include/{self.mod_name}', exist_ok=True)
-        self._copy_replace_iter(MOD_ROOT, CHIMAERA_TASK_TEMPL, '')
-
-    def _copy_replace_iter(self, MOD_ROOT, CHIMAERA_TASK_TEMPL, rel_path):
-        for name in os.listdir(f"{CHIMAERA_TASK_TEMPL}/{rel_path}"):
-            # Copy and replace files
-            if os.path.isfile(f"{CHIMAERA_TASK_TEMPL}/{rel_path}/{name}"):
-                rel_file_path = os.path.join(rel_path, name)
-                self._copy_replace(MOD_ROOT, CHIMAERA_TASK_TEMPL, rel_file_path)
-            # Recurse
-            elif os.path.isdir(f"{CHIMAERA_TASK_TEMPL}/{rel_path}/{name}"):
-                self._copy_replace_iter(MOD_ROOT, CHIMAERA_TASK_TEMPL, os.path.join(rel_path, name))
-
-    def _copy_replace(self, MOD_ROOT, CHIMAERA_TASK_TEMPL, rel_path):
-        """
-        Copies a file from CHIMAERA_TASK_TEMPL to MOD_ROOT and renames
-        TASK_TEMPL to the value of self.mod_name
-        """
-        with open(f'{CHIMAERA_TASK_TEMPL}/{rel_path}') as fp:
-            text = fp.read()
-        text = text.replace('chimaera_MOD_NAME', f'{self.namespace}_{self.mod_name}')
-        text = text.replace('MOD_NAME', self.mod_name)
-        rel_path = rel_path.replace('MOD_NAME', self.mod_name)
-        with open(f'{MOD_ROOT}/{rel_path}', 'w') as fp:
-            fp.write(text)
-
-    def refresh_repo(self, MOD_REPO_DIR):
-        print(f'Refreshing repository at {MOD_REPO_DIR}')
-        self.load_repo_config(MOD_REPO_DIR)
-        self.refresh_repo_mods(MOD_REPO_DIR)
-        self.refresh_repo_cmake(MOD_REPO_DIR)
+        MOD_REPO_DIR = os.path.dirname(os.path.abspath(MOD_ROOT))
+        return self.make_mods(MOD_REPO_DIR, [ModSpec(os.path.basename(MOD_ROOT))],
+                              templ_dir, on_exists)
 
-    def refresh_repo_mods(self, MOD_REPO_DIR):
+    def make_mods(self, MOD_REPO_DIR, specs, templ_dir=CHIMAERA_TASK_TEMPL,
+                  on_exists='prompt', jobs=1):
+        """
+        Bootstraps every module in specs (ModSpecs) in MOD_REPO_DIR. The
+        template is read once, and files are written by jobs threads.
+        on_exists decides what happens to a module whose src/ exists:
+        prompt asks, skip leaves it alone, overwrite regenerates its
+        files and error fails before anything is written.
+        Returns the names of the modules that were written.
+        """
+        if on_exists not in ON_EXISTS:
+            raise ValueError(f'Unknown on_exists policy {on_exists}, '
+                             f'expected one of {ON_EXISTS}')
         MOD_REPO_DIR = os.path.abspath(MOD_REPO_DIR)
-        MOD_ROOTS = [os.path.join(MOD_REPO_DIR, item)
-                      for item in os.listdir(MOD_REPO_DIR)]
-        # Refresh all methods
-        for MOD_ROOT in MOD_ROOTS:
-            try:
-                self.refresh_mod_tasks(MOD_ROOT)
-            except Exception as e:
-                print(e)
-                pass
+        self.load_repo_config(MOD_REPO_DIR)
+        specs = [spec for spec in specs
+                 if self._may_bootstrap(f'{MOD_REPO_DIR}/{spec.name}', on_exists)]
+        with RepoLock(MOD_REPO_DIR):
+            templ = self.module_template(templ_dir)
+            writes = []
+            dirs = set()
+            for spec in specs:
+                MOD_ROOT = f'{MOD_REPO_DIR}/{spec.name}'
+                dirs.update([f'{MOD_ROOT}/src', f'{MOD_ROOT}/include/{spec.name}'])
+                with PROFILER.module(spec.name), PROFILER.phase('render_templates'):
+                    writes += self._render_mod(MOD_ROOT, templ, spec)
+            with PROFILER.phase('copy_templates'):
+                dirs.update(os.path.dirname(path) for _, path, _ in writes)
+                for dirname in sorted(dirs):
+                    os.makedirs(dirname, exist_ok=True)
+                if jobs <= 0:
+                    jobs = os.cpu_count() or 1
+                if jobs > 1 and len(writes) > 1:
+                    from concurrent.futures import ThreadPoolExecutor
+                    with ThreadPoolExecutor(max_workers=jobs) as pool:
+                        list(pool.map(self._write_mod_file, writes))
+                else:
+                    list(map(self._write_mod_file, writes))
+            if specs:
+                self.refresh_repo_cmake(MOD_REPO_DIR)
+        return [spec.name for spec in specs]
+
+    def module_template(self, templ_dir):
+        """
+        The ModuleTemplate of templ_dir, read on first use.
+        """
+        templ = self.templates.get(templ_dir)
+        if templ is None:
+            with PROFILER.phase('load_templates'):
+                templ = ModuleTemplate(templ_dir)
+            self.templates[templ_dir] = templ
+        return templ
+
+    def _may_bootstrap(self, MOD_ROOT, on_exists):
+        if not os.path.exists(f'{MOD_ROOT}/src') or on_exists == 'overwrite':
+            return True
+        mod_name = os.path.basename(MOD_ROOT)
+        if on_exists == 'skip':
+            print(f'[{mod_name}] already bootstrapped, skipping')
+            return False
+        if on_exists == 'error':
+            raise FileExistsError(f'{MOD_ROOT} is already bootstrapped')
+        try:
+            ret = input(f'{mod_name} seems bootstrapped, do you really want to continue? (yes/no): ')
+        except EOFError:
+            raise FileExistsError(
+                f'{MOD_ROOT} is already bootstrapped and there is no terminal to ask; '
+                f'choose a policy with --on-exists skip|overwrite|error') from None
+        if ret != 'yes':
+            print('Skipping...')
+            return False
+        return True
 
-    def refresh_repo_cmake(self, MOD_REPO_DIR):
+    def _render_mod(self, MOD_ROOT, templ, spec):
+        """
+        Returns the [(mod_name, path, text)] to write for a module.
+        """
+        files = templ.render(self.namespace, spec.name)
+        if spec.methods:
+            methods_rel = f'include/{spec.name}/{spec.name}_methods.yaml'
+            texts = dict(files)
+            texts[methods_rel] = add_methods(texts.get(methods_rel, ''), spec.methods)
+            files = list(texts.items())
+        return [(spec.name, f'{MOD_ROOT}/{rel_path}', text)
+                for rel_path, text in files]
+
+    def _write_mod_file(self, write):
+        mod_name, path, text = write
+        with PROFILER.module(mod_name):
+            write_if_changed(path, text)
+
+    def refresh_repo(self, MOD_REPO_DIR, force=False, jobs=1, options=None,
+                     pool=None, quiet=False):
+        """
+        Refreshes every module in the repo. Modules whose inputs are
+        unchanged since the last refresh are skipped unless force is set.
+        options are codegen options (see chimaera_util.module.DEFAULT_OPTIONS)
+        applied to modules that do not override them. pool is a process
+        pool to refresh the modules in instead of one made for this repo.
+        With quiet, the log is left for the caller to print.
+        Returns the list of ModuleResults, sorted by module name.
+        """
+        if not quiet:
+            print(f'Refreshing repository at {MOD_REPO_DIR}')
+        with RepoLock(MOD_REPO_DIR):
+            with PROFILER.phase('load_repo_config'):
+                self.load_repo_config(MOD_REPO_DIR)
+            results = self.refresh_repo_mods(MOD_REPO_DIR, force=force, jobs=jobs,
+                                             options=options, pool=pool)
+            with PROFILER.phase('refresh_repo_cmake'):
+                self.refresh_repo_cmake(MOD_REPO_DIR)
+        if not quiet:
+            self.print_results(results)
+        return results
+
+    def refresh_repo_mods(self, MOD_REPO_DIR, force=False, jobs=1, options=None,
+                          pool=None):
+        """
+        Refreshes the modules of a repo. With jobs > 1, stale modules
+        are refreshed in a process pool. jobs <= 0 uses every core.
+        With pool, stale modules are refreshed in it regardless of jobs.
+        """
         MOD_REPO_DIR = os.path.abspath(MOD_REPO_DIR)
-        camel_ns = to_camel_case(self.namespace) 
-        MOD_NAMES = [MOD_NAME for MOD_NAME in os.listdir(MOD_REPO_DIR) 
-                     if os.path.isdir(f'{MOD_REPO_DIR}/{MOD_NAME}')
-                     and os.path.exists(f'{MOD_REPO_DIR}/{MOD_NAME}/chimaera_mod.yaml')]
-        MOD_NAMES = sorted(MOD_NAMES) 
-        subdirs = '\n'.join([f'add_subdirectory({MOD_NAME})' 
-                             for MOD_NAME in MOD_NAMES])
-        repo_cmake = BASE_REPO_CMAKE.format(namespace=self.namespace, subdirs=subdirs, camel_ns=camel_ns)
-        with open(f'{MOD_REPO_DIR}/CMakeLists.txt', 'w') as fp:
-            fp.write(repo_cmake)
-
-    def load_method_defs(self):
-        with open(self.METHODS_YAML) as fp:
-            method_defs = yaml.load(fp, Loader=yaml.FullLoader)
-        if method_defs is None:
-            method_defs = {}
-        self.method_defs = method_defs
-
-    def get_task_name_from_line(self, line):
-        match_set = [
-            re.search(r'struct\s+(.*)Task :', line),
-            re.search(r'CHI_BEGIN\((.*?)\)', line),
-            re.search(r'CHI_END\((.*?)\)', line),
-        ]
-        for match in match_set:
-            if not match:
-                continue
-            task_name = match.group(1)
-            return task_name
-        return None
-
-    def scan_compiled_tasks(self):
-        methods = {}
-        if os.path.exists(self.OLD_TASKS_H):
-            with open(self.OLD_TASKS_H) as fp:
-                for line in fp:
-                    task_name = self.get_task_name_from_line(line)
-                    if task_name is None:
-                        continue
-                    method_name = f'k{task_name}'
-                    if method_name not in self.method_defs:
-                        continue
-                    method_off = self.method_defs[method_name]
-                    methods[method_name] = {
-                        'val': method_off,
-                        'compiled': True
-                    }
-        return methods
-
-    def mark_new_methods_uncompiled(self):
-        for method_name, method_off in self.method_defs.items():
-                if method_off < 0:
-                    continue
-                if method_off <= 2:
-                    # These are required methods
-                    self.methods[method_name] = {
-                        'val': method_off,
-                        'compiled': True
-                    }
-                if method_off < 10:
-                    # TODO(llogan): Allow bootstrapping special methods
+        MOD_ROOTS = [os.path.join(MOD_REPO_DIR, item)
+                      for item in sorted(os.listdir(MOD_REPO_DIR))]
+        options = options or {}
+        results = []
+        stale = []
+        with PROFILER.phase('check_manifest'):
+            manifest = RefreshManifest(MOD_REPO_DIR, settings=options)
+            manifest.prune([os.path.basename(MOD_ROOT) for MOD_ROOT in MOD_ROOTS])
+            for MOD_ROOT in MOD_ROOTS:
+                if not os.path.exists(f'{MOD_ROOT}/include'):
                     continue
-                if method_name in self.methods:
+                if not force and manifest.is_fresh(MOD_ROOT):
+                    results.append(ModuleResult(os.path.basename(MOD_ROOT), 'skipped'))
+                    PROFILER.count('modules_skipped')
                     continue
-                self.methods[method_name] = {
-                    'val': method_off,
-                    'compiled': False
-                }
-
-    def save_method_compile_staus(self):
-        lines = []
-        for method in self.sorted_methods:
-            method_name = method[0]
-            method_info = method[1]
-            if 'compiled_tmp' in method_info:
-                method_info['compiled'] = method_info['compiled_tmp']
-                del method_info['compiled_tmp']
-            if 'inserted' in method_info:
-                del method_info['inserted']
-            lines.append(f'{method_name}: {method_info}')
-        with open(self.COMPILED_METHODS_YAML, 'w') as fp:
-            fp.write('\n'.join(lines))
-
-    def get_method_compile_status(self):
-        self.load_method_defs()
-        self.methods = self.scan_compiled_tasks()
-        # try:
-        #     with open(self.COMPILED_METHODS_YAML) as fp:
-        #         self.methods = yaml.load(fp, Loader=yaml.FullLoader)
-        # except:
-        #     self.methods = None
-        # if self.methods is None:
-        #     self.methods = self.scan_compiled_tasks()
-        self.mark_new_methods_uncompiled()
+                stale.append(MOD_ROOT)
+
+        # Refresh all stale modules
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        jobs = min(jobs, len(stale))
+        namespaces = [self.namespace] * len(stale)
+        mod_options = [options] * len(stale)
+        if stale and (pool is not None or jobs > 1):
+            profile = [PROFILER.enabled] * len(stale)
+            if pool is not None:
+                refreshed = list(pool.map(refresh_module, stale, namespaces,
+                                          mod_options, profile))
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=jobs) as pool:
+                    refreshed = list(pool.map(refresh_module, stale, namespaces,
+                                              mod_options, profile))
+            for result in refreshed:
+                if result.profile is not None:
+                    PROFILER.merge(result.profile)
+        else:
+            refreshed = list(map(refresh_module, stale, namespaces, mod_options))
+
+        # Record which modules are now up to date
+        with PROFILER.phase('save_manifest'):
+            for MOD_ROOT, result in zip(stale, refreshed):
+                if result.status == 'failed':
+                    manifest.forget(MOD_ROOT)
+                else:
+                    manifest.record(MOD_ROOT)
+            manifest.save()
+            self.record_artifacts(MOD_REPO_DIR, refreshed,
+                                  [os.path.basename(MOD_ROOT) for MOD_ROOT in MOD_ROOTS])
+        results += refreshed
+        results.sort(key=lambda result: result.mod_name)
+        return results
+
+    def record_artifacts(self, MOD_REPO_DIR, results, MOD_NAMES=None):
+        """
+        Records the files written by refreshed modules in the artifact
+        manifest. With MOD_NAMES, modules not among them are forgotten.
+        """
+        artifacts = ArtifactManifest(MOD_REPO_DIR)
+        if MOD_NAMES is not None:
+            artifacts.prune(MOD_NAMES)
+        for result in results:
+            if result.status != 'skipped':
+                artifacts.record_module(result.mod_name, result.artifacts)
+        artifacts.save()
+
+    def print_results(self, results):
+        """
+        Prints the log of each module, in module order, followed by a summary.
+        """
+        counts = {'refreshed': 0, 'skipped': 0, 'failed': 0}
+        for result in results:
+            counts[result.status] += 1
+            for msg in result.messages:
+                print(f'[{result.mod_name}] {msg}')
+            if result.error is not None:
+                print(f'[{result.mod_name}] FAILED: {result.error}')
+        print(f"Refreshed {counts['refreshed']} modules, "
+              f"skipped {counts['skipped']} unchanged, "
+              f"{counts['failed']} failed")
+
+    def verify_repo(self, MOD_REPO_DIR):
+        """
+        Checks the generated files of a repo without regenerating them.
+        Returns a sorted [(status, path)]: 'modified' generated files were
+        edited by hand (or temp files since they were written), 'missing'
+        ones were deleted, and 'stale' modules changed since their last
+        refresh. Returns None if the repo has no artifact manifest.
+        """
+        MOD_REPO_DIR = os.path.abspath(MOD_REPO_DIR)
+        artifacts = ArtifactManifest(MOD_REPO_DIR)
+        if not artifacts.exists:
+            return None
+        MOD_NAMES = [MOD_NAME for MOD_NAME in sorted(os.listdir(MOD_REPO_DIR))
+                     if os.path.exists(f'{MOD_REPO_DIR}/{MOD_NAME}/include')]
+        artifacts.prune(MOD_NAMES)
+        problems = [(status, key) for status, key, _ in artifacts.verify()]
+        manifest = RefreshManifest(MOD_REPO_DIR, settings=saved_settings(MOD_REPO_DIR))
+        for MOD_NAME in MOD_NAMES:
+            if not manifest.is_fresh(os.path.join(MOD_REPO_DIR, MOD_NAME)):
+                problems.append(('stale', MOD_NAME))
+        return sorted(problems, key=lambda problem: problem[1])
 
     def refresh_mod_tasks(self, MOD_ROOT):
         """
@@ -262,400 +423,78 @@ class ChimaeraCodegen:
         """
         if not os.path.exists(f'{MOD_ROOT}/include'):
             return
-        self.mod_name = os.path.basename(MOD_ROOT)
-
-        #Create paths
-        MOD_NAME = os.path.basename(MOD_ROOT)
-        self.METHODS_YAML = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.yaml'
-        self.COMPILED_METHODS_YAML = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.compiled.yaml'
-        self.METHODS_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.h'
-        self.METHOD_MACRO = f'CHI_{MOD_NAME.upper()}_METHODS_H_'
-        self.LIB_EXEC_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_lib_exec.h'
-        self.LIB_EXEC_MACRO = f'CHI_{MOD_NAME.upper()}_LIB_EXEC_H_'
-        self.OLD_TASKS_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_tasks.h'
-        self.NEW_TASKS_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_tasks.temp_h'
-        self.OLD_CLIENT_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_client.h'
-        self.NEW_CLIENT_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_client.temp_h'
-        self.OLD_RUNTIME_CC = f'{MOD_ROOT}/src/{MOD_NAME}_runtime.cc'
-        self.NEW_RUNTIME_CC = f'{MOD_ROOT}/src/{MOD_NAME}_runtime.temp_cc'
-
-        # Load methods and their compiled status
-        self.get_method_compile_status() 
-        self.sorted_methods = sorted(self.methods.items(), key=lambda x: x[1]['val'])
-
-        # Refresh the files
-        self.refresh_methods_h()
-        self.refresh_lib_exec_h()
-        self.refresh_tasks_h()
-        self.refresh_client_h()
-        self.refresh_runtime_cc()
-
-        # Save compiled methods
-        self.save_method_compile_staus()
-
-    def refresh_methods_h(self):
-        lines = []
-        lines += [f'#ifndef {self.METHOD_MACRO}',
-                  f'#define {self.METHOD_MACRO}',
-                  '',
-                  '/** The set of methods in the admin task */',
-                  'struct Method : public TaskMethod {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 10:
-                continue
-            lines += [f'  TASK_METHOD_T {method_enum_name} = {method_off};']
-        last_method_id = self.sorted_methods[-1][1]['val']
-        lines += [f'  TASK_METHOD_T kCount = {last_method_id + 1};']
-        lines += ['};', '', f'#endif  // {self.METHOD_MACRO}']
-        with open(self.METHODS_H, 'w') as fp:
-            fp.write('\n'.join(lines))
-
-    def refresh_lib_exec_h(self):
-        # Produce the MOD_NAME_lib_exec.h file
-        lines = []
-        lines += [f'#ifndef {self.LIB_EXEC_MACRO}',
-                  f'#define {self.LIB_EXEC_MACRO}',
-                  '']
-        ## Create the Run method
-        lines += ['/** Execute a task */',
-                  'void Run(u32 method, Task *task, RunContext &rctx) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      {method_name}(reinterpret_cast<{task_name} *>(task), rctx);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Create the Monitor method
-        lines += ['/** Execute a task */',
-                  'void Monitor(MonitorModeId mode, MethodId method, Task *task, RunContext &rctx) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      Monitor{method_name}(mode, reinterpret_cast<{task_name} *>(task), rctx);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Create the Del method
-        lines += ['/** Delete a task */',
-                  'void Del(const hipc::MemContext &mctx, u32 method, Task *task) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      CHI_CLIENT->DelTask<{task_name}>(mctx, reinterpret_cast<{task_name} *>(task));',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Create the CopyStart method
-        lines += ['/** Duplicate a task */',
-                  'void CopyStart(u32 method, const Task *orig_task, Task *dup_task, bool deep) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      chi::CALL_COPY_START(',
-                      f'        reinterpret_cast<const {task_name}*>(orig_task), ',
-                      f'        reinterpret_cast<{task_name}*>(dup_task), deep);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Create the CopyStart method
-        lines += ['/** Duplicate a task */',
-                  'void NewCopyStart(u32 method, const Task *orig_task, FullPtr<Task> &dup_task, bool deep) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      chi::CALL_NEW_COPY_START(reinterpret_cast<const {task_name}*>(orig_task), dup_task, deep);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Create the SaveStart Method
-        lines += ['/** Serialize a task when initially pushing into remote */',
-                  'void SaveStart(',
-                  # '    const hipc::CtxAllocator<CHI_ALLOC_T> &alloc, ',
-                  '    u32 method, BinaryOutputArchive<true> &ar,',
-                  '    Task *task) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      ar << *reinterpret_cast<{task_name}*>(task);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Create the LoadStart Method
-        lines += ['/** Deserialize a task when popping from remote queue */',
-                  'TaskPointer LoadStart('
-                  # '    const hipc::CtxAllocator<CHI_ALLOC_T> &alloc, ',
-                  '    u32 method, BinaryInputArchive<true> &ar) override {',
-                  '  TaskPointer task_ptr;',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      task_ptr.ptr_ = CHI_CLIENT->NewEmptyTask<{task_name}>(',
-                      f'             HSHM_DEFAULT_MEM_CTX, task_ptr.shm_);',
-                      f'      ar >> *reinterpret_cast<{task_name}*>(task_ptr.ptr_);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['  return task_ptr;']
-        lines += ['}']
-
-        ## Create the SaveEnd Method
-        lines += ['/** Serialize a task when returning from remote queue */',
-                  'void SaveEnd(u32 method, BinaryOutputArchive<false> &ar, Task *task) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      ar << *reinterpret_cast<{task_name}*>(task);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Create the LoadEnd Method
-        lines += ['/** Deserialize a task when popping from remote queue */',
-                  'void LoadEnd(u32 method, BinaryInputArchive<false> &ar, Task *task) override {',
-                  '  switch (method) {']
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
-                continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            lines += [f'    case Method::{method_enum_name}: {{',
-                      f'      ar >> *reinterpret_cast<{task_name}*>(task);',
-                      f'      break;',
-                      f'    }}']
-        lines += ['  }']
-        lines += ['}']
-
-        ## Finish the file
-        lines += ['', f'#endif  // {self.LIB_EXEC_MACRO}']
-
-        ## Write MOD_NAME_lib_exec.h
-        with open(self.LIB_EXEC_H, 'w') as fp:
-            fp.write('\n'.join(lines))
-
-    def refresh_tasks_h(self):
-        self.correct_lib_name()
-        self.refresh_method_try_modes(
-            self.OLD_TASKS_H, 
-            self.NEW_TASKS_H, task_template)
-
-    def correct_lib_name(self):
-        with open(self.OLD_TASKS_H) as fp:
-            content = fp.read()
-        # Replace lib_name_ with namespace_mod_name version
-        old_texts = [
-            f'lib_name_ = "{self.mod_name}"',
-            f'lib_name_ = "chimaera_{self.mod_name}"',
-        ]
-        new_text = f'lib_name_ = "{self.namespace}_{self.mod_name}"'
-        for old_text in old_texts:
-            if old_text in content:
-                print(f"Fixing lib_name_ from {self.mod_name} to {self.namespace}_{self.mod_name}")
-                content = content.replace(old_text, new_text)
-                with open(self.OLD_TASKS_H, 'w') as fp:
-                    fp.write(content)
-
-    def refresh_client_h(self):
-        self.refresh_method_try_modes(
-            self.OLD_CLIENT_H, 
-            self.NEW_CLIENT_H, client_method_template)
-
-    def refresh_runtime_cc(self):
-        self.refresh_method_try_modes(
-            self.OLD_RUNTIME_CC, 
-            self.NEW_RUNTIME_CC, runtime_method_template)
-
-    def refresh_method_try_modes(self, orig_path, new_path, tmpl_name):
-        with open(orig_path) as fp:
-            self.content = fp.readlines()
-        self.tmpl_name = tmpl_name
-        did_edits = False
-
-        # Insert based on macros
-        self.chi_ends = self.get_chi_end_map(self.content)
-        self.pending_chi_ends = {}
-        self.sorted_off = -1
-        for method_enum_name, method_info in self.sorted_methods:
-            self.sorted_off += 1
-            self.method_enum_name = method_enum_name
-            self.method_info = method_info
-            self.method_name = method_enum_name.replace('k', '', 1)
-            self.task_name = self.method_name + "Task"
-            if self.refresh_insert():
-                did_edits = True
-                continue
-            if self.refresh_append():
-                did_edits = True
-                continue
+        mod = ModuleCodegen(MOD_ROOT, self.namespace)
+        mod.refresh()
+        for msg in mod.messages:
+            print(msg)
 
-        # Write edited data
-        if did_edits:
-            self.refresh_insert_commit()
-            with open(orig_path, 'w') as fp:
-                fp.write(''.join(self.content))
-        elif 'CHI_AUTOGEN_METHODS' not in self.chi_ends:
-            self.refresh_tmpfile(new_path, tmpl_name)
-
-    def get_method_name(self, sorted_off):
-        method_enum_name = self.sorted_methods[sorted_off][0]
-        method_name = method_enum_name.replace('k', '', 1)
-        return method_name
-    
-    def get_chi_end_map(self, content):
-        """Find lines with CHI_END macro and map method_name to line number"""
-        chi_end_pattern = r'CHI_END\((.*?)\)'
-        method_map = {}
-        for i, line in enumerate(content):
-            match = re.search(chi_end_pattern, line)
-            if match:
-                method_name = match.group(1)
-                method_map[method_name] = i
-                continue
-            match = 'CHI_AUTOGEN_METHODS' in line
-            if match:
-                method_map['CHI_AUTOGEN_METHODS'] = i
-        return method_map
-
-    def refresh_insert_commit(self):
-        # Sort pending chi ends by insert position in descending order 
-        sorted_pending = sorted(self.pending_chi_ends.values(), 
-                               key=lambda x: x['insert'],
-                               reverse=True)
-
-        # Insert templates at sorted positions
-        for info in sorted_pending:
-            start_line = info['insert'] 
-            if start_line == -100:
-                break
-            tmpls = info['tmpl']
-            self.content = self.content[0:start_line] + tmpls + self.content[start_line:]
-
-    def refresh_insert(self):
-        """
-        Inserts non-compiled methods into the runtime
-        file at the ideal location
-        """
-        self.method_info['inserted'] = False
-        method_off = self.method_info['val']
-        if method_off < 0 or self.method_info['compiled']:
-            return False
-        tmpl = self.make_tmpl(self.tmpl_name, self.task_name, self.method_name, self.method_enum_name)
-        tmpl = '\n' + tmpl
-        # Find CHI_END tag to insert after
-        prior_method_name = self.get_method_name(self.sorted_off - 1)
-        if prior_method_name in self.chi_ends:
-            self.pending_chi_ends[self.method_name] = {
-                'insert': self.chi_ends[prior_method_name] + 1,
-                'tmpl': [tmpl],
-            }
-        elif prior_method_name in self.pending_chi_ends:
-            tmpls = self.pending_chi_ends[prior_method_name]['tmpl']
-            tmpls.append(tmpl)
-            self.pending_chi_ends[self.method_name] = {
-                'insert': -100,
-                'tmpl': tmpls,
-            }
-        else:
-            return False
-        self.method_info['compiled_tmp'] = True
-        self.method_info['inserted'] = True
-        return True
-        
-    def refresh_append(self):
-        """
-        Appends non-compiled methods to the end of the
-        runtime and marks them compiled
-        """
-        method_off = self.method_info['val']
-        if method_off < 0 or self.method_info['compiled'] or self.method_info['inserted']:
-            return False
-        tmpl = self.make_tmpl(self.tmpl_name, self.task_name, self.method_name, self.method_enum_name)
-        # Find CHI_AUTOGEN_METHODS tag and insert before
-        if 'CHI_AUTOGEN_METHODS' not in self.chi_ends:
-            return False
-        start_line = self.chi_ends['CHI_AUTOGEN_METHODS']
-        self.content.insert(start_line, tmpl + '\n')
-        self.chi_ends[self.method_name] = start_line
-        self.method_info['compiled_tmp'] = True
-        return True
-
-    def refresh_tmpfile(self, new_path, tmpl_name):
+    def refresh_repo_cmake(self, MOD_REPO_DIR):
+        MOD_REPO_DIR = os.path.abspath(MOD_REPO_DIR)
+        camel_ns = to_camel_case(self.namespace) 
+        MOD_NAMES = [MOD_NAME for MOD_NAME in os.listdir(MOD_REPO_DIR) 
+                     if os.path.isdir(f'{MOD_REPO_DIR}/{MOD_NAME}')
+                     and os.path.exists(f'{MOD_REPO_DIR}/{MOD_NAME}/chimaera_mod.yaml')]
+        MOD_NAMES = sorted(MOD_NAMES) 
+        build, subdirs = self.repo_cmake_subdirs(MOD_REPO_DIR, MOD_NAMES)
+        repo_cmake = BASE_REPO_CMAKE.format(namespace=self.namespace, subdirs='\n'.join(subdirs),
+                                            camel_ns=camel_ns, build=build)
+        data = repo_cmake.encode()
+        write_if_changed(f'{MOD_REPO_DIR}/CMakeLists.txt', data)
+        artifacts = ArtifactManifest(MOD_REPO_DIR)
+        artifacts.add(Artifact(f'{MOD_REPO_DIR}/CMakeLists.txt', 'generated', data))
+        artifacts.save()
+
+    def repo_cmake_subdirs(self, MOD_REPO_DIR, MOD_NAMES):
         """
-        Generates a temporary file with new runtime methods
-        to copy-paste from.
+        The CMake functions for generated dispatch sources and build
+        acceleration, and the add_subdirectory lines of the repo
+        CMakeLists.txt. Modules with a generated src/MOD_NAME_lib_exec.cc
+        are followed by a chi_module_lib_exec call. With a build: section
+        in chimaera_repo.yaml, each module is followed by its
+        chi_accelerate_module call (see chimaera_util.util.build).
         """
+        repo_conf = load_yaml(f'{MOD_REPO_DIR}/chimaera_repo.yaml') or {}
+        repo_build = repo_conf.get('build')
+        lib_exec = [MOD_NAME for MOD_NAME in MOD_NAMES
+                    if os.path.exists(f'{MOD_REPO_DIR}/{MOD_NAME}/src/{MOD_NAME}_lib_exec.cc')]
+        if repo_build is None and not lib_exec:
+            return '', [f'add_subdirectory({MOD_NAME})' for MOD_NAME in MOD_NAMES]
         lines = []
-        for method_enum_name, method_info in self.sorted_methods:
-            method_off = method_info['val']
-            if method_off < 0:
+        for MOD_NAME in MOD_NAMES:
+            lines.append(f'add_subdirectory({MOD_NAME})')
+            if MOD_NAME in lib_exec:
+                lines.append(f'chi_module_lib_exec({MOD_NAME} {MOD_NAME})')
+            if repo_build is None:
                 continue
-            method_name = method_enum_name.replace('k', '', 1)
-            task_name = method_name + "Task"
-            tmpl = self.make_tmpl(tmpl_name, task_name, method_name, method_enum_name)
-            lines += [tmpl]
-        with open(new_path, 'w') as fp:
-            fp.write(''.join(lines))
+            mod_yaml = f'{MOD_REPO_DIR}/{MOD_NAME}/chimaera_mod.yaml'
+            mod_conf = load_yaml(mod_yaml) or {}
+            settings = build_settings(repo_build, mod_conf.get('build'), mod_yaml)
+            accelerate = accelerate_cmake(MOD_NAME, settings)
+            if accelerate is not None:
+                lines.append(accelerate)
+        build = REPO_TARGETS_CMAKE
+        if lib_exec:
+            build += REPO_LIB_EXEC_CMAKE
+        if repo_build is not None:
+            build += REPO_BUILD_CMAKE
+        return build, lines
 
     def clear_autogen_temp(self, MOD_REPO_DIR):
-        MOD_ROOTS = [os.path.join(MOD_REPO_DIR, item)
-                      for item in os.listdir(MOD_REPO_DIR)]
-        for MOD_ROOT in MOD_ROOTS:
-            self._clear_autogen_temp(MOD_ROOT)
+        """
+        Removes the temporary files and backups recorded in the artifact
+        manifest. Every module is also scanned for the ones the manifest
+        does not record, e.g., those of repos refreshed before it existed
+        or of refresh_mod_tasks.
+        """
+        with RepoLock(MOD_REPO_DIR), PROFILER.phase('clear_autogen_temp'):
+            artifacts = ArtifactManifest(MOD_REPO_DIR)
+            if artifacts.exists:
+                artifacts.clear()
+                artifacts.save()
+            MOD_ROOTS = [os.path.join(MOD_REPO_DIR, item)
+                          for item in os.listdir(MOD_REPO_DIR)]
+            for MOD_ROOT in MOD_ROOTS:
+                self._clear_autogen_temp(MOD_ROOT)
 
     def _clear_autogen_temp(self, MOD_ROOT):
         """
@@ -676,10 +515,3 @@ class ChimaeraCodegen:
                 os.remove(file_path)
             except FileNotFoundError:
                 pass
-
-    def make_tmpl(self, tmpl_str, task_name, method_name, method_enum_name):
-        tmpl = tmpl_str.replace('##task_name##', task_name) \
-            .replace('##method_name##', method_name) \
-            .replace('##method_enum_name##', method_enum_name)
-        tmpl = tmpl.strip() + '\n'
-        return tmpl
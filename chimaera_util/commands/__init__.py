@@ -0,0 +1,36 @@
+"""
+Subcommands of the chi entry point. Each module defines add_args(parser)
+and run(args), which returns the exit status. Modules are imported only
+when their command runs, so the dispatcher itself stays cheap to start.
+"""
+
+# name: (module, summary)
+COMMANDS = {
+    'make-repo': ('make_repo', 'create a module repository'),
+    'make-mod': ('make_mod', 'bootstrap a module from the module template'),
+    'refresh': ('refresh', 'regenerate the autogenerated code of a repo'),
+    'workspace': ('workspace', 'refresh every repo of a workspace in dependency order'),
+    'clear-temp': ('clear_temp', 'remove autogenerated temporary files'),
+    'verify': ('verify', 'detect hand-edited or stale generated files'),
+    'methods': ('methods', 'report method id density, compact ids'),
+    'make-macro': ('make_macro', 'embed files in a C/C++ header'),
+    'make-config': ('make_config', 'generate the default config headers'),
+    'reformat': ('reformat', 'migrate a repo to the current layout'),
+    'compile-time': ('compile_time', 'rank modules and headers by compile time'),
+    'compile-launcher': ('compile_launcher', 'compiler launcher that records compile times'),
+    'bench': ('bench', 'benchmark the codegen'),
+    'batch': ('batch', 'run many commands in one process'),
+}
+
+# The names of the original bin/ scripts
+ALIASES = {
+    'make_repo': 'make-repo',
+    'make_mod': 'make-mod',
+    'refresh_repo': 'refresh',
+    'refresh-repo': 'refresh',
+    'clear_temp': 'clear-temp',
+    'make_macro': 'make-macro',
+    'make_config': 'make-config',
+    'repo_reformat': 'reformat',
+    'repo-reformat': 'reformat',
+}
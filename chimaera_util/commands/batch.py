@@ -0,0 +1,66 @@
+"""
+USAGE: chi batch <FILE|-> [--keep-going] [--profile PATH]
+
+Runs the chi commands listed in FILE (or stdin) in this process, one per
+line, e.g.
+
+    make-repo /repos/mods example
+    make-mod /repos/mods/compress
+    refresh /repos/mods -j 4
+    make-macro kernel.bin -o kernel.h --mode bytes
+
+Lines are split like a shell command line; blank lines and lines
+starting with # are skipped. Loaded state (imported modules, parsed
+configs, the codegen version) is shared by every command. Stops at the
+first failing command unless --keep-going is given.
+"""
+
+import shlex
+import sys
+from chimaera_util.util.cli import add_profile_args, profiled
+
+
+def add_args(parser):
+    parser.add_argument('FILE', help='command file, or - for stdin')
+    parser.add_argument('-k', '--keep-going', action='store_true',
+                        help='run the remaining commands after a failure')
+    add_profile_args(parser)
+
+
+def read_commands(FILE):
+    """
+    Returns the (line number, argv) of each command in FILE.
+    """
+    if FILE == '-':
+        text = sys.stdin.read()
+    else:
+        with open(FILE) as fp:
+            text = fp.read()
+    commands = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        argv = shlex.split(line, comments=True)
+        if argv:
+            commands.append((lineno, argv))
+    return commands
+
+
+def run(args):
+    from chimaera_util.chi import run_command
+    failed = 0
+    with profiled(args):
+        for lineno, argv in read_commands(args.FILE):
+            if argv[0] == 'batch':
+                print(f'{args.FILE}:{lineno}: batch files cannot run batch')
+                status = 2
+            else:
+                try:
+                    status = run_command(argv[0], argv[1:])
+                except Exception as e:
+                    print(f'{type(e).__name__}: {e}')
+                    status = 1
+            if status != 0:
+                failed += 1
+                print(f'{args.FILE}:{lineno}: {shlex.join(argv)} exited with {status}')
+                if not args.keep_going:
+                    return status
+    return 1 if failed else 0
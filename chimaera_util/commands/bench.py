@@ -0,0 +1,61 @@
+"""
+USAGE: chi bench [--mods 4,16] [--methods 10,100] [--filler 20]
+                 [--cases refresh_warm,...] [--repeat 3] [-j N]
+                 [--output results.json]
+                 [--baseline old.json] [--threshold 1.25] [--min-delta 0.005]
+
+Benchmarks the codegen entry points on synthetic module repositories.
+Every combination of --mods, --methods and --filler is run. With
+--baseline, exits non-zero if any case's median got slower than
+threshold x the baseline median (and by at least min-delta seconds).
+"""
+
+import tempfile
+from chimaera_util.bench import CodegenBench, compare_to_baseline, save_report, load_report
+from chimaera_util.util.cli import add_profile_args, profiled
+
+
+def int_list(text):
+    return [int(x) for x in text.split(',')]
+
+
+def add_args(parser):
+    parser.add_argument('--mods', type=int_list, default=[4, 16])
+    parser.add_argument('--methods', type=int_list, default=[10, 100])
+    parser.add_argument('--filler', type=int_list, default=[20])
+    parser.add_argument('--cases', type=lambda text: text.split(','),
+                        default=CodegenBench.CASES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('--work-dir', default=None)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--threshold', type=float, default=1.25)
+    parser.add_argument('--min-delta', type=float, default=0.005)
+    add_profile_args(parser)
+
+
+def run(args):
+    for case in args.cases:
+        if case not in CodegenBench.CASES:
+            print(f'Unknown case {case}, expected one of {CodegenBench.CASES}')
+            return 1
+
+    with profiled(args), tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        bench = CodegenBench(work_dir, repeat=args.repeat, jobs=args.jobs,
+                             cases=args.cases)
+        bench.run(args.mods, args.methods, args.filler)
+    report = bench.report()
+    if args.output:
+        save_report(report, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(report['results'], load_report(args.baseline),
+                                          args.threshold, args.min_delta)
+        for result, old in regressions:
+            print(f"REGRESSION {result['case']} mods={result['mods']} "
+                  f"methods={result['methods']} filler={result['filler']}: "
+                  f"{old['median'] * 1e3:.2f}ms -> {result['median'] * 1e3:.2f}ms")
+        if regressions:
+            return 1
+    return 0
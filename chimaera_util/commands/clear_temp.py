@@ -0,0 +1,16 @@
+"""
+USAGE: chi clear-temp [MOD_REPO_DIR] [--profile PATH]
+"""
+
+from chimaera_util.util.cli import add_profile_args, profiled, get_codegen
+
+
+def add_args(parser):
+    parser.add_argument('MOD_REPO_DIR')
+    add_profile_args(parser)
+
+
+def run(args):
+    with profiled(args):
+        get_codegen().clear_autogen_temp(args.MOD_REPO_DIR)
+    return 0
@@ -0,0 +1,28 @@
+"""
+USAGE: chi compile-launcher OUT_DIR MODULE -- COMPILER ARGS...
+
+Compiler launcher used by repos built with time_trace (see the build:
+section of chimaera_repo.yaml). Runs the compiler, then records its wall
+time, the headers in its depfile and, with Clang, its -ftime-trace in
+OUT_DIR. Exits with the status of the compiler.
+"""
+
+import argparse
+
+
+def add_args(parser):
+    parser.add_argument('OUT_DIR')
+    parser.add_argument('MODULE')
+    parser.add_argument('COMMAND', nargs=argparse.REMAINDER,
+                        help='the compiler command, after --')
+
+
+def run(args):
+    from chimaera_util.util.compile_times import record_compile
+    command = args.COMMAND
+    if command and command[0] == '--':
+        command = command[1:]
+    if not command:
+        print('chi compile-launcher: no compiler command given')
+        return 2
+    return record_compile(args.OUT_DIR, args.MODULE, command)
@@ -0,0 +1,42 @@
+"""
+USAGE: chi compile-time [BUILD_DIR|TIMES_DIR] [--top N] [--json PATH]
+
+Reports the compile times recorded by chi compile-launcher in a build of
+a repo with time_trace enabled. Modules, translation units and headers
+are ranked by compile time, with the generated headers (*_lib_exec.h,
+*_methods.h, *_tasks.h, *_client.h) ranked separately. With Clang, a
+header costs the time spent parsing it; with GCC, the compile time of
+the TUs that include it.
+"""
+
+import json
+import os
+
+
+def add_args(parser):
+    parser.add_argument('DIR', nargs='?', default=None,
+                        help='the build directory or its chi_compile_times directory')
+    parser.add_argument('--top', type=int, default=10,
+                        help='entries shown per ranking (default 10)')
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the full report as JSON to PATH')
+
+
+def run(args):
+    from chimaera_util.util.compile_times import CompileReport, load_records
+    out_dir = args.DIR or os.getcwd()
+    if os.path.isdir(os.path.join(out_dir, 'chi_compile_times')):
+        out_dir = os.path.join(out_dir, 'chi_compile_times')
+    if not os.path.isdir(out_dir):
+        print(f'{out_dir} has no compile times; build a repo with '
+              f'build: {{time_trace: true}} in its chimaera_repo.yaml first')
+        return 1
+    report = CompileReport(load_records(out_dir))
+    if not report.records:
+        print(f'No compile times recorded in {out_dir}')
+        return 1
+    print(report.format(args.top))
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(report.to_dict(), fp, indent=2)
+    return 0
@@ -0,0 +1,24 @@
+"""
+USAGE: chi make-config [CHI_ROOT (optional)] [--binary] [--profile PATH]
+
+OUTPUT:
+    ${CHI}/src/config_client_default.h (if client)
+    ${CHI}/src/config_server_default.h (if server)
+    config_*_default_bin.h alongside them (with --binary)
+"""
+
+import os
+from chimaera_util.util.cli import add_profile_args, profiled, get_codegen
+
+
+def add_args(parser):
+    parser.add_argument('CHI_ROOT', nargs='?', default=None)
+    parser.add_argument('--binary', action='store_true',
+                        help='also emit the configs as pre-parsed binary blobs')
+    add_profile_args(parser)
+
+
+def run(args):
+    with profiled(args):
+        get_codegen().make_configs(args.CHI_ROOT or os.getcwd(), binary=args.binary)
+    return 0
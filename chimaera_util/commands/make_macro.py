@@ -0,0 +1,31 @@
+"""
+USAGE: chi make-macro PATH [PATH ...] [-o OUTPUT] [--mode macro|string|bytes|embed]
+                      [--profile PATH]
+
+Embeds each file in a C/C++ header, named after the file in caps.
+Without -o, the result is printed. macro (the default) is a #define of
+the lines of a text file. string and bytes embed any file, binary or
+not, as an escaped string literal or a byte array. embed uses #embed
+when the compiler supports it and the byte array otherwise.
+"""
+
+from chimaera_util.util.embed import EMBED_MODES
+from chimaera_util.util.cli import add_profile_args, profiled, get_codegen
+
+
+def add_args(parser):
+    parser.add_argument('PATHS', nargs='+')
+    parser.add_argument('-o', '--output',
+                        help='header to write; only rewritten if it changes')
+    parser.add_argument('--mode', choices=EMBED_MODES, default='macro')
+    add_profile_args(parser)
+
+
+def run(args):
+    with profiled(args):
+        gen = get_codegen()
+        if len(args.PATHS) == 1 and args.output is None and args.mode == 'macro':
+            gen.make_macro(args.PATHS[0])
+        else:
+            gen.make_macros(args.PATHS, args.output, args.mode)
+    return 0
@@ -0,0 +1,77 @@
+"""
+USAGE: chi make-mod [MODULE_ROOT ...] [--manifest FILE] [--template DIR]
+                    [--on-exists prompt|skip|overwrite|error] [-j N]
+                    [--refresh] [--profile PATH]
+
+MODULE_ROOT is the path to the module. The mod
+should be within a module repo.
+--manifest bootstraps every module listed in a YAML manifest, optionally
+with their initial methods:
+
+    repo: mods            # relative to the manifest, default: its dir
+    template: ~/.chimaera/MOD_NAME
+    modules:
+      - compress
+      - name: encrypt
+        methods: [kEncrypt, kDecrypt]
+      - name: stats
+        methods: {kCollect: 10, kReport: null}
+
+--on-exists decides what to do with a module that is already
+bootstrapped. prompt (the default) asks, and fails if there is no
+terminal to ask on. --refresh refreshes the repo afterwards, so that
+the methods of the new modules are generated.
+"""
+
+import os
+import sys
+from chimaera_util.util.paths import CHIMAERA_TASK_TEMPL
+from chimaera_util.util.scaffold import ON_EXISTS, ModSpec, load_mod_manifest
+from chimaera_util.util.cli import add_profile_args, profiled, get_codegen
+
+
+def add_args(parser):
+    parser.add_argument('MOD_ROOTS', nargs='*', metavar='MOD_ROOT')
+    parser.add_argument('--manifest', help='YAML file listing the modules to create')
+    parser.add_argument('--template', default=None,
+                        help=f'module template (default: {CHIMAERA_TASK_TEMPL})')
+    parser.add_argument('--on-exists', choices=ON_EXISTS, default='prompt',
+                        help='policy for modules that are already bootstrapped')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of threads writing files (0 = all cores)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='refresh the repo after bootstrapping')
+    add_profile_args(parser)
+
+
+def run(args):
+    # (repo, template) -> specs
+    groups = {}
+    if args.manifest:
+        MOD_REPO_DIR, templ_dir, specs = load_mod_manifest(args.manifest)
+        templ_dir = args.template or templ_dir or CHIMAERA_TASK_TEMPL
+        groups.setdefault((MOD_REPO_DIR, templ_dir), []).extend(specs)
+    for MOD_ROOT in args.MOD_ROOTS:
+        MOD_ROOT = os.path.abspath(MOD_ROOT)
+        key = (os.path.dirname(MOD_ROOT), args.template or CHIMAERA_TASK_TEMPL)
+        groups.setdefault(key, []).append(ModSpec(os.path.basename(MOD_ROOT)))
+    if not groups:
+        print('Nothing to do: give MODULE_ROOTs or --manifest', file=sys.stderr)
+        return 2
+
+    with profiled(args):
+        gen = get_codegen()
+        for (MOD_REPO_DIR, templ_dir), specs in groups.items():
+            try:
+                made = gen.make_mods(MOD_REPO_DIR, specs, templ_dir,
+                                     on_exists=args.on_exists, jobs=args.jobs)
+            except FileExistsError as e:
+                print(e, file=sys.stderr)
+                return 1
+            if len(specs) > 1:
+                print(f'Bootstrapped {len(made)} of {len(specs)} modules in {MOD_REPO_DIR}')
+            if args.refresh and made:
+                results = gen.refresh_repo(MOD_REPO_DIR, jobs=args.jobs)
+                if any(result.status == 'failed' for result in results):
+                    return 1
+    return 0
@@ -0,0 +1,21 @@
+"""
+USAGE: chi make-repo [MOD_REPO_DIR] [MOD_NAMESPACE] [--profile PATH]
+
+MOD_REPO_DIR is the path to the module repo.
+MOD_NAMESPACE is the namespace of the module. This
+translates to a cmake project name and install namespace.
+"""
+
+from chimaera_util.util.cli import add_profile_args, profiled, get_codegen
+
+
+def add_args(parser):
+    parser.add_argument('MOD_REPO_DIR')
+    parser.add_argument('MOD_NAMESPACE')
+    add_profile_args(parser)
+
+
+def run(args):
+    with profiled(args):
+        get_codegen().make_repo(args.MOD_REPO_DIR, args.MOD_NAMESPACE)
+    return 0
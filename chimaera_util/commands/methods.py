@@ -0,0 +1,67 @@
+"""
+USAGE: chi methods <MOD_ROOT|MOD_REPO_DIR> [--assign] [--renumber] [--compact]
+
+Reports the method ids of a module, or of every module in a repo: how
+many there are, kCount, the unused ids below the highest one (and the
+retired methods that reserve them), and how densely the ids are used.
+Methods defined without an id (kFoo: null) are shown with the id they
+would be assigned.
+--assign writes the ids of those methods into the methods yaml. A
+refresh fails on methods without an id unless the module sets the abi
+codegen option, which records their ids in MOD_NAME_methods.abi.yaml.
+--renumber accepts ids changed by hand in the methods yaml, which a
+refresh rejects once they are recorded in MOD_NAME_methods.abi.yaml.
+--compact renumbers the ids from 10 up without gaps, keeping their
+order, and rewrites the methods yaml. With the abi codegen option, it
+starts a new abi_version in MOD_NAME_methods.abi.yaml. Run chi refresh
+afterwards.
+"""
+
+import os
+from chimaera_util.util.output import RepoLock
+
+
+def add_args(parser):
+    parser.add_argument('path')
+    parser.add_argument('--compact', action='store_true',
+                        help='renumber the ids densely (changes the ABI of the module)')
+    parser.add_argument('--assign', action='store_true',
+                        help='write the ids of methods defined without one into the methods yaml')
+    parser.add_argument('--renumber', action='store_true',
+                        help='accept published ids changed by hand (changes the ABI of the module)')
+
+
+def run(args):
+    from chimaera_util.module import ModuleCodegen
+    path = os.path.abspath(args.path)
+    if os.path.exists(os.path.join(path, 'chimaera_mod.yaml')):
+        MOD_ROOTS = [path]
+        MOD_REPO_DIR = os.path.dirname(path)
+    else:
+        MOD_ROOTS = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                     if os.path.exists(os.path.join(path, name, 'include', name,
+                                                    f'{name}_methods.yaml'))]
+        MOD_REPO_DIR = path
+    status = 0
+    with RepoLock(MOD_REPO_DIR):
+        for MOD_ROOT in MOD_ROOTS:
+            mod = ModuleCodegen(MOD_ROOT, None)
+            try:
+                if args.compact or args.assign or args.renumber:
+                    mod.resolve_method_ids(mod.read_method_defs(), compact=args.compact,
+                                           assign=args.assign or args.compact,
+                                           renumber=args.renumber)
+                count, kcount, gaps, density = mod.method_id_report()
+            except Exception as e:
+                print(f'[{mod.mod_name}] FAILED: {type(e).__name__}: {e}')
+                status = 1
+                continue
+            for msg in mod.messages:
+                print(f'[{mod.mod_name}] {msg}')
+            print(f'[{mod.mod_name}] {count} methods, kCount {kcount}, '
+                  f'{density:.0%} dense')
+            if gaps:
+                print(f'[{mod.mod_name}] unused ids: ' + ', '.join(
+                    f'{method_id} (retired {name})' if name else str(method_id)
+                    for method_id, name in gaps))
+    return status
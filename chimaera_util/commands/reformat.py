@@ -0,0 +1,34 @@
+"""
+USAGE: chi reformat <repo_path> [--dry-run] [-j N] [--profile PATH]
+
+Migrates the modules of a repo to the current file names. Every change
+is planned before any is made; only files whose contents change are
+written. --dry-run prints the files, bytes and renames the migration
+would make without changing anything.
+"""
+
+import os
+from chimaera_util.util.cli import add_profile_args, profiled
+
+
+def add_args(parser):
+    parser.add_argument('repo_path')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report the changes without making them')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of modules planned and migrated at once (0 = all cores)')
+    add_profile_args(parser)
+
+
+def run(args):
+    from chimaera_util.reformat import RepoReformat
+    repo_path = args.repo_path
+    if not os.path.exists(repo_path):
+        print(f"Invalid path: {repo_path}")
+        return 1
+
+    with profiled(args):
+        reformat = RepoReformat(repo_path, jobs=args.jobs, dry_run=args.dry_run)
+        reformat.process()
+    print("Done")
+    return 0
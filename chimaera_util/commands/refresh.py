@@ -0,0 +1,58 @@
+"""
+USAGE: chi refresh [MOD_REPO_DIR] [--force] [-j N] [--dispatch switch|table]
+                   [--lib-exec header|source]
+                   [--profile PATH] [--profile-format json|chrome]
+                   [--cprofile PATH] [--watch [--debounce SEC] [--poll]]
+
+Modules whose inputs are unchanged since the last refresh are skipped.
+--force regenerates every module regardless. -j refreshes modules in
+N worker processes (0 uses every core). --dispatch selects how the
+*_lib_exec.h dispatch functions are generated for modules that do not
+set codegen: {dispatch: ...} in their *_methods.yaml.
+--lib-exec source compiles the dispatch functions that do not call the
+module's methods once per module in a generated src/*_lib_exec.cc.
+--watch stays running after the refresh and regenerates a module
+whenever its methods yaml, tasks.h, client.h or runtime.cc changes.
+"""
+
+from chimaera_util.util.dispatch import DISPATCH_MODES, LIB_EXEC_MODES
+from chimaera_util.util.cli import add_profile_args, profiled, get_codegen
+
+
+def add_args(parser):
+    parser.add_argument('MOD_REPO_DIR')
+    parser.add_argument('--force', action='store_true',
+                        help='refresh every module, ignoring the manifest')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (0 = all cores)')
+    parser.add_argument('--dispatch', choices=DISPATCH_MODES,
+                        help='default dispatch strategy for *_lib_exec.h')
+    parser.add_argument('--lib-exec', choices=LIB_EXEC_MODES,
+                        help='where the dispatch functions are compiled (default header)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and regenerate modules as they change')
+    parser.add_argument('--debounce', type=float, default=0.2,
+                        help='seconds of quiet before regenerating (default 0.2)')
+    parser.add_argument('--poll', action='store_true',
+                        help='poll for changes instead of using inotify')
+    add_profile_args(parser)
+
+
+def run(args):
+    options = {}
+    if args.dispatch is not None:
+        options['dispatch'] = args.dispatch
+    if args.lib_exec is not None:
+        options['lib_exec'] = args.lib_exec
+    if args.watch:
+        from chimaera_util.watch import RepoWatcher
+        with profiled(args):
+            RepoWatcher(args.MOD_REPO_DIR, options, debounce=args.debounce,
+                        poll=args.poll).run(force=args.force, jobs=args.jobs)
+        return 0
+    with profiled(args):
+        results = get_codegen().refresh_repo(args.MOD_REPO_DIR, force=args.force,
+                                             jobs=args.jobs, options=options)
+    if any(result.status == 'failed' for result in results):
+        return 1
+    return 0
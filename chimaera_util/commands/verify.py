@@ -0,0 +1,31 @@
+"""
+USAGE: chi verify [MOD_REPO_DIR] [--profile PATH]
+
+Checks the generated files of a repo against the artifact manifest
+written by chi refresh, without regenerating anything. Reports files
+that were edited by hand (modified) or deleted (missing), and modules
+whose inputs changed since their last refresh (stale). Exits with 1
+if anything was reported.
+"""
+
+from chimaera_util.util.cli import add_profile_args, profiled, get_codegen
+
+
+def add_args(parser):
+    parser.add_argument('MOD_REPO_DIR')
+    add_profile_args(parser)
+
+
+def run(args):
+    with profiled(args):
+        problems = get_codegen().verify_repo(args.MOD_REPO_DIR)
+    if problems is None:
+        print(f'{args.MOD_REPO_DIR} has no artifact manifest; run chi refresh first')
+        return 1
+    for status, path in problems:
+        print(f'{status:<9} {path}')
+    if problems:
+        print(f'{len(problems)} problems')
+        return 1
+    print('All generated files are up to date')
+    return 0
@@ -0,0 +1,54 @@
+"""
+USAGE: chi workspace [WORKSPACE] [--force] [-j N] [--dispatch switch|table]
+                     [--lib-exec header|source]
+                     [--no-configs] [--binary] [--profile PATH]
+
+Refreshes every repo listed in a workspace file (chimaera_workspace.yaml
+in the current directory by default) in dependency order, and generates
+the default configs of its configs entries. With -j N, repos whose
+dependencies are done are refreshed concurrently and their modules
+share N worker processes (0 uses every core). A repo is not refreshed
+if a repo it depends on failed. Prints the log of each repo followed by
+a combined summary.
+"""
+
+import os
+from chimaera_util.util.dispatch import DISPATCH_MODES, LIB_EXEC_MODES
+from chimaera_util.util.cli import add_profile_args, profiled
+
+
+def add_args(parser):
+    parser.add_argument('WORKSPACE', nargs='?', default=None,
+                        help='workspace file, or the directory that holds it')
+    parser.add_argument('--force', action='store_true',
+                        help='refresh every module, ignoring the manifests')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes (0 = all cores)')
+    parser.add_argument('--dispatch', choices=DISPATCH_MODES,
+                        help='default dispatch strategy for *_lib_exec.h')
+    parser.add_argument('--lib-exec', choices=LIB_EXEC_MODES,
+                        help='where the dispatch functions are compiled (default header)')
+    parser.add_argument('--no-configs', action='store_true',
+                        help='do not generate the configs of the workspace')
+    parser.add_argument('--binary', action='store_true',
+                        help='also emit every config as a pre-parsed binary blob')
+    add_profile_args(parser)
+
+
+def run(args):
+    from chimaera_util.workspace import Workspace, print_workspace_results
+    options = {}
+    if args.dispatch is not None:
+        options['dispatch'] = args.dispatch
+    if args.lib_exec is not None:
+        options['lib_exec'] = args.lib_exec
+    with profiled(args):
+        workspace = Workspace.load(args.WORKSPACE or os.getcwd())
+        repo_results, config_results = workspace.refresh(
+            force=args.force, jobs=args.jobs, options=options,
+            configs=not args.no_configs, binary=args.binary)
+    print_workspace_results(repo_results, config_results)
+    if any(result.status != 'refreshed' for result in repo_results) or \
+            any(result.error is not None for result in config_results):
+        return 1
+    return 0
@@ -0,0 +1,474 @@
+"""
+Per-module code generation. All state produced while refreshing a module
+lives on a ModuleCodegen instance, so modules can be refreshed
+independently (and in parallel) without sharing a ChimaeraCodegen.
+"""
+
+import os
+from chimaera_util.util.templates import task_template, client_method_template, runtime_method_template
+from chimaera_util.util.output import write_if_changed, write_lines_if_changed
+from chimaera_util.util.artifacts import Artifact
+from chimaera_util.util.config import load_yaml
+from chimaera_util.util.markers import MarkerIndex, AUTOGEN_MARKER
+from chimaera_util.util.edit_buffer import EditBuffer
+from chimaera_util.util.dispatch import LIB_EXEC_FNS, BATCH_FNS, DISPATCH_MODES, \
+    LIB_EXEC_MODES, LIB_EXEC_CC_BANNER, render_dispatch_fn, render_batch_fn, \
+    render_free_fn, render_forward_fn, render_stats_table, lib_exec_context
+from chimaera_util.util.profile import PROFILER
+from chimaera_util.util.template_engine import method_template
+from chimaera_util.util.method_ids import AbiMap, allocate_ids, update_abi, \
+    compact_ids, id_report, set_ids, split_method_defs
+from chimaera_util.util.method_table import MethodTable
+
+# Codegen options. These can be set for a whole refresh (e.g., on the
+# chi_refresh_repo command line) and overridden per module under the
+# "codegen" key of MOD_NAME_methods.yaml.
+DEFAULT_OPTIONS = {
+    'dispatch': 'switch',
+    'lib_exec': 'header',
+    'abi': False,
+}
+
+
+class ModuleResult:
+    """
+    The outcome of refreshing one module. Picklable so it can be returned
+    from a worker process.
+    """
+
+    def __init__(self, mod_name, status, messages=None, error=None):
+        self.mod_name = mod_name
+        self.status = status
+        self.messages = messages or []
+        self.error = error
+        self.profile = None
+        self.artifacts = []
+
+
+def refresh_module(MOD_ROOT, namespace, options=None, profile=False):
+    """
+    Refreshes a single module and captures its log and any error.
+    This is the unit of work handed to the process pool. With profile,
+    the module's profile is recorded separately and returned in the
+    result so the parent process can merge it.
+    """
+    if profile:
+        PROFILER.reset(enabled=True)
+    mod_name = os.path.basename(MOD_ROOT)
+    mod = ModuleCodegen(MOD_ROOT, namespace, options)
+    try:
+        mod.refresh()
+        result = ModuleResult(mod_name, 'refreshed', mod.messages)
+    except Exception as e:
+        result = ModuleResult(mod_name, 'failed', mod.messages,
+                              f'{type(e).__name__}: {e}')
+    result.artifacts = mod.artifacts
+    if profile:
+        result.profile = PROFILER.drain()
+    return result
+
+
+class ModuleCodegen:
+    def __init__(self, MOD_ROOT, namespace, options=None):
+        self.MOD_ROOT = MOD_ROOT
+        self.namespace = namespace
+        self.options = dict(DEFAULT_OPTIONS)
+        self.options.update(options or {})
+        self.mod_name = os.path.basename(MOD_ROOT)
+        self.messages = []
+        self.marker_indexes = {}
+        self.artifacts = []
+        self.method_flags = {}
+        self.methods = None
+
+        #Create paths
+        MOD_NAME = self.mod_name
+        self.METHODS_YAML = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.yaml'
+        self.METHODS_ABI_YAML = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.abi.yaml'
+        self.COMPILED_METHODS_YAML = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.compiled.yaml'
+        self.METHODS_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.h'
+        self.METHOD_MACRO = f'CHI_{MOD_NAME.upper()}_METHODS_H_'
+        self.LIB_EXEC_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_lib_exec.h'
+        self.LIB_EXEC_MACRO = f'CHI_{MOD_NAME.upper()}_LIB_EXEC_H_'
+        self.LIB_EXEC_CC = f'{MOD_ROOT}/src/{MOD_NAME}_lib_exec.cc'
+        self.LIB_EXEC_PREFIX = f'{MOD_NAME}_lib_exec_'
+        self.OLD_TASKS_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_tasks.h'
+        self.NEW_TASKS_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_tasks.temp_h'
+        self.OLD_CLIENT_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_client.h'
+        self.NEW_CLIENT_H = f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_client.temp_h'
+        self.OLD_RUNTIME_CC = f'{MOD_ROOT}/src/{MOD_NAME}_runtime.cc'
+        self.NEW_RUNTIME_CC = f'{MOD_ROOT}/src/{MOD_NAME}_runtime.temp_cc'
+
+    def log(self, msg):
+        self.messages.append(msg)
+
+    def write_artifact(self, path, text, kind='generated'):
+        """
+        Writes a generated file and records it in self.artifacts.
+        """
+        data = text.encode()
+        write_if_changed(path, data)
+        self.artifacts.append(Artifact(path, kind, data))
+
+    def stream_artifact(self, path, lines, kind='generated'):
+        """
+        Streams the lines of an emitter into a generated file and records
+        it in self.artifacts.
+        """
+        size, sha1 = write_lines_if_changed(path, lines)
+        self.artifacts.append(Artifact(path, kind, size=size, sha1=sha1))
+
+    def refresh(self):
+        """
+        Refreshes autogenerated code in the task.
+        """
+        with PROFILER.module(self.mod_name), PROFILER.phase('refresh_mod'):
+            # Load methods and their compiled status
+            self.get_method_compile_status()
+
+            # Refresh the files
+            with PROFILER.phase('refresh_methods_h'):
+                self.refresh_methods_h()
+            with PROFILER.phase('refresh_lib_exec_h'):
+                self.refresh_lib_exec_h()
+            with PROFILER.phase('refresh_tasks_h'):
+                self.refresh_tasks_h()
+            with PROFILER.phase('refresh_client_h'):
+                self.refresh_client_h()
+            with PROFILER.phase('refresh_runtime_cc'):
+                self.refresh_runtime_cc()
+
+            # Save compiled methods
+            with PROFILER.phase('save_compile_status'):
+                self.save_method_compile_staus()
+
+    def load_method_defs(self):
+        method_defs = self.read_method_defs()
+        if self.options['dispatch'] not in DISPATCH_MODES:
+            raise ValueError(f"Unknown dispatch mode {self.options['dispatch']}, "
+                             f"expected one of {DISPATCH_MODES}")
+        if self.options['lib_exec'] not in LIB_EXEC_MODES:
+            raise ValueError(f"Unknown lib_exec mode {self.options['lib_exec']}, "
+                             f"expected one of {LIB_EXEC_MODES}")
+        self.method_defs = self.resolve_method_ids(method_defs)
+
+    def read_method_defs(self):
+        """
+        The methods yaml as {method name: id or None}. Codegen options
+        set in it are applied to self.options, and per-method flags
+        (e.g., batchable) are stored in self.method_flags.
+        """
+        method_defs = load_yaml(self.METHODS_YAML)
+        if method_defs is None:
+            method_defs = {}
+        self.options.update(method_defs.pop('codegen', None) or {})
+        if not isinstance(self.options['abi'], bool):
+            raise ValueError(f"codegen abi must be true or false, not {self.options['abi']!r}")
+        method_defs, self.method_flags = split_method_defs(method_defs)
+        return method_defs
+
+    def load_abi(self):
+        """
+        The AbiMap of the module if the abi option is set, else None.
+        """
+        if not self.options['abi']:
+            return None
+        return AbiMap.load(self.METHODS_ABI_YAML)
+
+    def resolve_method_ids(self, method_defs, compact=False, assign=False, renumber=False):
+        """
+        Assigns ids to the methods defined without one and, with compact,
+        renumbers the ids from FIRST_METHOD_ID up densely. With assign or
+        compact, changed ids are written back to the methods yaml. With the
+        abi option, every id is recorded in the ABI map, and published ids
+        changed by hand are only accepted with renumber or compact. Without
+        either the abi option or assign, methods must have an id, as
+        nothing would keep the assigned ones stable. Returns
+        {method name: id}.
+        """
+        missing = [name for name, method_id in method_defs.items() if method_id is None]
+        if missing and not (self.options['abi'] or assign or compact):
+            raise ValueError(
+                f'Methods {missing} have no id; run chi methods --assign to write their '
+                f'ids into {os.path.basename(self.METHODS_YAML)}, or set '
+                f'codegen: {{abi: true}} to record them in '
+                f'{os.path.basename(self.METHODS_ABI_YAML)}')
+        abi = self.load_abi()
+        ids, changed = allocate_ids(method_defs, abi, self.METHODS_ABI_YAML,
+                                    renumber=renumber or compact)
+        if assign:
+            for method_name, method_id in changed.items():
+                self.log(f'Assigned method id {method_id} to {method_name}')
+        if compact:
+            moved = compact_ids(ids)
+            for method_name, method_id in moved.items():
+                self.log(f'Moved {method_name} from id {ids[method_name]} to {method_id}')
+            if moved or (abi is not None and abi.retired):
+                version = abi.version + 1 if abi is not None else 1
+                abi = AbiMap(version=version)
+            ids.update(moved)
+            changed.update(moved)
+        if changed and (assign or compact):
+            with open(self.METHODS_YAML) as fp:
+                methods_yaml = fp.read()
+            write_if_changed(self.METHODS_YAML, set_ids(methods_yaml, changed))
+        if self.options['abi']:
+            update_abi(abi, ids).save(self.METHODS_ABI_YAML, self.mod_name)
+        return ids
+
+    def method_id_report(self):
+        """
+        (count, kCount, gaps, density) of the module's ids, as they would
+        be after the next refresh. See method_ids.id_report.
+        """
+        method_defs = self.read_method_defs()
+        abi = self.load_abi()
+        ids, _ = allocate_ids(method_defs, abi, self.METHODS_ABI_YAML)
+        return id_report(ids, abi)
+
+    def marker_index(self, path):
+        """
+        The MarkerIndex of path. Built on first use and shared by every
+        refresh stage of this module until the file is rewritten.
+        """
+        index = self.marker_indexes.get(path)
+        if index is None:
+            index = MarkerIndex.from_file(path)
+            self.marker_indexes[path] = index
+        return index
+
+    def scan_compiled_tasks(self):
+        """
+        The task names already in tasks.h, in the order they appear.
+        """
+        if not os.path.exists(self.OLD_TASKS_H):
+            return []
+        with PROFILER.phase('scan_compiled_tasks'):
+            return self.marker_index(self.OLD_TASKS_H).task_names
+
+    def save_method_compile_staus(self):
+        self.stream_artifact(self.COMPILED_METHODS_YAML,
+                             (entry.compile_status() for entry in self.methods))
+
+    def get_method_compile_status(self):
+        """
+        Builds self.methods, the MethodTable of the module.
+        """
+        self.load_method_defs()
+        self.methods = MethodTable.build(
+            self.method_defs, self.scan_compiled_tasks(), self.method_flags)
+
+    def emit_methods_h(self):
+        yield f'#ifndef {self.METHOD_MACRO}'
+        yield f'#define {self.METHOD_MACRO}'
+        yield ''
+        yield '/** The set of methods in the admin task */'
+        yield 'struct Method : public TaskMethod {'
+        for entry in self.methods:
+            if entry.id < 10:
+                continue
+            yield f'  TASK_METHOD_T {entry.enum_name} = {entry.id};'
+        # kCount is one past the highest id, so it only changes with the
+        # ids above; a header of its own would not spare any rebuild
+        yield f'  TASK_METHOD_T kCount = {self.methods.count()};'
+        yield '};'
+        yield ''
+        yield f'#endif  // {self.METHOD_MACRO}'
+
+    def emit_lib_exec_h(self):
+        yield f'#ifndef {self.LIB_EXEC_MACRO}'
+        yield f'#define {self.LIB_EXEC_MACRO}'
+        yield ''
+        methods = self.methods.dispatched()
+        if self.options['lib_exec'] == 'source':
+            yield from self.emit_lib_exec_h_forwards(methods)
+        else:
+            yield from render_stats_table()
+            for fn in LIB_EXEC_FNS:
+                yield from render_dispatch_fn(fn, methods, self.options['dispatch'])
+            batchable = self.methods.flagged('batchable')
+            if batchable:
+                for fn in BATCH_FNS:
+                    yield from render_batch_fn(fn, batchable)
+        yield ''
+        yield f'#endif  // {self.LIB_EXEC_MACRO}'
+
+    def emit_lib_exec_h_forwards(self, methods):
+        """
+        The lib_exec: source header. Run and Monitor call the methods of
+        the runtime class, so they are dispatched here. The others forward
+        to MOD_NAME_lib_exec.cc.
+        """
+        source = os.path.basename(self.LIB_EXEC_CC)
+        yield from render_stats_table()
+        for fn in LIB_EXEC_FNS:
+            if fn.decl is None:
+                yield from render_dispatch_fn(fn, methods, self.options['dispatch'])
+            else:
+                yield from render_forward_fn(fn, self.LIB_EXEC_PREFIX, source)
+        if self.methods.flagged('batchable'):
+            for fn in BATCH_FNS:
+                yield from render_forward_fn(fn, self.LIB_EXEC_PREFIX, source)
+
+    def emit_lib_exec_cc(self):
+        """
+        MOD_NAME_lib_exec.cc: the dispatch functions that do not need the
+        runtime class, as free functions in its namespace.
+        """
+        includes, namespaces = lib_exec_context(
+            self.marker_index(self.OLD_RUNTIME_CC).text, os.path.basename(self.LIB_EXEC_H))
+        yield LIB_EXEC_CC_BANNER
+        yield from includes
+        yield ''
+        for namespace in namespaces:
+            yield f'namespace {namespace} {{'
+        yield ''
+        methods = self.methods.dispatched()
+        for fn in LIB_EXEC_FNS:
+            if fn.decl is not None:
+                yield from render_free_fn(fn, methods, self.options['dispatch'],
+                                          self.LIB_EXEC_PREFIX)
+                yield ''
+        batchable = self.methods.flagged('batchable')
+        if batchable:
+            for fn in BATCH_FNS:
+                yield from render_batch_fn(fn, batchable, self.LIB_EXEC_PREFIX)
+                yield ''
+        for namespace in reversed(namespaces):
+            yield f'}}  // namespace {namespace}'
+
+    def refresh_methods_h(self):
+        self.stream_artifact(self.METHODS_H, self.emit_methods_h())
+
+    def refresh_lib_exec_h(self):
+        if self.options['lib_exec'] == 'source':
+            self.stream_artifact(self.LIB_EXEC_CC, self.emit_lib_exec_cc())
+        else:
+            self.remove_lib_exec_cc()
+        self.stream_artifact(self.LIB_EXEC_H, self.emit_lib_exec_h())
+
+    def remove_lib_exec_cc(self):
+        """
+        Removes the MOD_NAME_lib_exec.cc generated by a lib_exec: source
+        refresh, so it is not built alongside the header dispatch.
+        """
+        try:
+            with open(self.LIB_EXEC_CC) as fp:
+                generated = fp.readline().rstrip('\n') == LIB_EXEC_CC_BANNER
+        except FileNotFoundError:
+            return
+        if generated:
+            os.remove(self.LIB_EXEC_CC)
+            self.log(f'Removed {os.path.basename(self.LIB_EXEC_CC)} (lib_exec: header)')
+
+    def refresh_tasks_h(self):
+        self.correct_lib_name()
+        self.refresh_method_try_modes(
+            self.OLD_TASKS_H, 
+            self.NEW_TASKS_H, task_template)
+
+    def correct_lib_name(self):
+        content = self.marker_index(self.OLD_TASKS_H).text
+        # Replace lib_name_ with namespace_mod_name version
+        old_texts = [
+            f'lib_name_ = "{self.mod_name}"',
+            f'lib_name_ = "chimaera_{self.mod_name}"',
+        ]
+        new_text = f'lib_name_ = "{self.namespace}_{self.mod_name}"'
+        for old_text in old_texts:
+            if old_text in content:
+                self.log(f"Fixing lib_name_ from {self.mod_name} to {self.namespace}_{self.mod_name}")
+                content = content.replace(old_text, new_text)
+                write_if_changed(self.OLD_TASKS_H, content)
+                self.marker_indexes[self.OLD_TASKS_H] = MarkerIndex(content)
+
+    def refresh_client_h(self):
+        self.refresh_method_try_modes(
+            self.OLD_CLIENT_H, 
+            self.NEW_CLIENT_H, client_method_template)
+
+    def refresh_runtime_cc(self):
+        self.refresh_method_try_modes(
+            self.OLD_RUNTIME_CC, 
+            self.NEW_RUNTIME_CC, runtime_method_template)
+
+    def refresh_method_try_modes(self, orig_path, new_path, tmpl_name):
+        index = self.marker_index(orig_path)
+        self.edits = EditBuffer(index.lines)
+        self.tmpl_name = tmpl_name
+
+        # Insert based on macros. chi_ends are the CHI_END lines of the
+        # original file. anchors are the insert positions of new methods.
+        self.chi_ends = index.chi_ends
+        self.anchors = {}
+        for sorted_off, method in enumerate(self.methods):
+            self.sorted_off = sorted_off
+            self.method = method
+            if self.refresh_insert():
+                continue
+            if self.refresh_append():
+                continue
+
+        # Write edited data
+        if self.edits.has_edits():
+            write_if_changed(orig_path, self.edits.render())
+            del self.marker_indexes[orig_path]
+        elif AUTOGEN_MARKER not in self.chi_ends:
+            self.refresh_tmpfile(new_path, tmpl_name)
+
+    def get_method_name(self, sorted_off):
+        return self.methods[sorted_off].name
+
+    def refresh_insert(self):
+        """
+        Inserts non-compiled methods into the runtime
+        file at the ideal location
+        """
+        method = self.method
+        method.inserted = False
+        if method.id < 0 or method.compiled:
+            return False
+        # Find CHI_END tag to insert after, or the method inserted just before
+        prior_method_name = self.get_method_name(self.sorted_off - 1)
+        if prior_method_name in self.chi_ends:
+            anchor = self.chi_ends[prior_method_name] + 1
+        elif prior_method_name in self.anchors:
+            anchor = self.anchors[prior_method_name]
+        else:
+            return False
+        tmpl = self.make_tmpl(self.tmpl_name, method.task_name, method.name, method.enum_name)
+        self.edits.insert(anchor, '\n' + tmpl)
+        self.anchors[method.name] = anchor
+        method.compiled_tmp = True
+        method.inserted = True
+        return True
+
+    def refresh_append(self):
+        """
+        Appends non-compiled methods to the end of the
+        runtime and marks them compiled
+        """
+        method = self.method
+        if method.id < 0 or method.compiled or method.inserted:
+            return False
+        # Find CHI_AUTOGEN_METHODS tag and insert before
+        if AUTOGEN_MARKER not in self.chi_ends:
+            return False
+        tmpl = self.make_tmpl(self.tmpl_name, method.task_name, method.name, method.enum_name)
+        anchor = self.chi_ends[AUTOGEN_MARKER]
+        self.edits.insert(anchor, tmpl + '\n')
+        self.anchors[method.name] = anchor
+        method.compiled_tmp = True
+        return True
+
+    def refresh_tmpfile(self, new_path, tmpl_name):
+        """
+        Generates a temporary file with new runtime methods
+        to copy-paste from.
+        """
+        rows = [(entry.task_name, entry.name, entry.enum_name)
+                for entry in self.methods.dispatched()]
+        self.write_artifact(new_path, method_template(tmpl_name).render_many(rows), 'temp')
+
+    def make_tmpl(self, tmpl_str, task_name, method_name, method_enum_name):
+        return method_template(tmpl_str).render(task_name, method_name, method_enum_name)
@@ -0,0 +1,282 @@
+"""
+Migrates a module repository to the current file layout and naming.
+Every rename and edit is planned in memory first; only files whose
+bytes change are written, so re-running on a migrated repo only reads.
+"""
+
+import os
+from chimaera_util.util.artifacts import Artifact, ArtifactManifest
+from chimaera_util.util.output import atomic_write, RepoLock
+from chimaera_util.util.profile import PROFILER
+
+
+class ReformatPlan:
+    """
+    The changes to one module (or, with mod_name None, to the repo
+    CMakeLists.txt). renames are applied first, then backups are
+    created, then writes ({path: text}) replace the files' contents.
+    old_sizes holds the size of each written file before the change,
+    or None for new files.
+    """
+
+    def __init__(self, mod_name, mod_root):
+        self.mod_name = mod_name
+        self.mod_root = mod_root
+        self.renames = []
+        self.backups = {}
+        self.writes = {}
+        self.old_sizes = {}
+        self.messages = []
+
+    def is_empty(self):
+        return not (self.renames or self.backups or self.writes)
+
+    def bytes_written(self):
+        return sum(len(text.encode()) for text in
+                   list(self.writes.values()) + list(self.backups.values()))
+
+
+class RepoReformat:
+    def __init__(self, repo_path, jobs=1, dry_run=False):
+        self.repo_path = repo_path
+        self.jobs = jobs
+        self.dry_run = dry_run
+
+    def process(self):
+        """
+        Plans the migration of every module, then applies the plans
+        (unless dry_run). Returns the plans.
+        """
+        mods = []
+        for subdir in sorted(os.listdir(self.repo_path)):
+            full_path = os.path.join(self.repo_path, subdir)
+            # Only subdirectories with a chimaera_mod.yaml are modules
+            if os.path.isdir(full_path) and \
+                    os.path.exists(os.path.join(full_path, "chimaera_mod.yaml")):
+                mods.append((subdir, full_path))
+
+        plans = self._map(lambda mod: self.plan_mod(*mod), mods)
+        if mods:
+            with PROFILER.phase('reformat_repo_cmake'):
+                plans.append(self.plan_repo_cmake())
+        if not self.dry_run and not all(plan.is_empty() for plan in plans):
+            with RepoLock(self.repo_path):
+                self._map(self.apply, plans)
+                self.record_artifacts(plans)
+        self.print_plans(plans)
+        return plans
+
+    def _map(self, fn, items):
+        jobs = self.jobs if self.jobs > 0 else (os.cpu_count() or 1)
+        if jobs > 1 and len(items) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                return list(pool.map(fn, items))
+        return list(map(fn, items))
+
+    def plan_repo_cmake(self):
+        plan = ReformatPlan(None, self.repo_path)
+        cmake_path = os.path.join(self.repo_path, "CMakeLists.txt")
+        if not os.path.exists(cmake_path):
+            return plan
+        content = _read(cmake_path)
+        new_content = content.replace('MOD_NAMESPACE', 'REPO_NAMESPACE')
+        self._plan_write(plan, cmake_path, new_content, content)
+        return plan
+
+    def plan_mod(self, mod_name, mod_root):
+        with PROFILER.module(mod_name), PROFILER.phase('plan_reformat'):
+            return _ModPlanner(mod_name, mod_root).build()
+
+    def _plan_write(self, plan, path, text, old_text):
+        if text == old_text:
+            return
+        plan.writes[path] = text
+        plan.old_sizes[path] = None if old_text is None else len(old_text.encode())
+
+    def apply(self, plan):
+        with PROFILER.module(plan.mod_name), PROFILER.phase('apply_reformat'):
+            for src_path, dst_path in plan.renames:
+                os.rename(src_path, dst_path)
+                plan.messages.append(f"Moved {src_path} to {dst_path}")
+            for path, text in list(plan.backups.items()) + list(plan.writes.items()):
+                data = text.encode()
+                atomic_write(path, data)
+                PROFILER.count('bytes_written', len(data))
+                PROFILER.count('files_rewritten')
+                if path in plan.backups:
+                    plan.messages.append(f"Created backup: {path}")
+                elif plan.old_sizes[path] is None:
+                    plan.messages.append(f"Created {path}")
+                else:
+                    plan.messages.append(f"Updated {path}")
+        return plan
+
+    def record_artifacts(self, plans):
+        """
+        Records the backups, and the new contents of any generated file
+        that was rewritten, in the repo's artifact manifest. Repos
+        without a manifest are left to the legacy scan of chi clear-temp.
+        """
+        artifacts = ArtifactManifest(self.repo_path)
+        if not artifacts.exists:
+            return
+        for plan in plans:
+            for path, text in plan.backups.items():
+                artifacts.add(Artifact(path, 'backup', text.encode()), plan.mod_name)
+            for path, text in plan.writes.items():
+                entry = artifacts.entries.get(
+                    os.path.relpath(os.path.abspath(path), artifacts.repo_dir))
+                if entry is not None:
+                    artifacts.add(Artifact(path, entry['kind'], text.encode()),
+                                  entry['module'])
+        artifacts.save()
+
+    def print_plans(self, plans):
+        """
+        Prints what was done, or with dry_run what would be done: each
+        rename and file, and a summary of files, bytes and renames.
+        """
+        n_renames = n_files = n_bytes = n_mods = 0
+        for plan in plans:
+            if plan.is_empty():
+                continue
+            name = plan.mod_name or 'repo'
+            n_mods += plan.mod_name is not None
+            n_renames += len(plan.renames)
+            n_files += len(plan.writes) + len(plan.backups)
+            n_bytes += plan.bytes_written()
+            if not self.dry_run:
+                for msg in plan.messages:
+                    print(f'[{name}] {msg}')
+                continue
+            for src_path, dst_path in plan.renames:
+                print(f'[{name}] would move {src_path} to {dst_path}')
+            for path in plan.backups:
+                print(f'[{name}] would back up {path}')
+            for path, text in plan.writes.items():
+                old_size = plan.old_sizes[path]
+                new_size = len(text.encode())
+                if old_size is None:
+                    print(f'[{name}] would create {path} ({new_size} bytes)')
+                else:
+                    print(f'[{name}] would update {path} ({old_size} -> {new_size} bytes)')
+        verb = 'Would change' if self.dry_run else 'Changed'
+        print(f'{verb} {n_mods} modules: {n_renames} renames, '
+              f'{n_files} files written, {n_bytes} bytes')
+
+
+class _ModPlanner:
+    """
+    Plans the migration of one module against a view of its files as
+    they will be after the renames.
+    """
+
+    def __init__(self, mod_name, mod_root):
+        self.mod_name = mod_name
+        self.mod_root = mod_root
+        self.plan = ReformatPlan(mod_name, mod_root)
+        # Planned path -> path it currently has on disk
+        self.moved_from = {}
+        self.old_texts = {}
+        self.texts = {}
+
+    def build(self):
+        mod_name, mod_root = self.mod_name, self.mod_root
+        self.plan_rename(os.path.join(mod_root, "src", f"{mod_name}.cc"),
+                         os.path.join(mod_root, "src", f"{mod_name}_runtime.cc"))
+        self.plan_rename(os.path.join(mod_root, "include", mod_name, f"{mod_name}.h"),
+                         os.path.join(mod_root, "include", mod_name, f"{mod_name}_client.h"))
+        self.plan_src_cmake()
+        self.plan_src_client()
+        for dirname in ["src", "include"]:
+            for path in self.listdir(os.path.join(mod_root, dirname)):
+                if path.endswith('CMakeLists.txt.backup'):
+                    continue
+                self.plan_file(path)
+
+        for path, text in self.texts.items():
+            old_text = self.old_texts.get(path)
+            if text != old_text:
+                self.plan.writes[path] = text
+                self.plan.old_sizes[path] = \
+                    None if old_text is None else len(old_text.encode())
+        return self.plan
+
+    def plan_rename(self, src_path, dst_path):
+        if os.path.exists(src_path):
+            self.plan.renames.append((src_path, dst_path))
+            self.moved_from[dst_path] = src_path
+
+    def exists(self, path):
+        if path in self.texts or path in self.moved_from:
+            return True
+        if path in self.moved_from.values():
+            return False
+        return os.path.exists(path)
+
+    def listdir(self, dirname):
+        """
+        The files directly in dirname, as they will be after the renames.
+        """
+        paths = set()
+        if os.path.isdir(dirname):
+            for name in os.listdir(dirname):
+                path = os.path.join(dirname, name)
+                if os.path.isfile(path) and path not in self.moved_from.values():
+                    paths.add(path)
+        paths.update(path for path in list(self.moved_from) + list(self.texts)
+                     if os.path.dirname(path) == dirname)
+        return sorted(paths)
+
+    def text(self, path):
+        """
+        The planned contents of path, read from disk on first use.
+        """
+        if path not in self.texts:
+            text = _read(self.moved_from.get(path, path))
+            self.old_texts[path] = text
+            self.texts[path] = text
+        return self.texts[path]
+
+    def plan_src_cmake(self):
+        mod_name = self.mod_name
+        cmake_path = os.path.join(self.mod_root, "src/CMakeLists.txt")
+        if not os.path.exists(cmake_path):
+            return
+        content = self.text(cmake_path)
+        add_chimod = f"add_chimod_runtime_lib(${{MOD_NAMESPACE}} {mod_name} {mod_name}_runtime.cc)\n" + \
+                     f"add_chimod_client_lib(${{MOD_NAMESPACE}} {mod_name} {mod_name}_client.cc)"
+        new_content = content.replace(f"add_chimod_library(${{MOD_NAMESPACE}} {mod_name} {mod_name}.cc)", add_chimod)
+        new_content = new_content.replace(f"add_chimod_library(${{REPO_NAMESPACE}} {mod_name} {mod_name}.cc)", add_chimod)
+        new_content = new_content.replace(f"add_chimod_library(${{MOD_NAMESPACE}} {mod_name} {mod_name}_runtime.cc)", add_chimod)
+        new_content = new_content.replace(f"add_chimod_library(${{REPO_NAMESPACE}} {mod_name} {mod_name}_runtime.cc)", add_chimod)
+        new_content = new_content.replace('MOD_NAMESPACE', 'REPO_NAMESPACE')
+        if new_content != content:
+            # Back up the CMakeLists.txt only when it is about to change
+            backup_path = os.path.join(self.mod_root, "src/CMakeLists.txt.backup")
+            self.plan.backups[backup_path] = content
+            self.texts[cmake_path] = new_content
+
+    def plan_src_client(self):
+        client_path = os.path.join(self.mod_root, "src", f"{self.mod_name}_client.cc")
+        if not self.exists(client_path):
+            self.texts[client_path] = f'#include "{self.mod_name}/{self.mod_name}_client.h"\n'
+
+    def plan_file(self, path):
+        try:
+            content = self.text(path)
+        except UnicodeDecodeError:
+            # Not a source file
+            return
+        content = content.replace(f"{self.mod_name}.h", f"{self.mod_name}_client.h")
+        content = content.replace(f"{self.mod_name}.cc", f"{self.mod_name}_runtime.cc")
+        self.texts[path] = content
+
+
+def _read(path):
+    # newline='' so that line endings are compared and kept byte for byte
+    with open(path, newline='') as f:
+        text = f.read()
+    PROFILER.count('bytes_read', len(text))
+    return text
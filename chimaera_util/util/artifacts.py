@@ -0,0 +1,143 @@
+"""
+Tracks every file the codegen generates, so that temporary outputs can
+be cleared without scanning the repo and hand-edited generated files
+can be detected without regenerating them.
+"""
+
+import hashlib
+import json
+import os
+from chimaera_util.util.manifest import hash_file
+from chimaera_util.util.output import write_if_changed
+
+ARTIFACTS_NAME = '.chimaera_artifacts.json'
+ARTIFACTS_VERSION = 1
+# generated: rewritten on every refresh (*_methods.h, *_lib_exec.h, ...)
+# temp: methods to copy-paste from (*.temp_h, *.temp_cc)
+# backup: copies of files before a reformat changed them
+KINDS = ('generated', 'temp', 'backup')
+CLEARABLE = ('temp', 'backup')
+
+
+class Artifact:
+    """
+    A file written by the codegen: its path, kind and the sha1 and size
+    of the contents written, given either as the data or as its size and
+    sha1. Picklable so it can be returned from a
+    worker process.
+    """
+
+    def __init__(self, path, kind, data=None, size=None, sha1=None):
+        self.path = path
+        self.kind = kind
+        if data is not None:
+            size = len(data)
+            sha1 = hashlib.sha1(data).hexdigest()
+        self.size = size
+        self.sha1 = sha1
+
+
+class ArtifactManifest:
+    """
+    The manifest lives at MOD_REPO_DIR/.chimaera_artifacts.json and maps
+    the repo-relative path of each artifact to its kind, module (None
+    for repo-level files), size and sha1.
+    """
+
+    def __init__(self, MOD_REPO_DIR):
+        self.repo_dir = os.path.abspath(MOD_REPO_DIR)
+        self.path = os.path.join(self.repo_dir, ARTIFACTS_NAME)
+        self.exists = False
+        self.entries = {}
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get('version') != ARTIFACTS_VERSION:
+            return
+        self.exists = True
+        self.entries = data.get('artifacts', {})
+
+    def add(self, artifact, mod_name=None):
+        key = os.path.relpath(os.path.abspath(artifact.path), self.repo_dir)
+        entry = {'kind': artifact.kind, 'module': mod_name,
+                 'size': artifact.size, 'sha1': artifact.sha1}
+        if self.entries.get(key) != entry:
+            self.entries[key] = entry
+            self.dirty = True
+
+    def record_module(self, mod_name, artifacts):
+        """
+        Replaces the artifacts of a module with those of its latest
+        refresh. Temp files and backups from earlier runs are kept while
+        they exist, so that they can still be cleared.
+        """
+        for key, entry in list(self.entries.items()):
+            if entry['module'] != mod_name:
+                continue
+            if entry['kind'] in CLEARABLE and \
+                    os.path.exists(os.path.join(self.repo_dir, key)):
+                continue
+            del self.entries[key]
+            self.dirty = True
+        for artifact in artifacts:
+            self.add(artifact, mod_name)
+
+    def prune(self, MOD_NAMES):
+        """
+        Forgets the artifacts of modules that are no longer in the repo.
+        """
+        for key, entry in list(self.entries.items()):
+            if entry['module'] is not None and entry['module'] not in MOD_NAMES:
+                del self.entries[key]
+                self.dirty = True
+
+    def clear(self, kinds=CLEARABLE):
+        """
+        Removes the artifacts of the given kinds. Returns their paths.
+        """
+        removed = []
+        for key, entry in sorted(self.entries.items()):
+            if entry['kind'] not in kinds:
+                continue
+            path = os.path.join(self.repo_dir, key)
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                pass
+            del self.entries[key]
+            self.dirty = True
+        return removed
+
+    def verify(self):
+        """
+        Compares each artifact with what was written. Returns a sorted
+        [(status, key, entry)] of the artifacts that are 'missing' or
+        'modified'.
+        """
+        problems = []
+        for key, entry in sorted(self.entries.items()):
+            path = os.path.join(self.repo_dir, key)
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                if entry['kind'] == 'generated':
+                    problems.append(('missing', key, entry))
+                continue
+            if size != entry['size'] or hash_file(path) != entry['sha1']:
+                problems.append(('modified', key, entry))
+        return problems
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {'version': ARTIFACTS_VERSION, 'artifacts': self.entries}
+        write_if_changed(self.path, json.dumps(data, indent=1, sort_keys=True))
+        self.dirty = False
+        self.exists = True
@@ -0,0 +1,89 @@
+"""
+Build acceleration settings for the generated repo CMakeLists.txt. They
+are opt-in, under the build: key of chimaera_repo.yaml, and can be
+overridden per module under the build: key of its chimaera_mod.yaml:
+
+    build:
+      unity: true         # unity-build the sources of each target
+      unity_batch: 8      # sources per unity file
+      pch: true           # precompile the common Chimaera headers,
+                          # or a header or list of headers to precompile
+      time_trace: true    # record the compile time of every TU (see
+                          # chimaera_util.util.compile_times)
+
+Without a build: key in chimaera_repo.yaml, the CMakeLists.txt is
+generated as before.
+"""
+
+BUILD_DEFAULTS = {
+    'unity': False,
+    'unity_batch': 8,
+    'pch': False,
+    'time_trace': False,
+}
+
+# The headers precompiled with pch: true
+DEFAULT_PCH = [
+    '<chimaera/chimaera_types.h>',
+    '<chimaera/api/chimaera_client.h>',
+]
+
+
+def build_settings(repo_build, mod_build=None, where='build'):
+    """
+    The build settings of a module: BUILD_DEFAULTS updated with the repo
+    build: section and then the module's. pch is resolved to a list of
+    headers (empty if disabled); a single header may be given as a string.
+    """
+    settings = dict(BUILD_DEFAULTS)
+    for section in (repo_build, mod_build):
+        if section is None:
+            continue
+        if not isinstance(section, dict):
+            raise ValueError(f'{where}: build must be a mapping of {list(BUILD_DEFAULTS)}')
+        unknown = sorted(set(section) - set(BUILD_DEFAULTS))
+        if unknown:
+            raise ValueError(f'{where}: unknown build keys {unknown}, '
+                             f'expected one of {list(BUILD_DEFAULTS)}')
+        settings.update(section)
+    for key in ('unity', 'time_trace'):
+        if not isinstance(settings[key], bool):
+            raise ValueError(f'{where}: build {key} must be true or false')
+    pch = settings['pch']
+    if pch is True:
+        pch = DEFAULT_PCH
+    elif pch is False:
+        pch = []
+    elif isinstance(pch, str):
+        pch = [pch]
+    elif not isinstance(pch, list) or not all(isinstance(header, str) for header in pch):
+        raise ValueError(f'{where}: build pch must be true, false or a list of headers')
+    settings['pch'] = [_header(header) for header in pch]
+    batch = settings['unity_batch']
+    if isinstance(batch, bool) or not isinstance(batch, int) or batch < 0:
+        raise ValueError(f'{where}: unity_batch must be 0 (unbounded) or more')
+    return settings
+
+
+def _header(header):
+    if header.startswith(('<', '"')):
+        return header
+    return f'<{header}>'
+
+
+def accelerate_cmake(MOD_NAME, settings):
+    """
+    The chi_accelerate_module call for a module, or None if the module
+    has no build setting enabled.
+    """
+    if not settings['unity'] and not settings['pch'] and not settings['time_trace']:
+        return None
+    args = [MOD_NAME]
+    if settings['unity']:
+        args += ['UNITY', f"UNITY_BATCH {int(settings['unity_batch'])}"]
+    if settings['pch']:
+        pch = ' '.join('"' + header.replace('"', '\\"') + '"' for header in settings['pch'])
+        args += [f'PCH {pch}']
+    if settings['time_trace']:
+        args += ['TIME_TRACE']
+    return f"chi_accelerate_module({' '.join(args)})"
@@ -0,0 +1,52 @@
+"""
+Command-line helpers shared by the bin/ tools.
+"""
+
+import contextlib
+from chimaera_util.util.profile import PROFILER
+
+
+def add_profile_args(parser):
+    parser.add_argument('--profile', metavar='PATH',
+                        help='write per-module, per-phase timings and I/O counters to PATH')
+    parser.add_argument('--profile-format', choices=['json', 'chrome'], default='json',
+                        help='json summary or Chrome trace event format')
+    parser.add_argument('--cprofile', metavar='PATH',
+                        help='dump cProfile stats of the main process to PATH')
+
+
+@contextlib.contextmanager
+def profiled(args):
+    """
+    Enables the profilers requested on the command line for the duration
+    of the with block and writes their output when it exits.
+    """
+    if args.profile:
+        PROFILER.reset(enabled=True)
+    cprof = None
+    if args.cprofile:
+        import cProfile
+        cprof = cProfile.Profile()
+        cprof.enable()
+    try:
+        yield
+    finally:
+        if cprof is not None:
+            cprof.disable()
+            cprof.dump_stats(args.cprofile)
+        if args.profile:
+            PROFILER.save(args.profile, args.profile_format)
+
+
+_CODEGEN = None
+
+
+def get_codegen():
+    """
+    The ChimaeraCodegen shared by every command run in this process.
+    """
+    global _CODEGEN
+    if _CODEGEN is None:
+        from chimaera_util.codegen import ChimaeraCodegen
+        _CODEGEN = ChimaeraCodegen()
+    return _CODEGEN
@@ -0,0 +1,205 @@
+"""
+Compile-time profiling of module repos. With time_trace in the build:
+section of chimaera_repo.yaml, the repo CMake runs every module compile
+through "chi compile-launcher", which times the compiler and records
+one JSON file per translation unit in CHI_COMPILE_TIMES_DIR:
+
+    module: the module the TU belongs to
+    source, object: absolute paths
+    seconds: wall time of the compiler
+    headers: the headers the TU included, from its depfile
+    header_us: (Clang only) {header: microseconds spent parsing it,
+        including the headers it includes}, from -ftime-trace
+
+"chi compile-time" aggregates the records per module and per header.
+The cost of a header is its parse time where Clang traces exist. With
+GCC, headers are ranked by the compile time of the TUs that include
+them, i.e., what an edit to the header costs to rebuild.
+"""
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+
+RECORD_VERSION = 1
+# The headers written or maintained by the codegen
+GENERATED_SUFFIXES = ('_lib_exec.h', '_methods.h', '_tasks.h', '_client.h')
+_DEP_SPLIT_RE = re.compile(r'(?<!\\)\s+')
+
+
+def _arg_value(args, flag):
+    """
+    The value of flag in a compiler command line (-o out or -oout).
+    """
+    for i, arg in enumerate(args):
+        if arg == flag and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith(flag) and len(arg) > len(flag):
+            return arg[len(flag):]
+    return None
+
+
+def _source(args):
+    """
+    The source file of a compiler command line, which follows -c in the
+    commands CMake generates.
+    """
+    for i, arg in enumerate(args[:-1]):
+        if arg == '-c':
+            return args[i + 1]
+    return None
+
+
+def parse_depfile(path):
+    """
+    The prerequisites listed in a make-style depfile.
+    """
+    with open(path) as fp:
+        text = fp.read().replace('\\\n', ' ')
+    deps = []
+    for rule in text.splitlines():
+        _, sep, prereqs = rule.partition(': ')
+        if not sep:
+            continue
+        deps += [dep.replace('\\ ', ' ') for dep in _DEP_SPLIT_RE.split(prereqs.strip()) if dep]
+    return deps
+
+
+def summarize_trace(path):
+    """
+    {header: microseconds} of the Source events of a Clang -ftime-trace.
+    """
+    with open(path) as fp:
+        trace = json.load(fp)
+    header_us = {}
+    for event in trace.get('traceEvents', []):
+        if event.get('name') != 'Source':
+            continue
+        header = os.path.abspath(event.get('args', {}).get('detail', ''))
+        header_us[header] = header_us.get(header, 0) + event.get('dur', 0)
+    return header_us
+
+
+def record_compile(out_dir, module, argv):
+    """
+    Runs the compiler command argv, then records its time, the headers
+    from its depfile and its Clang trace. Recording never fails the
+    compile. Returns the exit status of the compiler.
+    """
+    start = time.perf_counter()
+    status = subprocess.call(argv)
+    seconds = time.perf_counter() - start
+    if status != 0:
+        return status
+    try:
+        obj = _arg_value(argv, '-o')
+        record = {
+            'version': RECORD_VERSION,
+            'module': module,
+            'source': os.path.abspath(_source(argv) or ''),
+            'object': os.path.abspath(obj or ''),
+            'seconds': seconds,
+            'headers': [],
+            'header_us': {},
+        }
+        depfile = _arg_value(argv, '-MF')
+        if depfile and os.path.exists(depfile):
+            record['headers'] = sorted({os.path.abspath(dep) for dep in parse_depfile(depfile)
+                                        if os.path.abspath(dep) != record['source']})
+        trace = os.path.splitext(obj)[0] + '.json' if obj else None
+        if trace and '-ftime-trace' in argv and os.path.exists(trace):
+            record['header_us'] = summarize_trace(trace)
+        os.makedirs(out_dir, exist_ok=True)
+        name = hashlib.sha1(record['object'].encode()).hexdigest()
+        with open(os.path.join(out_dir, f'{name}.json'), 'w') as fp:
+            json.dump(record, fp)
+    except Exception as e:
+        print(f'chi compile-launcher: could not record {argv}: {e}')
+    return status
+
+
+def load_records(out_dir):
+    records = []
+    for name in sorted(os.listdir(out_dir)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(out_dir, name)) as fp:
+            record = json.load(fp)
+        if record.get('version') == RECORD_VERSION:
+            records.append(record)
+    return records
+
+
+def is_generated(header):
+    return header.endswith(GENERATED_SUFFIXES)
+
+
+class CompileReport:
+    """
+    The compile time of each module, TU and header of a build.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.traced = any(record['header_us'] for record in records)
+        self.modules = {}
+        self.headers = {}
+        for record in records:
+            module = self.modules.setdefault(record['module'], {'tus': 0, 'seconds': 0.0})
+            module['tus'] += 1
+            module['seconds'] += record['seconds']
+            for header in record['headers']:
+                stats = self._header(header)
+                stats['tus'] += 1
+                stats['rebuild_seconds'] += record['seconds']
+            for header, us in record['header_us'].items():
+                self._header(header)['parse_seconds'] += us / 1e6
+
+    def _header(self, header):
+        return self.headers.setdefault(
+            header, {'tus': 0, 'rebuild_seconds': 0.0, 'parse_seconds': 0.0})
+
+    def header_cost(self, header):
+        stats = self.headers[header]
+        return stats['parse_seconds'] if self.traced else stats['rebuild_seconds']
+
+    def ranked_modules(self):
+        return sorted(self.modules.items(), key=lambda item: -item[1]['seconds'])
+
+    def ranked_tus(self):
+        return sorted(self.records, key=lambda record: -record['seconds'])
+
+    def ranked_headers(self, generated=False):
+        headers = [header for header in self.headers
+                   if not generated or is_generated(header)]
+        return sorted(headers, key=lambda header: -self.header_cost(header))
+
+    def to_dict(self):
+        return {
+            'traced': self.traced,
+            'modules': dict(self.ranked_modules()),
+            'tus': [{key: record[key] for key in ('module', 'source', 'seconds')}
+                    for record in self.ranked_tus()],
+            'headers': {header: dict(self.headers[header], generated=is_generated(header))
+                        for header in self.ranked_headers()},
+        }
+
+    def format(self, top=10):
+        cost = 'parse time (Clang -ftime-trace)' if self.traced else \
+            'compile time of the TUs that include it'
+        total = sum(record['seconds'] for record in self.records)
+        lines = [f'{len(self.records)} TUs, {total:.2f}s of compile time',
+                 '', 'Modules:']
+        lines += [f"  {stats['seconds']:9.2f}s  {stats['tus']:4} TUs  {module}"
+                  for module, stats in self.ranked_modules()[:top]]
+        lines += ['', 'Translation units:']
+        lines += [f"  {record['seconds']:9.2f}s  [{record['module']}] {record['source']}"
+                  for record in self.ranked_tus()[:top]]
+        for title, generated in [('Generated headers', True), ('All headers', False)]:
+            lines += ['', f'{title}, by {cost}:']
+            lines += [f"  {self.header_cost(header):9.2f}s  {self.headers[header]['tus']:4} TUs  {header}"
+                      for header in self.ranked_headers(generated)[:top]]
+        return '\n'.join(lines)
@@ -0,0 +1,263 @@
+"""
+Loading of the YAML configs read by the codegen (chimaera_repo.yaml,
+MOD_NAME_methods.yaml, ...). Uses libyaml's C loader when PyYAML was
+built with it, and caches parsed configs in memory and on disk so that
+repeated tool invocations do not parse unchanged files again.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import shutil
+import time
+from chimaera_util.util.output import atomic_write
+from chimaera_util.util.profile import PROFILER
+
+CACHE_VERSION = 2
+# A file modified this close to when it was cached could be modified
+# again without its mtime changing, so its cache entry is checked by hash.
+RACY_NS = 2 * 10**9
+# The disk cache is pruned at most this often, and down to this size
+PRUNE_INTERVAL = 3600
+CACHE_MAX_BYTES = 8 * 2**20
+REPO_CONFIG = 'chimaera_repo.yaml'
+
+
+def yaml_loader():
+    """
+    yaml is imported on first use, so that commands which never parse
+    YAML do not pay for importing it.
+    """
+    import yaml
+    return yaml, getattr(yaml, 'CFullLoader', yaml.FullLoader)
+
+
+def default_cache_dir():
+    """
+    $CHIMAERA_CACHE_DIR, else $XDG_CACHE_HOME/chimaera, else
+    ~/.cache/chimaera. CHIMAERA_CACHE_DIR=off disables the disk cache.
+    """
+    cache_dir = os.getenv('CHIMAERA_CACHE_DIR')
+    if cache_dir:
+        return None if cache_dir == 'off' else cache_dir
+    xdg = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(xdg, 'chimaera', 'yaml')
+
+
+def _sha1(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class ConfigCache:
+    """
+    Parsed YAML configs keyed by absolute path. An entry is valid while
+    the file's size and mtime_ns match; if only the mtime differs (or the
+    entry was racy), the sha1 of the contents decides. Entries store the
+    config as JSON text, so every load returns a fresh object the caller
+    may modify. Configs that JSON does not round-trip (e.g., non-string
+    keys) are only cached in memory.
+
+    On disk, the entries of a repo (the nearest directory above the file
+    with a chimaera_repo.yaml, else the file's directory) are kept
+    together in CACHE_DIR/<sha1 of the repo>/, along with the repo path.
+    prune() removes the repos and entries whose files no longer exist
+    and then the oldest entries until the cache fits in CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.entries = {}
+        self.repo_roots = {}
+        self.pruned = False
+
+    def load(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is None:
+            entry = self._read_entry(path)
+        if entry is not None and entry['size'] == st.st_size and \
+                entry['mtime_ns'] == st.st_mtime_ns and not entry['racy']:
+            PROFILER.count('config_cache_hits')
+            self.entries[path] = entry
+            return self._config(entry)
+
+        with open(path, 'rb') as fp:
+            text = fp.read()
+        PROFILER.count('bytes_read', len(text))
+        sha1 = hashlib.sha1(text).hexdigest()
+        if entry is not None and entry['sha1'] == sha1:
+            PROFILER.count('config_cache_hits')
+            data, config = entry['data'], entry.get('config')
+        else:
+            yaml, loader = yaml_loader()
+            config = yaml.load(text, Loader=loader)
+            data = self._to_json(config)
+            if data is not None:
+                config = None
+        entry = {
+            'version': CACHE_VERSION,
+            'path': path,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'racy': time.time_ns() - st.st_mtime_ns < RACY_NS,
+            'sha1': sha1,
+            'data': data,
+        }
+        if data is None:
+            entry['config'] = config
+        else:
+            self._write_entry(path, entry)
+        self.entries[path] = entry
+        return self._config(entry)
+
+    @staticmethod
+    def _to_json(config):
+        """
+        config as JSON text, or None if it does not round-trip.
+        """
+        try:
+            data = json.dumps(config)
+        except (TypeError, ValueError):
+            return None
+        return data if json.loads(data) == config else None
+
+    @staticmethod
+    def _config(entry):
+        if entry['data'] is None:
+            return copy.deepcopy(entry['config'])
+        return json.loads(entry['data'])
+
+    def repo_root(self, dirname):
+        """
+        The nearest directory from dirname up with a chimaera_repo.yaml,
+        or dirname if there is none.
+        """
+        root = self.repo_roots.get(dirname)
+        if root is None:
+            root = dirname
+            cur = dirname
+            while True:
+                if os.path.exists(os.path.join(cur, REPO_CONFIG)):
+                    root = cur
+                    break
+                parent = os.path.dirname(cur)
+                if parent == cur:
+                    break
+                cur = parent
+            self.repo_roots[dirname] = root
+        return root
+
+    def _repo_dir(self, path):
+        return os.path.join(self.cache_dir, _sha1(self.repo_root(os.path.dirname(path))))
+
+    def _entry_path(self, path):
+        return os.path.join(self._repo_dir(path), f'{_sha1(path)}.json')
+
+    def _read_entry(self, path):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._entry_path(path)) as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != CACHE_VERSION or \
+                entry.get('path') != path or not isinstance(entry.get('data'), str):
+            return None
+        return entry
+
+    def _write_entry(self, path, entry):
+        if self.cache_dir is None:
+            return
+        try:
+            repo_dir = self._repo_dir(path)
+            root_file = os.path.join(repo_dir, 'root')
+            if not os.path.exists(root_file):
+                os.makedirs(repo_dir, exist_ok=True)
+                atomic_write(root_file, self.repo_root(os.path.dirname(path)).encode())
+            atomic_write(self._entry_path(path), json.dumps(entry).encode())
+            if not self.pruned:
+                self.pruned = True
+                self.prune()
+        except OSError:
+            # The cache is an optimization; a read-only home is not an error
+            pass
+
+    def prune(self, force=False):
+        """
+        Removes the entries of repos and files that no longer exist, and
+        then the least recently written entries until the cache is at
+        most CACHE_MAX_BYTES. Runs at most once per PRUNE_INTERVAL unless
+        force is set.
+        """
+        stamp = os.path.join(self.cache_dir, '.pruned')
+        try:
+            if not force and time.time() - os.stat(stamp).st_mtime < PRUNE_INTERVAL:
+                return
+        except FileNotFoundError:
+            pass
+        atomic_write(stamp, b'')
+        kept = []
+        for name in os.listdir(self.cache_dir):
+            repo_dir = os.path.join(self.cache_dir, name)
+            if name.startswith('.'):
+                # The stamp, or a file being written
+                continue
+            if not os.path.isdir(repo_dir):
+                # An entry of an older cache version
+                os.remove(repo_dir)
+                continue
+            try:
+                with open(os.path.join(repo_dir, 'root')) as fp:
+                    root = fp.read()
+            except OSError:
+                root = ''
+            if not root or not os.path.isdir(root):
+                shutil.rmtree(repo_dir, ignore_errors=True)
+                continue
+            for entry_name in os.listdir(repo_dir):
+                if entry_name == 'root' or entry_name.startswith('.'):
+                    continue
+                entry_path = os.path.join(repo_dir, entry_name)
+                try:
+                    with open(entry_path) as fp:
+                        entry = json.load(fp)
+                    st = os.stat(entry_path)
+                except (OSError, ValueError):
+                    entry = None
+                if not isinstance(entry, dict) or entry.get('version') != CACHE_VERSION or \
+                        not os.path.exists(str(entry.get('path'))):
+                    os.remove(entry_path)
+                    continue
+                kept.append((st.st_mtime_ns, st.st_size, entry_path))
+        total = sum(size for _, size, _ in kept)
+        for _, size, entry_path in sorted(kept):
+            if total <= CACHE_MAX_BYTES:
+                break
+            os.remove(entry_path)
+            total -= size
+
+
+_CACHE = None
+
+
+def load_yaml(path):
+    """
+    Parses the YAML file at path, or returns its cached parse.
+    """
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = ConfigCache(default_cache_dir())
+    with PROFILER.phase('load_yaml'):
+        return _CACHE.load(path)
+
+
+def reset_cache():
+    """
+    Drops the in-memory cache, so the next load_yaml reads
+    CHIMAERA_CACHE_DIR again.
+    """
+    global _CACHE
+    _CACHE = None
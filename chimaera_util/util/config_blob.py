@@ -0,0 +1,208 @@
+"""
+Compact binary encoding of parsed YAML configs, so that the runtime can
+load its default configuration without a YAML parser.
+
+Layout (all integers little endian):
+    header: magic "CHCF", u16 version, u16 reserved, u32 size of the
+            whole blob, u64 schema hash, then the root value
+    value:  u8 tag followed by its payload
+        NULL  (0)
+        FALSE (1), TRUE (2)
+        INT   (3) i64
+        FLOAT (4) f64
+        STR   (5) u32 length, utf-8 bytes
+        LIST  (6) u32 count, count values
+        MAP   (7) u32 count, count x (u32 key length, utf-8 key, value)
+The schema hash covers the keys and value types but not the values, so
+a reader can detect a config whose layout it was not written for.
+
+Reading a blob on the runtime side (config_*_default_bin.h defines the
+blob as <name>Bin, plus <name>BinVersion, <name>SchemaHash and <name>BinSize):
+    - Check bytes [0, 4) are "CHCF", the u16 at 4 is the version the
+      reader supports, and the u32 at 8 equals <name>BinSize. The u64 at
+      12 is <name>SchemaHash. Compare it with the hash the reader was written
+      against to detect a changed layout. The root value starts at 20.
+    - Values are not aligned; read integers and floats with memcpy.
+    - Strings and keys are not NUL terminated. Map entries keep the
+      order of the YAML file, and keys are always strings (YAML keys of
+      other types are converted with str()). Dates are ISO 8601 strings.
+    - A reader that finds an unknown tag must reject the blob.
+decode_config is the reference reader. Every blob is decoded and compared
+with the parsed config when it is generated (check_config_blob).
+"""
+
+import datetime
+import hashlib
+import struct
+
+BLOB_MAGIC = b'CHCF'
+BLOB_VERSION = 1
+HEADER = struct.Struct('<4sHHIQ')
+TAG_NULL, TAG_FALSE, TAG_TRUE, TAG_INT, TAG_FLOAT, TAG_STR, TAG_LIST, TAG_MAP = range(8)
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+
+
+def _scalar(value):
+    # Dates are the only other type a YAML loader produces for configs
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def schema_of(value):
+    """
+    Canonical string of the keys and value types of a config.
+    """
+    value = _scalar(value)
+    if value is None:
+        return 'n'
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, int):
+        return 'i'
+    if isinstance(value, float):
+        return 'f'
+    if isinstance(value, str):
+        return 's'
+    if isinstance(value, list):
+        elems = list(dict.fromkeys(schema_of(elem) for elem in value))
+        return f"[{','.join(elems)}]"
+    if isinstance(value, dict):
+        return '{' + ','.join(f'{key}:{schema_of(val)}'
+                              for key, val in value.items()) + '}'
+    raise TypeError(f'Cannot encode {type(value).__name__} in a config blob')
+
+
+def schema_hash(value):
+    digest = hashlib.sha1(schema_of(value).encode()).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def _encode(value, out):
+    value = _scalar(value)
+    if value is None:
+        out.append(bytes([TAG_NULL]))
+    elif isinstance(value, bool):
+        out.append(bytes([TAG_TRUE if value else TAG_FALSE]))
+    elif isinstance(value, int):
+        if not -2**63 <= value < 2**63:
+            raise ValueError(f'{value} does not fit in a 64-bit config integer')
+        out.append(bytes([TAG_INT]))
+        out.append(_I64.pack(value))
+    elif isinstance(value, float):
+        out.append(bytes([TAG_FLOAT]))
+        out.append(_F64.pack(value))
+    elif isinstance(value, str):
+        data = value.encode()
+        out.append(bytes([TAG_STR]))
+        out.append(_U32.pack(len(data)))
+        out.append(data)
+    elif isinstance(value, list):
+        out.append(bytes([TAG_LIST]))
+        out.append(_U32.pack(len(value)))
+        for elem in value:
+            _encode(elem, out)
+    elif isinstance(value, dict):
+        out.append(bytes([TAG_MAP]))
+        out.append(_U32.pack(len(value)))
+        for key, val in value.items():
+            data = str(key).encode()
+            out.append(_U32.pack(len(data)))
+            out.append(data)
+            _encode(val, out)
+    else:
+        raise TypeError(f'Cannot encode {type(value).__name__} in a config blob')
+
+
+def encode_config(config):
+    """
+    Encodes a parsed config. Returns (blob, schema hash).
+    """
+    out = []
+    _encode(config, out)
+    body = b''.join(out)
+    hash_val = schema_hash(config)
+    header = HEADER.pack(BLOB_MAGIC, BLOB_VERSION, 0, HEADER.size + len(body), hash_val)
+    return header + body, hash_val
+
+
+def decode_config(blob):
+    """
+    Inverse of encode_config. Used to check the generated blobs.
+    """
+    magic, version, _, size, _ = HEADER.unpack_from(blob, 0)
+    if magic != BLOB_MAGIC or version != BLOB_VERSION or size != len(blob):
+        raise ValueError(f'Not a config blob of version {BLOB_VERSION}')
+    value, off = _decode(blob, HEADER.size)
+    if off != len(blob):
+        raise ValueError(f'{len(blob) - off} trailing bytes after the config blob')
+    return value
+
+
+def _normalized(value):
+    """
+    value as decode_config returns it: dates as strings, keys as strings.
+    """
+    value = _scalar(value)
+    if isinstance(value, list):
+        return [_normalized(elem) for elem in value]
+    if isinstance(value, dict):
+        return {str(key): _normalized(val) for key, val in value.items()}
+    return value
+
+
+def check_config_blob(blob, config, hash_val):
+    """
+    Decodes blob and checks it holds config and its schema hash. Raises
+    ValueError if the blob does not round-trip.
+    """
+    if HEADER.unpack_from(blob, 0)[4] != hash_val or \
+            decode_config(blob) != _normalized(config):
+        raise ValueError('The config blob does not decode to the parsed config')
+
+
+def _decode(blob, off):
+    tag = blob[off]
+    off += 1
+    if tag == TAG_NULL:
+        return None, off
+    if tag in (TAG_FALSE, TAG_TRUE):
+        return tag == TAG_TRUE, off
+    if tag == TAG_INT:
+        return _I64.unpack_from(blob, off)[0], off + _I64.size
+    if tag == TAG_FLOAT:
+        return _F64.unpack_from(blob, off)[0], off + _F64.size
+    count = _U32.unpack_from(blob, off)[0]
+    off += _U32.size
+    if tag == TAG_STR:
+        return blob[off:off + count].decode(), off + count
+    if tag == TAG_LIST:
+        value = []
+        for _ in range(count):
+            elem, off = _decode(blob, off)
+            value.append(elem)
+        return value, off
+    if tag == TAG_MAP:
+        value = {}
+        for _ in range(count):
+            length = _U32.unpack_from(blob, off)[0]
+            off += _U32.size
+            key = blob[off:off + length].decode()
+            value[key], off = _decode(blob, off + length)
+        return value, off
+    raise ValueError(f'Unknown config blob tag {tag}')
+
+
+def blob_to_c_array(blob, indent='  ', per_line=16):
+    """
+    The bytes of blob as the lines of a C array initializer.
+    """
+    hex_data = blob.hex()
+    lines = []
+    for i in range(0, len(blob), per_line):
+        chunk = hex_data[2 * i:2 * (i + per_line)]
+        lines.append(indent + ', '.join(f'0x{chunk[j:j + 2]}'
+                                        for j in range(0, len(chunk), 2)) + ',')
+    return lines
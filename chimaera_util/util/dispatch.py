@@ -0,0 +1,531 @@
+"""
+The dispatch functions emitted into MOD_NAME_lib_exec.h. Each function is
+described once by a DispatchFn and can be rendered either as a switch over
+the method id or as a constexpr table of function pointers indexed by the
+method id. The renderers are generators of lines over the MethodEntry
+objects of a MethodTable, so a file can be streamed to disk as it is
+rendered.
+
+Run, SaveStart/LoadStart/SaveEnd/LoadEnd and the batched functions can
+also record per-method stats. The stats are only compiled in when
+STATS_MACRO is defined, so without it the generated code is unchanged.
+
+With lib_exec: source, the functions that do not call the module's own
+methods are compiled once per module as free functions in the generated
+src/MOD_NAME_lib_exec.cc. The runtime class keeps Run and Monitor and a
+one-line forwarder for each of the others, so the header no longer
+changes with the methods except through Run and Monitor.
+"""
+
+import re
+
+DISPATCH_MODES = ['switch', 'table']
+LIB_EXEC_MODES = ['header', 'source']
+
+# A table is emitted for the ids [0, extent). The extent is grown while the
+# table has at most TABLE_MAX_SPARSITY slots per method, or fits within
+# TABLE_MIN_SLOTS. Ids past the extent fall back to a switch.
+TABLE_MIN_SLOTS = 64
+TABLE_MAX_SPARSITY = 4
+
+# Defining this macro when building a module compiles in its method stats
+STATS_MACRO = 'CHI_METHOD_STATS'
+
+# The first line of a generated MOD_NAME_lib_exec.cc
+LIB_EXEC_CC_BANNER = '// Generated by chi refresh (lib_exec: source). Do not edit.'
+
+_FN_NAME_RE = re.compile(r'(\w+)\(')
+_INCLUDE_RE = re.compile(r'\s*#\s*include\b')
+_NAMESPACE_RE = re.compile(r'\s*namespace\s+([\w:]+)\s*\{')
+_NAMESPACE_END_RE = re.compile(r'\s*\}\s*//\s*namespace\b')
+
+
+class DispatchFn:
+    """
+    A dispatch function.
+
+    head: the signature lines, ending with the opening brace
+    params: the parameters forwarded to each per-method case
+    args: the argument names matching params
+    body: the per-method case body. {method_name} and {task_name} are
+        substituted. {self} is empty in a switch and "self->" in a table.
+    prologue/epilogue: lines placed before/after the dispatch
+    ret: the variable returned by the function, if any
+    stats: the stats the function records, if any. 'run' counts the calls
+        of the method and their latency, 'save'/'load' count the bytes
+        written to/read from the archive.
+    decl/call: the signature and the call of the function as a free
+        function named {name}, for lib_exec: source. None if the cases
+        call the module's own methods, so it stays in the runtime class.
+    """
+
+    def __init__(self, doc, head, params, args, body,
+                 prologue=None, epilogue=None, ret=None, stats=None,
+                 decl=None, call=None):
+        self.doc = doc
+        self.head = head
+        self.params = params
+        self.args = args
+        self.body = body
+        self.prologue = prologue or []
+        self.epilogue = epilogue or []
+        self.ret = ret
+        self.stats = stats
+        self.decl = decl
+        self.call = call
+        self.name = _FN_NAME_RE.search(head[0]).group(1)
+
+
+LIB_EXEC_FNS = [
+    DispatchFn(
+        doc='/** Execute a task */',
+        head=['void Run(u32 method, Task *task, RunContext &rctx) override {'],
+        params='Task *task, RunContext &rctx',
+        args='task, rctx',
+        body=['{self}{method_name}(reinterpret_cast<{task_name} *>(task), rctx);'],
+        stats='run'),
+    DispatchFn(
+        doc='/** Execute a task */',
+        head=['void Monitor(MonitorModeId mode, MethodId method, Task *task, RunContext &rctx) override {'],
+        params='MonitorModeId mode, Task *task, RunContext &rctx',
+        args='mode, task, rctx',
+        body=['{self}Monitor{method_name}(mode, reinterpret_cast<{task_name} *>(task), rctx);']),
+    DispatchFn(
+        doc='/** Delete a task */',
+        head=['void Del(const hipc::MemContext &mctx, u32 method, Task *task) override {'],
+        params='const hipc::MemContext &mctx, Task *task',
+        args='mctx, task',
+        body=['CHI_CLIENT->DelTask<{task_name}>(mctx, reinterpret_cast<{task_name} *>(task));'],
+        decl='void {name}(const hipc::MemContext &mctx, u32 method, Task *task)',
+        call='{name}(mctx, method, task)'),
+    DispatchFn(
+        doc='/** Duplicate a task */',
+        head=['void CopyStart(u32 method, const Task *orig_task, Task *dup_task, bool deep) override {'],
+        params='const Task *orig_task, Task *dup_task, bool deep',
+        args='orig_task, dup_task, deep',
+        body=['chi::CALL_COPY_START(',
+              '  reinterpret_cast<const {task_name}*>(orig_task), ',
+              '  reinterpret_cast<{task_name}*>(dup_task), deep);'],
+        decl='void {name}(u32 method, const Task *orig_task, Task *dup_task, bool deep)',
+        call='{name}(method, orig_task, dup_task, deep)'),
+    DispatchFn(
+        doc='/** Duplicate a task */',
+        head=['void NewCopyStart(u32 method, const Task *orig_task, FullPtr<Task> &dup_task, bool deep) override {'],
+        params='const Task *orig_task, FullPtr<Task> &dup_task, bool deep',
+        args='orig_task, dup_task, deep',
+        body=['chi::CALL_NEW_COPY_START(reinterpret_cast<const {task_name}*>(orig_task), dup_task, deep);'],
+        decl='void {name}(u32 method, const Task *orig_task, FullPtr<Task> &dup_task, bool deep)',
+        call='{name}(method, orig_task, dup_task, deep)'),
+    DispatchFn(
+        doc='/** Serialize a task when initially pushing into remote */',
+        head=['void SaveStart(',
+              '    u32 method, BinaryOutputArchive<true> &ar,',
+              '    Task *task) override {'],
+        params='BinaryOutputArchive<true> &ar, Task *task',
+        args='ar, task',
+        body=['ar << *reinterpret_cast<{task_name}*>(task);'],
+        stats='save',
+        decl='void {name}(u32 method, BinaryOutputArchive<true> &ar, Task *task)',
+        call='{name}(method, ar, task)'),
+    DispatchFn(
+        doc='/** Deserialize a task when popping from remote queue */',
+        head=['TaskPointer LoadStart(    u32 method, BinaryInputArchive<true> &ar) override {'],
+        params='BinaryInputArchive<true> &ar, TaskPointer &task_ptr',
+        args='ar, task_ptr',
+        body=['task_ptr.ptr_ = CHI_CLIENT->NewEmptyTask<{task_name}>(',
+              '       HSHM_DEFAULT_MEM_CTX, task_ptr.shm_);',
+              'ar >> *reinterpret_cast<{task_name}*>(task_ptr.ptr_);'],
+        prologue=['  TaskPointer task_ptr;'],
+        epilogue=['  return task_ptr;'],
+        ret='task_ptr',
+        stats='load',
+        decl='TaskPointer {name}(u32 method, BinaryInputArchive<true> &ar)',
+        call='{name}(method, ar)'),
+    DispatchFn(
+        doc='/** Serialize a task when returning from remote queue */',
+        head=['void SaveEnd(u32 method, BinaryOutputArchive<false> &ar, Task *task) override {'],
+        params='BinaryOutputArchive<false> &ar, Task *task',
+        args='ar, task',
+        body=['ar << *reinterpret_cast<{task_name}*>(task);'],
+        stats='save',
+        decl='void {name}(u32 method, BinaryOutputArchive<false> &ar, Task *task)',
+        call='{name}(method, ar, task)'),
+    DispatchFn(
+        doc='/** Deserialize a task when popping from remote queue */',
+        head=['void LoadEnd(u32 method, BinaryInputArchive<false> &ar, Task *task) override {'],
+        params='BinaryInputArchive<false> &ar, Task *task',
+        args='ar, task',
+        body=['ar >> *reinterpret_cast<{task_name}*>(task);'],
+        stats='load',
+        decl='void {name}(u32 method, BinaryInputArchive<false> &ar, Task *task)',
+        call='{name}(method, ar, task)'),
+]
+
+
+def lib_exec_context(text, lib_exec_h):
+    """
+    The #include lines and the namespaces of the runtime class, from the
+    text of MOD_NAME_runtime.cc, so that MOD_NAME_lib_exec.cc sees the
+    same declarations. The includes are those before the first namespace,
+    and the namespaces are those open where lib_exec_h is included, as
+    a list from the outermost. Namespaces are closed by a line starting
+    with "}  // namespace". Raises ValueError if lib_exec_h is not
+    included.
+    """
+    includes = []
+    namespaces = []
+    for line in text.splitlines():
+        if lib_exec_h in line and _INCLUDE_RE.match(line):
+            return includes, namespaces
+        match = _NAMESPACE_RE.match(line)
+        if match:
+            namespaces.append(match.group(1))
+        elif _NAMESPACE_END_RE.match(line) and namespaces:
+            namespaces.pop()
+        elif _INCLUDE_RE.match(line) and not namespaces:
+            includes.append(line.strip())
+    raise ValueError(f'the runtime does not include {lib_exec_h}')
+
+
+def table_extent(method_ids):
+    """
+    The number of table slots to emit for a sorted list of method ids.
+    """
+    extent = 0
+    for count, method_id in enumerate(method_ids, 1):
+        if method_id + 1 <= max(TABLE_MIN_SLOTS, count * TABLE_MAX_SPARSITY):
+            extent = method_id + 1
+    return extent
+
+
+def _case_lines(fn, entry, indent, self_prefix):
+    for line in fn.body:
+        yield indent + line.format(method_name=entry.name,
+                                   task_name=entry.task_name,
+                                   self=self_prefix)
+
+
+def render_switch(fn, methods, indent='  '):
+    """
+    Renders the cases of a switch over methods, a list of MethodEntry.
+    """
+    yield f'{indent}switch (method) {{'
+    for entry in methods:
+        yield f'{indent}  case Method::{entry.enum_name}: {{'
+        yield from _case_lines(fn, entry, indent + '    ', '')
+        yield f'{indent}    break;'
+        yield f'{indent}  }}'
+    yield f'{indent}}}'
+
+
+def render_stats_scope(stats, indent='  '):
+    """
+    Renders the statement that records stats of the given kind for the
+    rest of the enclosing scope. It is guarded by STATS_MACRO and the
+    recording is done by a destructor, so it also covers early returns.
+    """
+    if stats is None:
+        return
+    if stats == 'run':
+        scope = 'MethodStatsRun chi_stats_(method);'
+    else:
+        scope = f'MethodStatsBytes<{str(stats == "save").lower()}, ' \
+                f'decltype(ar)> chi_stats_(method, ar);'
+    yield f'#ifdef {STATS_MACRO}'
+    yield f'{indent}{scope}'
+    yield '#endif'
+
+
+def render_stats_table():
+    """
+    Renders the per-module stats table, indexed by method id, and the
+    scopes that fill it in. These are nested in the runtime class like the
+    dispatch functions, so each module has its own table. The archive
+    positions are read through CHI_METHOD_STATS_SAVE_POS and
+    CHI_METHOD_STATS_LOAD_POS, which can be defined to match the archive.
+    """
+    yield from _STATS_TABLE
+
+
+_STATS_TABLE = [
+    f'#ifdef {STATS_MACRO}',
+    '#ifndef CHI_METHOD_STATS_SAVE_POS',
+    '#define CHI_METHOD_STATS_SAVE_POS(ar) static_cast<u64>((ar).ss_.tellp())',
+    '#endif',
+    '#ifndef CHI_METHOD_STATS_LOAD_POS',
+    '#define CHI_METHOD_STATS_LOAD_POS(ar) static_cast<u64>((ar).ss_.tellg())',
+    '#endif',
+    '/** Per-method stats, recorded when built with ' + STATS_MACRO + ' */',
+    'struct MethodStats {',
+    '  /** Bucket b counts runs that took [2^b, 2^(b+1)) ns */',
+    '  static constexpr int kLatencyBuckets = 40;',
+    '  std::atomic<u64> calls_;',
+    '  std::atomic<u64> total_ns_;',
+    '  std::atomic<u64> latency_ns_[kLatencyBuckets];',
+    '  std::atomic<u64> save_bytes_;',
+    '  std::atomic<u64> load_bytes_;',
+    '};',
+    '/** The stats of this module, indexed by method id, with Method::kCount entries */',
+    'static MethodStats *GetMethodStats() {',
+    '  static MethodStats stats[Method::kCount];',
+    '  return stats;',
+    '}',
+    '/** Records a call and its latency when it goes out of scope */',
+    'class MethodStatsRun {',
+    ' public:',
+    '  explicit MethodStatsRun(u32 method)',
+    '      : method_(method), start_(std::chrono::steady_clock::now()) {}',
+    '  ~MethodStatsRun() {',
+    '    if (method_ >= Method::kCount) {',
+    '      return;',
+    '    }',
+    '    u64 ns = std::chrono::duration_cast<std::chrono::nanoseconds>(',
+    '        std::chrono::steady_clock::now() - start_).count();',
+    '    int bucket = 0;',
+    '    while ((ns >> (bucket + 1)) && bucket + 1 < MethodStats::kLatencyBuckets) {',
+    '      ++bucket;',
+    '    }',
+    '    MethodStats &stats = GetMethodStats()[method_];',
+    '    stats.calls_.fetch_add(1, std::memory_order_relaxed);',
+    '    stats.total_ns_.fetch_add(ns, std::memory_order_relaxed);',
+    '    stats.latency_ns_[bucket].fetch_add(1, std::memory_order_relaxed);',
+    '  }',
+    '',
+    ' private:',
+    '  u32 method_;',
+    '  std::chrono::steady_clock::time_point start_;',
+    '};',
+    '/** Records the bytes moved through an archive when it goes out of scope */',
+    'template <bool kSave, typename ArT>',
+    'class MethodStatsBytes {',
+    ' public:',
+    '  MethodStatsBytes(u32 method, ArT &ar)',
+    '      : method_(method), ar_(ar), start_(Pos(ar)) {}',
+    '  ~MethodStatsBytes() {',
+    '    if (method_ >= Method::kCount) {',
+    '      return;',
+    '    }',
+    '    MethodStats &stats = GetMethodStats()[method_];',
+    '    (kSave ? stats.save_bytes_ : stats.load_bytes_)',
+    '        .fetch_add(Pos(ar_) - start_, std::memory_order_relaxed);',
+    '  }',
+    '',
+    ' private:',
+    '  static u64 Pos(ArT &ar) {',
+    '    if constexpr (kSave) {',
+    '      return CHI_METHOD_STATS_SAVE_POS(ar);',
+    '    } else {',
+    '      return CHI_METHOD_STATS_LOAD_POS(ar);',
+    '    }',
+    '  }',
+    '  u32 method_;',
+    '  ArT &ar_;',
+    '  u64 start_;',
+    '};',
+    '#endif  // ' + STATS_MACRO,
+    '',
+]
+
+
+def render_dispatch_fn(fn, methods, mode):
+    """
+    Renders a complete dispatch function in the given mode.
+    """
+    yield fn.doc
+    yield from fn.head
+    yield from render_stats_scope(fn.stats)
+    yield from fn.prologue
+    if mode == 'table':
+        yield from render_table(fn, methods)
+    else:
+        yield from render_switch(fn, methods)
+    yield from fn.epilogue
+    yield '}'
+
+
+def render_free_fn(fn, methods, mode, prefix):
+    """
+    Renders fn as the free function prefix + name, for the generated
+    MOD_NAME_lib_exec.cc. Its stats are recorded by the forwarder.
+    """
+    yield fn.doc
+    yield fn.decl.format(name=prefix + fn.name) + ' {'
+    yield from fn.prologue
+    if mode == 'table':
+        yield from render_table(fn, methods, member=False)
+    else:
+        yield from render_switch(fn, methods)
+    yield from fn.epilogue
+    yield '}'
+
+
+def render_forward_fn(fn, prefix, source):
+    """
+    Renders the member function of the runtime class that records the
+    stats of fn and calls the free function prefix + name compiled in
+    source. The free function is declared in the block, which declares it
+    in the namespace of the runtime class, so the header needs no other
+    declaration.
+    """
+    name = prefix + fn.name
+    yield fn.doc
+    yield from fn.head
+    yield from render_stats_scope(fn.stats)
+    yield f'  // Compiled in {source}'
+    yield f'  {fn.decl.format(name=name)};'
+    yield f"  {'return ' if fn.decl.split()[0] != 'void' else ''}{fn.call.format(name=name)};"
+    yield '}'
+
+
+def render_table(fn, methods, member=True):
+    """
+    Renders a constexpr function-pointer table indexed by method id for the
+    dense ids, followed by a switch for the remaining sparse ids. The
+    entries take the runtime class as their first parameter, unless the
+    table is in a free function (not member).
+    """
+    extent = table_extent([entry.id for entry in methods])
+    if extent == 0:
+        yield from render_switch(fn, methods)
+        return
+    dense = {entry.id: entry for entry in methods if entry.id < extent}
+    sparse = [entry for entry in methods if entry.id >= extent]
+    ret = f'return {fn.ret};' if fn.ret else 'return;'
+    if member:
+        # Leave self unnamed when no case uses it to avoid unused warnings
+        uses_self = any('{self}' in line for line in fn.body)
+        self_param = 'SelfPtr self, ' if uses_self else 'SelfPtr, '
+        self_arg = 'this, '
+        yield '  using SelfPtr = decltype(this);'
+        yield f'  using DispatchFn = void (*)(SelfPtr, {fn.params});'
+    else:
+        self_param = self_arg = ''
+        yield f'  using DispatchFn = void (*)({fn.params});'
+    yield f'  static constexpr DispatchFn kDispatch[{extent}] = {{'
+    for method_id in range(extent):
+        entry = dense.get(method_id)
+        if entry is None:
+            yield f'    /* {method_id} */ nullptr,'
+            continue
+        yield f'    /* {entry.enum_name} */ []({self_param}{fn.params}) {{'
+        yield from _case_lines(fn, entry, '      ', 'self->')
+        yield '    },'
+    yield '  };'
+    yield f'  if (method < {extent} && kDispatch[method]) {{'
+    yield f'    kDispatch[method]({self_arg}{fn.args});'
+    yield f'    {ret}'
+    yield '  }'
+    if sparse:
+        yield from render_switch(fn, sparse)
+
+
+class BatchFn:
+    """
+    A batched dispatch function, emitted for modules with batchable
+    methods. It handles count tasks of one method with a single dispatch.
+
+    head: the signature lines, ending with the opening brace
+    loops: the per-method case body, as a list of loops over i in
+        [0, count). {task_name} is substituted.
+    fallback: the loop body for methods that are not batchable, which
+        calls the single-task function once per task. {prefix} is
+        substituted with the prefix of the free functions, if any.
+    stats: the kind of stats the batchable cases record. The fallback
+        is recorded by the single-task function.
+    decl/call: as in DispatchFn
+    """
+
+    def __init__(self, doc, head, loops, fallback, stats, decl, call):
+        self.doc = doc
+        self.head = head
+        self.loops = loops
+        self.fallback = fallback
+        self.stats = stats
+        self.decl = decl
+        self.call = call
+        self.name = _FN_NAME_RE.search(head[0]).group(1)
+
+
+BATCH_FNS = [
+    BatchFn(
+        doc='/** Serialize count tasks of one method when initially pushing into remote */',
+        head=['void SaveStartBatch(',
+              '    u32 method, BinaryOutputArchive<true> &ar,',
+              '    Task **tasks, size_t count) {'],
+        loops=[['ar << *reinterpret_cast<{task_name}*>(tasks[i]);']],
+        fallback=['{prefix}SaveStart(method, ar, tasks[i]);'],
+        stats='save',
+        decl='void {name}(u32 method, BinaryOutputArchive<true> &ar, Task **tasks, size_t count)',
+        call='{name}(method, ar, tasks, count)'),
+    BatchFn(
+        doc='/** Deserialize count tasks of one method when popping from remote queue */',
+        head=['void LoadStartBatch(',
+              '    u32 method, BinaryInputArchive<true> &ar,',
+              '    TaskPointer *task_ptrs, size_t count) {'],
+        # Allocate every task before reading any, so the archive is read
+        # in one pass
+        loops=[['task_ptrs[i].ptr_ = CHI_CLIENT->NewEmptyTask<{task_name}>(',
+                '       HSHM_DEFAULT_MEM_CTX, task_ptrs[i].shm_);'],
+               ['ar >> *reinterpret_cast<{task_name}*>(task_ptrs[i].ptr_);']],
+        fallback=['task_ptrs[i] = {prefix}LoadStart(method, ar);'],
+        stats='load',
+        decl='void {name}(u32 method, BinaryInputArchive<true> &ar, TaskPointer *task_ptrs, size_t count)',
+        call='{name}(method, ar, task_ptrs, count)'),
+    BatchFn(
+        doc='/** Serialize count tasks of one method when returning from remote queue */',
+        head=['void SaveEndBatch(',
+              '    u32 method, BinaryOutputArchive<false> &ar,',
+              '    Task **tasks, size_t count) {'],
+        loops=[['ar << *reinterpret_cast<{task_name}*>(tasks[i]);']],
+        fallback=['{prefix}SaveEnd(method, ar, tasks[i]);'],
+        stats='save',
+        decl='void {name}(u32 method, BinaryOutputArchive<false> &ar, Task **tasks, size_t count)',
+        call='{name}(method, ar, tasks, count)'),
+    BatchFn(
+        doc='/** Deserialize count tasks of one method when popping from remote queue */',
+        head=['void LoadEndBatch(',
+              '    u32 method, BinaryInputArchive<false> &ar,',
+              '    Task **tasks, size_t count) {'],
+        loops=[['ar >> *reinterpret_cast<{task_name}*>(tasks[i]);']],
+        fallback=['{prefix}LoadEnd(method, ar, tasks[i]);'],
+        stats='load',
+        decl='void {name}(u32 method, BinaryInputArchive<false> &ar, Task **tasks, size_t count)',
+        call='{name}(method, ar, tasks, count)'),
+]
+
+
+def _loop_lines(body, indent, **fields):
+    yield f'{indent}for (size_t i = 0; i < count; ++i) {{'
+    for line in body:
+        yield f'{indent}  ' + line.format(**fields)
+    yield f'{indent}}}'
+
+
+def render_batch_fn(fn, methods, prefix=None):
+    """
+    Renders a batched dispatch function. methods are the batchable
+    MethodEntry objects; other methods fall back to the single-task
+    function. These functions do not override anything, so they compile
+    against runtimes that do not call them. With prefix, fn is rendered
+    as a free function (see render_free_fn).
+    """
+    yield fn.doc
+    if prefix is None:
+        yield from fn.head
+    else:
+        yield fn.decl.format(name=prefix + fn.name) + ' {'
+    yield '  switch (method) {'
+    for entry in methods:
+        yield f'    case Method::{entry.enum_name}: {{'
+        if prefix is None:
+            yield from render_stats_scope(fn.stats, '      ')
+        for body in fn.loops:
+            yield from _loop_lines(body, '      ', task_name=entry.task_name)
+        yield '      break;'
+        yield '    }'
+    yield '    default: {'
+    yield from _loop_lines(fn.fallback, '      ', prefix=prefix or '')
+    yield '      break;'
+    yield '    }'
+    yield '  }'
+    yield '}'
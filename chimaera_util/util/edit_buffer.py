@@ -0,0 +1,44 @@
+"""
+Append-only edit buffer used to insert method templates into tasks.h,
+client.h and runtime.cc.
+"""
+
+
+class EditBuffer:
+    """
+    Records insertions against an unmodified list of lines and applies
+    all of them in a single linear pass.
+
+    An insertion is anchored before an original line number. Insertions
+    that share an anchor are emitted in the order they were recorded, so
+    chaining one method after another is done by reusing the anchor.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.inserts = []
+
+    def insert(self, anchor, text):
+        """
+        Inserts text before original line anchor. An anchor equal to
+        len(lines) appends to the end of the file.
+        """
+        self.inserts.append((anchor, text))
+
+    def has_edits(self):
+        return len(self.inserts) > 0
+
+    def render(self):
+        """
+        Returns the edited file contents.
+        """
+        # sort is stable, so equal anchors keep their insertion order
+        inserts = sorted(self.inserts, key=lambda insert: insert[0])
+        out = []
+        pos = 0
+        for anchor, text in inserts:
+            out.extend(self.lines[pos:anchor])
+            out.append(text)
+            pos = anchor
+        out.extend(self.lines[pos:])
+        return ''.join(out)
@@ -0,0 +1,180 @@
+"""
+Embedding files in C/C++ headers. Inputs are streamed through a fixed
+size buffer, so the memory used does not depend on the size of the file.
+
+Modes:
+    macro   #define NAME followed by the lines of a text file
+    string  constexpr char NAME[], a string literal escaped byte by byte
+    bytes   constexpr unsigned char NAME[], one initializer per byte
+    embed   C23/C++26 #embed where the compiler supports it, falling
+            back to the bytes form otherwise
+"""
+
+import os
+import re
+
+EMBED_MODES = ['macro', 'string', 'bytes', 'embed']
+CHUNK_SIZE = 1 << 16
+BYTES_PER_LINE = 16
+# Longest run of a string literal on one line of the header
+STRING_LINE_MAX = 120
+
+_HEX = [f'0x{i:02x},' for i in range(256)]
+
+
+def _string_escape(byte):
+    char = chr(byte)
+    if char == '\n':
+        return '\\n'
+    if char in '"\\?':
+        # '?' is escaped so that "??x" is never read as a trigraph
+        return '\\' + char
+    if 0x20 <= byte < 0x7f:
+        return char
+    # Always 3 digits, so a following digit is not read as part of it
+    return f'\\{byte:03o}'
+
+
+_ESCAPE = [_string_escape(i) for i in range(256)]
+
+
+def macro_name(path):
+    """
+    The name of the symbol for path: its base name without extension,
+    in caps, with characters that are not valid in an identifier
+    replaced by '_'.
+    """
+    name = os.path.basename(path).upper().split('.')[0]
+    name = re.sub(r'[^A-Z0-9_]', '_', name)
+    if not name or name[0].isdigit():
+        name = f'_{name}'
+    return name
+
+
+def _read_chunks(path):
+    with open(path, 'rb') as fp:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def write_macro(path, name, out):
+    """
+    Writes the text file at path as #define name. This is the original
+    chi_make_macro format.
+    """
+    out.write(f'#define {name} \\\n')
+    with open(path) as fp:
+        sep = ''
+        try:
+            for line in fp:
+                # splitlines() of each line splits the text as splitlines()
+                # of the whole file does, including on \r and \r\n
+                for part in line.splitlines():
+                    out.write(sep)
+                    out.write(part)
+                    sep = ' \\\n'
+        except UnicodeDecodeError:
+            raise ValueError(f'{path} is not a text file, embed it with '
+                             f'the string or bytes mode') from None
+    out.write('\n')
+
+
+def write_string(path, name, out):
+    out.write(f'constexpr char {name}[] =\n')
+    size = 0
+    line = []
+    line_len = 0
+    for chunk in _read_chunks(path):
+        size += len(chunk)
+        for byte in chunk:
+            esc = _ESCAPE[byte]
+            line.append(esc)
+            line_len += len(esc)
+            if byte == 0x0a or line_len >= STRING_LINE_MAX:
+                out.write(f'  "{"".join(line)}"\n')
+                line = []
+                line_len = 0
+    if line or size == 0:
+        out.write(f'  "{"".join(line)}"\n')
+    out.write(';\n')
+    out.write(f'constexpr size_t {name}_SIZE = {size};\n')
+
+
+def _write_byte_lines(path, out):
+    """
+    Writes the bytes of path as initializers. Returns the number of bytes.
+    """
+    size = 0
+    tail = b''
+    for chunk in _read_chunks(path):
+        size += len(chunk)
+        chunk = tail + chunk
+        end = len(chunk) - len(chunk) % BYTES_PER_LINE
+        for i in range(0, end, BYTES_PER_LINE):
+            out.write('  ')
+            out.write(''.join(map(_HEX.__getitem__, chunk[i:i + BYTES_PER_LINE])))
+            out.write('\n')
+        tail = chunk[end:]
+    if tail:
+        out.write('  ')
+        out.write(''.join(map(_HEX.__getitem__, tail)))
+        out.write('\n')
+    return size
+
+
+def write_bytes(path, name, out):
+    out.write(f'alignas(8) constexpr unsigned char {name}[] = {{\n')
+    size = _write_byte_lines(path, out)
+    if size == 0:
+        # Zero-length arrays are not valid C++
+        out.write('  0x00,\n')
+    out.write('};\n')
+    out.write(f'constexpr size_t {name}_SIZE = {size};\n')
+
+
+def write_embed(path, name, out, embed_path=None):
+    """
+    #embed with a byte array fallback. embed_path is the path written in
+    the #embed directive; it must be resolvable from the output header.
+    """
+    embed_path = embed_path or os.path.abspath(path)
+    if os.path.getsize(path) == 0:
+        # #embed of an empty file leaves an empty initializer list
+        write_bytes(path, name, out)
+        return
+    out.write('#if defined(__has_embed)\n')
+    out.write(f'#if __has_embed("{embed_path}") == __STDC_EMBED_FOUND__\n')
+    out.write(f'#define {name}_HAS_EMBED\n')
+    out.write('#endif\n')
+    out.write('#endif\n')
+    out.write(f'#ifdef {name}_HAS_EMBED\n')
+    out.write(f'alignas(8) constexpr unsigned char {name}[] = {{\n')
+    out.write(f'#embed "{embed_path}"\n')
+    out.write('};\n')
+    out.write(f'constexpr size_t {name}_SIZE = sizeof({name});\n')
+    out.write('#else\n')
+    write_bytes(path, name, out)
+    out.write('#endif\n')
+
+
+def write_embedded(path, name, out, mode='macro', out_dir=None):
+    """
+    Writes path to out in the given mode. out_dir is the directory of the
+    output header, used to make #embed paths relative to it.
+    """
+    if mode == 'macro':
+        write_macro(path, name, out)
+    elif mode == 'string':
+        write_string(path, name, out)
+    elif mode == 'bytes':
+        write_bytes(path, name, out)
+    elif mode == 'embed':
+        embed_path = None
+        if out_dir is not None:
+            embed_path = os.path.relpath(os.path.abspath(path), out_dir)
+        write_embed(path, name, out, embed_path)
+    else:
+        raise ValueError(f'Unknown embed mode {mode}, expected one of {EMBED_MODES}')
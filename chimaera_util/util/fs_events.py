@@ -0,0 +1,142 @@
+"""
+File system change notification for watch mode. Both backends watch
+directories and report the paths inside them that changed; inotify is
+used on Linux and a stat-polling backend everywhere else.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyEvents:
+    """
+    inotify through ctypes. wait() returns the changed paths, [] on
+    timeout, or None if the kernel queue overflowed and events were lost.
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.dirs = {}
+
+    def watch_dir(self, path):
+        if path in self.dirs.values():
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.dirs[wd] = path
+
+    def wait(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        paths = []
+        lost = False
+        off = 0
+        while off < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, off)
+            off += EVENT_HEADER.size
+            name = data[off:off + length].rstrip(b'\0')
+            off += length
+            if mask & IN_Q_OVERFLOW:
+                lost = True
+                continue
+            dir_path = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if dir_path is None:
+                continue
+            paths.append(os.path.join(dir_path, os.fsdecode(name)) if name else dir_path)
+        return None if lost else paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollEvents:
+    """
+    Polls the size and mtime of every entry of the watched directories.
+    Has the same interface as InotifyEvents.
+    """
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.dirs = {}
+
+    def watch_dir(self, path):
+        if path not in self.dirs:
+            self.dirs[path] = self._scan(path)
+
+    def _scan(self, path):
+        states = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    states[entry.path] = (st.st_size, st.st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return states
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+            paths = []
+            for path, old in list(self.dirs.items()):
+                new = self._scan(path)
+                if new is None:
+                    del self.dirs[path]
+                    paths.append(path)
+                    continue
+                if new != old:
+                    self.dirs[path] = new
+                    paths += [entry for entry in new.keys() | old.keys()
+                              if new.get(entry) != old.get(entry)]
+            if paths or (deadline is not None and time.monotonic() >= deadline):
+                return paths
+
+    def close(self):
+        pass
+
+
+def make_fs_events(poll=False, interval=0.5):
+    """
+    inotify when available (and poll is not set), polling otherwise.
+    """
+    if not poll:
+        try:
+            return InotifyEvents()
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollEvents(interval)
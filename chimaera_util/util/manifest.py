@@ -0,0 +1,176 @@
+"""
+Tracks the inputs each module was last refreshed from, so that
+chi_refresh_repo can skip modules whose inputs have not changed.
+"""
+
+import hashlib
+import json
+import os
+from chimaera_util.util.output import write_if_changed
+
+MANIFEST_NAME = '.chimaera_refresh.json'
+MANIFEST_VERSION = 1
+_CODEGEN_VERSION = None
+
+
+def codegen_version():
+    """
+    Hash of the chimaera_util sources. Any change to the code generator
+    invalidates every module in the manifest. Computed once per process.
+    """
+    global _CODEGEN_VERSION
+    if _CODEGEN_VERSION is None:
+        pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        digest = hashlib.sha1()
+        # sorted() orders the whole walk by directory
+        for dirpath, _, filenames in sorted(os.walk(pkg_dir)):
+            for name in sorted(filenames):
+                if not name.endswith('.py'):
+                    continue
+                with open(os.path.join(dirpath, name), 'rb') as fp:
+                    digest.update(name.encode())
+                    digest.update(fp.read())
+        _CODEGEN_VERSION = digest.hexdigest()
+    return _CODEGEN_VERSION
+
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_state(path, old_state=None):
+    """
+    Returns [size, mtime_ns, sha1] for path, or None if it does not exist.
+    The hash is reused from old_state when size and mtime are unchanged.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if old_state is not None and \
+            old_state[0] == st.st_size and old_state[1] == st.st_mtime_ns:
+        return old_state
+    return [st.st_size, st.st_mtime_ns, hash_file(path)]
+
+
+def mod_inputs(MOD_ROOT):
+    MOD_NAME = os.path.basename(MOD_ROOT)
+    return [
+        f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.yaml',
+        f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_tasks.h',
+        f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_client.h',
+        f'{MOD_ROOT}/src/{MOD_NAME}_runtime.cc',
+    ]
+
+
+def mod_outputs(MOD_ROOT):
+    MOD_NAME = os.path.basename(MOD_ROOT)
+    return [
+        f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.h',
+        f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_lib_exec.h',
+        f'{MOD_ROOT}/include/{MOD_NAME}/{MOD_NAME}_methods.compiled.yaml',
+    ]
+
+
+def saved_settings(MOD_REPO_DIR):
+    """
+    The codegen settings the repo was last refreshed with, or None if
+    it has no manifest.
+    """
+    try:
+        with open(os.path.join(MOD_REPO_DIR, MANIFEST_NAME)) as fp:
+            return json.load(fp).get('repo', {}).get('settings')
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class RefreshManifest:
+    """
+    The manifest lives at MOD_REPO_DIR/.chimaera_refresh.json. It stores
+    the codegen version, the codegen settings and the chimaera_repo.yaml
+    hash for the whole repo, and a [size, mtime_ns, sha1] triple for each
+    input of each module.
+    A module is fresh when none of these changed and all of its generated
+    outputs still exist.
+    """
+
+    def __init__(self, MOD_REPO_DIR, settings=None):
+        self.repo_dir = os.path.abspath(MOD_REPO_DIR)
+        self.path = os.path.join(self.repo_dir, MANIFEST_NAME)
+        self.modules = {}
+        self.dirty = False
+        self.repo_key = {
+            'version': MANIFEST_VERSION,
+            'codegen': codegen_version(),
+            'settings': settings or {},
+            'repo_config': file_state(
+                os.path.join(self.repo_dir, 'chimaera_repo.yaml')),
+        }
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            return
+        old_key = data.get('repo', {})
+        if old_key.get('version') != MANIFEST_VERSION or \
+                old_key.get('codegen') != self.repo_key['codegen'] or \
+                old_key.get('settings') != self.repo_key['settings']:
+            return
+        old_conf = old_key.get('repo_config')
+        new_conf = self.repo_key['repo_config']
+        if (old_conf is None) != (new_conf is None) or \
+                (old_conf and old_conf[2] != new_conf[2]):
+            return
+        self.modules = data.get('modules', {})
+
+    def is_fresh(self, MOD_ROOT):
+        entry = self.modules.get(os.path.basename(MOD_ROOT))
+        if entry is None:
+            return False
+        for path in mod_outputs(MOD_ROOT):
+            if not os.path.exists(path):
+                return False
+        old_inputs = entry['inputs']
+        for path in mod_inputs(MOD_ROOT):
+            key = os.path.relpath(path, self.repo_dir)
+            old_state = old_inputs.get(key)
+            new_state = file_state(path, old_state)
+            if new_state is old_state:
+                continue
+            if old_state is None or new_state is None or \
+                    old_state[2] != new_state[2]:
+                return False
+            # Touched but identical: remember the new mtime
+            old_inputs[key] = new_state
+            self.dirty = True
+        return True
+
+    def record(self, MOD_ROOT):
+        inputs = {os.path.relpath(path, self.repo_dir): file_state(path)
+                  for path in mod_inputs(MOD_ROOT)}
+        self.modules[os.path.basename(MOD_ROOT)] = {'inputs': inputs}
+        self.dirty = True
+
+    def forget(self, MOD_ROOT):
+        if self.modules.pop(os.path.basename(MOD_ROOT), None) is not None:
+            self.dirty = True
+
+    def prune(self, MOD_NAMES):
+        for MOD_NAME in list(self.modules):
+            if MOD_NAME not in MOD_NAMES:
+                del self.modules[MOD_NAME]
+                self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {'repo': self.repo_key, 'modules': self.modules}
+        write_if_changed(self.path, json.dumps(data, indent=1, sort_keys=True))
+        self.dirty = False
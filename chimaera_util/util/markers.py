@@ -0,0 +1,88 @@
+"""
+Single-pass index of the codegen markers in tasks.h, client.h and
+runtime.cc. One compiled regex is run over the whole file, recording
+where each CHI_BEGIN, CHI_END, struct XTask and CHI_AUTOGEN_METHODS
+appears.
+"""
+
+import re
+from chimaera_util.util.profile import PROFILER
+
+AUTOGEN_MARKER = 'CHI_AUTOGEN_METHODS'
+# The CHI_ alternatives share a prefix so the regex engine only has to
+# look at two literals per position.
+# The groups stop at the end of the line, as the markers are per-line.
+MARKER_RE = re.compile(
+    r'struct[ \t]+(?P<struct>\w+)Task\s*:'
+    r'|CHI_(?:BEGIN\((?P<begin>[^)\n]*)\)'
+    r'|END\((?P<end>[^)\n]*)\)'
+    r'|(?P<autogen>AUTOGEN_METHODS))')
+
+
+def split_lines(text):
+    """
+    Splits text into lines ending in newline, like readlines().
+    """
+    lines = text.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+class MarkerIndex:
+    """
+    The markers of a single file.
+
+    lines: the file contents as a list of lines
+    task_names: the task name mentioned on each marker line, in order.
+        When a line has several markers, struct wins over CHI_BEGIN,
+        which wins over CHI_END.
+    chi_ends: maps a method name to the line of its (last) CHI_END.
+        CHI_AUTOGEN_METHODS maps to the line of the autogen marker.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.lines = split_lines(text)
+        self.task_names = []
+        self.chi_ends = {}
+        self._index()
+
+    @staticmethod
+    def from_file(path):
+        with PROFILER.phase('index_markers'):
+            with open(path) as fp:
+                text = fp.read()
+            PROFILER.count('bytes_read', len(text))
+            return MarkerIndex(text)
+
+    def _index(self):
+        line_no = 0
+        pos = 0
+        cur_line = -1
+        cur = {}
+        for match in MARKER_RE.finditer(self.text):
+            line_no += self.text.count('\n', pos, match.start())
+            pos = match.start()
+            if line_no != cur_line:
+                self._commit_line(cur_line, cur)
+                cur_line = line_no
+                cur = {}
+            kind = match.lastgroup
+            if kind not in cur:
+                cur[kind] = match.group(kind)
+        self._commit_line(cur_line, cur)
+
+    def _commit_line(self, line_no, markers):
+        if not markers:
+            return
+        for kind in ('struct', 'begin', 'end'):
+            if kind in markers:
+                self.task_names.append(markers[kind])
+                break
+        if 'end' in markers:
+            self.chi_ends[markers['end']] = line_no
+        elif 'autogen' in markers:
+            self.chi_ends[AUTOGEN_MARKER] = line_no
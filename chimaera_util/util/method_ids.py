@@ -0,0 +1,259 @@
+"""
+Method id allocation. Ids of a module's methods are dense when they run
+from FIRST_METHOD_ID without gaps, which keeps the generated dispatch
+and anything the runtime sizes by kCount small. The ids a module has
+published can be persisted in MOD_NAME_methods.abi.yaml (codegen option
+abi), so that the id of a removed method is not handed to a new one.
+"""
+
+import os
+import re
+from chimaera_util.util.output import write_if_changed
+
+# Ids below this are reserved for the methods every module has
+FIRST_METHOD_ID = 10
+# The per-method flags a methods yaml may set:
+#   batchable: emit batched (de)serialization for the method's tasks
+METHOD_FLAGS = ('batchable',)
+
+
+class AbiMap:
+    """
+    The persisted ids of a module. methods maps each method to its id;
+    retired maps removed methods to the id they had, which stays
+    reserved. version counts the compactions.
+    """
+
+    def __init__(self, methods=None, retired=None, version=1):
+        self.methods = dict(methods or {})
+        self.retired = dict(retired or {})
+        self.version = version
+
+    @staticmethod
+    def load(path):
+        """
+        Returns the AbiMap stored at path, or None if there is none.
+        """
+        if not os.path.exists(path):
+            return None
+        from chimaera_util.util.config import load_yaml
+        data = load_yaml(path) or {}
+        return AbiMap(data.get('methods'), data.get('retired'),
+                      data.get('abi_version', 1))
+
+    def save(self, path, mod_name):
+        lines = [f'# Method ids of {mod_name}. Written by chi refresh; commit this file.',
+                 '# Listed ids only change with chi methods --renumber or --compact.',
+                 f'abi_version: {self.version}',
+                 'methods:']
+        lines += [f'  {name}: {method_id}' for name, method_id in
+                  sorted(self.methods.items(), key=lambda item: (item[1], item[0]))]
+        if self.retired:
+            lines.append('retired:')
+            lines += [f'  {name}: {method_id}' for name, method_id in
+                      sorted(self.retired.items(), key=lambda item: (item[1], item[0]))]
+        return write_if_changed(path, '\n'.join(lines) + '\n')
+
+    def reserved(self):
+        return set(self.methods.values()) | set(self.retired.values())
+
+
+def split_method_defs(method_defs):
+    """
+    Splits the methods of a methods yaml into {name: id or None} and
+    {name: {flag: value}}. A method is either an id (kFoo: 10) or a
+    mapping of its id and flags (kFoo: {id: 10, batchable: true}).
+    """
+    ids = {}
+    flags = {}
+    for name, value in method_defs.items():
+        if isinstance(value, dict):
+            value = dict(value)
+            unknown = sorted(set(value) - {'id'} - set(METHOD_FLAGS))
+            if unknown:
+                raise ValueError(f'Unknown keys {unknown} in method {name}, '
+                                 f'expected id or one of {list(METHOD_FLAGS)}')
+            ids[name] = value.pop('id', None)
+            flags[name] = value
+        else:
+            ids[name] = value
+    return ids, flags
+
+
+def allocate_ids(method_defs, abi=None, abi_path='the ABI map', renumber=False):
+    """
+    Resolves the ids of method_defs ({name: id or None}). None ids get
+    the id the method had in abi, if any, else the lowest free id from
+    FIRST_METHOD_ID up that abi has never used. Raises ValueError if an
+    id is used twice and, unless renumber, if a published id would change
+    or a published (or retired) id is given to another method. Returns
+    (ids, assigned): all ids, and just the newly assigned ones.
+    """
+    abi = abi or AbiMap()
+    published = {method_id: name for name, method_id in abi.retired.items()}
+    published.update((method_id, name) for name, method_id in abi.methods.items())
+    ids = {}
+    owners = {}
+    for name, method_id in method_defs.items():
+        if method_id is None:
+            continue
+        if not isinstance(method_id, int):
+            raise ValueError(f'Method id of {name} must be an integer, not {method_id!r}')
+        old_id = abi.methods.get(name, abi.retired.get(name))
+        if not renumber and old_id is not None and old_id != method_id:
+            raise ValueError(
+                f'Method id of {name} changed from {old_id} to {method_id}; published ids '
+                f'only change with chi methods --renumber or --compact')
+        owner = published.get(method_id)
+        if not renumber and owner is not None and owner != name:
+            raise ValueError(
+                f'Method id {method_id} of {name} is published for {owner} in {abi_path}; '
+                f'published ids only change with chi methods --renumber or --compact')
+        if method_id >= 0 and method_id in owners:
+            raise ValueError(f'Method id {method_id} is used by both '
+                             f'{owners[method_id]} and {name}')
+        owners[method_id] = name
+        ids[name] = method_id
+
+    assigned = {}
+    reserved = abi.reserved() | set(owners)
+    free = free_ids(reserved)
+    for name, method_id in method_defs.items():
+        if method_id is not None:
+            continue
+        method_id = abi.methods.get(name)
+        if method_id is not None and method_id in owners:
+            raise ValueError(f'{owners[method_id]} uses id {method_id}, '
+                             f'which is published for {name}')
+        if method_id is None:
+            method_id = abi.retired.get(name)
+        if method_id is None or method_id in owners:
+            method_id = next(free)
+        owners[method_id] = name
+        ids[name] = assigned[name] = method_id
+    return {name: ids[name] for name in method_defs}, assigned
+
+
+def free_ids(reserved, start=FIRST_METHOD_ID):
+    """
+    Yields the ids from start up that are not in reserved.
+    """
+    method_id = start
+    while True:
+        if method_id not in reserved:
+            yield method_id
+        method_id += 1
+
+
+def update_abi(abi, ids):
+    """
+    Records ids in abi. Methods no longer defined are retired, and
+    methods defined again leave retirement. A retired id that was
+    renumbered to another method is dropped.
+    """
+    abi = abi or AbiMap()
+    for name, method_id in list(abi.methods.items()):
+        if name not in ids:
+            abi.retired[name] = method_id
+            del abi.methods[name]
+    for name, method_id in ids.items():
+        if method_id >= 0:
+            abi.methods[name] = method_id
+            abi.retired.pop(name, None)
+    live = set(abi.methods.values())
+    abi.retired = {name: method_id for name, method_id in abi.retired.items()
+                   if method_id not in live}
+    return abi
+
+
+def compact_ids(ids):
+    """
+    Renumbers the ids from FIRST_METHOD_ID up densely, keeping their
+    order. Returns {name: new id} of the methods whose id changes.
+    """
+    user_ids = sorted((method_id, name) for name, method_id in ids.items()
+                      if method_id >= FIRST_METHOD_ID)
+    return {name: new_id for new_id, (old_id, name) in
+            enumerate(user_ids, FIRST_METHOD_ID) if new_id != old_id}
+
+
+def id_report(ids, abi=None):
+    """
+    Describes the ids from FIRST_METHOD_ID up: (count, kCount, gaps,
+    density). gaps are the unused ids below the highest one, with the
+    retired ones that reserve them; density is count over the ids spanned.
+    """
+    user_ids = sorted(method_id for method_id in ids.values()
+                      if method_id >= FIRST_METHOD_ID)
+    if not user_ids:
+        return 0, max(list(ids.values()) + [-1]) + 1, [], 1.0
+    retired = {method_id: name for name, method_id in
+               (abi.retired.items() if abi else [])}
+    used = set(user_ids)
+    gaps = [(method_id, retired.get(method_id))
+            for method_id in range(FIRST_METHOD_ID, user_ids[-1])
+            if method_id not in used]
+    span = user_ids[-1] - FIRST_METHOD_ID + 1
+    return len(user_ids), user_ids[-1] + 1, gaps, len(user_ids) / span
+
+
+_KEY_RE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)([ \t]*:[ \t]*)([^#\r\n]*?)([ \t]*(?:#.*)?)(\r?\n?)$')
+_FLOW_ID_RE = re.compile(r'(\bid[ \t]*:[ \t]*)([^,}]*)')
+_BLOCK_ID_RE = re.compile(r'^([ \t]+id[ \t]*:)[ \t]*([^#\r\n]*?)([ \t]*(?:#.*)?)(\r?\n?)$')
+
+
+def set_ids(methods_yaml, ids):
+    """
+    Sets the ids of the top-level methods in the text of a methods yaml,
+    keeping its layout and comments. Methods may be plain (kFoo: 10) or
+    mappings with an id key, in flow or block style.
+    """
+    lines = methods_yaml.splitlines(keepends=True)
+    out = []
+    i = 0
+    while i < len(lines):
+        match = _KEY_RE.match(lines[i])
+        i += 1
+        if match is None or match.group(1) not in ids:
+            out.append(match.group() if match else lines[i - 1])
+            continue
+        name, sep, value, comment, eol = match.groups()
+        method_id = str(ids[name])
+        if comment.startswith('#'):
+            comment = ' ' + comment
+        if not sep.endswith((' ', '\t')):
+            sep += ' '
+        if value.startswith('{'):
+            if _FLOW_ID_RE.search(value):
+                value = _FLOW_ID_RE.sub(lambda m: m.group(1) + method_id, value, count=1)
+            else:
+                value = f'{{id: {method_id}, ' + value[1:].lstrip()
+            out.append(f'{name}{sep}{value}{comment}{eol}')
+            continue
+        if value:
+            out.append(f'{name}{sep}{method_id}{comment}{eol}')
+            continue
+        # An empty value is either null or a block mapping on the next lines
+        block = []
+        while i < len(lines) and (lines[i][:1] in (' ', '\t') or not lines[i].strip()):
+            block.append(lines[i])
+            i += 1
+        if not any(line.strip() for line in block):
+            out.append(f'{name}{sep}{method_id}{comment}{eol}')
+            out += block
+            continue
+        out.append(match.group())
+        for j, line in enumerate(block):
+            id_match = _BLOCK_ID_RE.match(line)
+            if id_match:
+                key, _, id_comment, id_eol = id_match.groups()
+                if id_comment.startswith('#'):
+                    id_comment = ' ' + id_comment
+                block[j] = f'{key} {method_id}{id_comment}{id_eol}'
+                break
+        else:
+            indent = next(line for line in block if line.strip())
+            indent = indent[:len(indent) - len(indent.lstrip())]
+            block.insert(0, f'{indent}id: {method_id}{eol or chr(10)}')
+        out += block
+    return ''.join(out)
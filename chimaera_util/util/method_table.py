@@ -0,0 +1,112 @@
+"""
+The methods of a module, as seen by the refresh. A MethodTable is built
+once per module from the methods yaml and the tasks already compiled into
+tasks.h, and is then read by every emitter and updated by the insertion
+stages.
+"""
+
+
+class MethodEntry:
+    """
+    A method of a module.
+
+    enum_name: the name in the methods yaml (kFoo)
+    name: the method name (Foo)
+    task_name: the task struct (FooTask)
+    id: the method id. Negative ids are disabled methods.
+    compiled: whether tasks.h already has the method
+    compiled_tmp: whether the method was inserted by this refresh
+    inserted: whether it was inserted after the method before it, as
+        opposed to appended at CHI_AUTOGEN_METHODS
+    flags: the per-method flags of the methods yaml (e.g., batchable)
+    """
+
+    __slots__ = ('enum_name', 'name', 'task_name', 'id',
+                 'compiled', 'compiled_tmp', 'inserted', 'flags')
+
+    def __init__(self, enum_name, method_id, compiled, flags=None):
+        self.enum_name = enum_name
+        self.name = enum_name.replace('k', '', 1)
+        self.task_name = self.name + 'Task'
+        self.id = method_id
+        self.compiled = compiled
+        self.compiled_tmp = None
+        self.inserted = False
+        self.flags = flags or {}
+
+    def compile_status(self):
+        """
+        The line recorded for the method in MOD_NAME_methods.compiled.yaml.
+        """
+        compiled = self.compiled if self.compiled_tmp is None else self.compiled_tmp
+        return f"{self.enum_name}: {{'val': {self.id}, 'compiled': {compiled}}}"
+
+
+class MethodTable:
+    """
+    The methods of a module, sorted by id.
+    """
+
+    __slots__ = ('entries', 'by_name')
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: entry.id)
+        self.by_name = {entry.enum_name: entry for entry in self.entries}
+
+    @classmethod
+    def build(cls, method_ids, compiled_task_names, flags=None):
+        """
+        Builds the table from {method name: id} and the task names found
+        in tasks.h. Methods in tasks.h are compiled, as are the required
+        methods (ids 0-2). Methods with ids from 10 up that are not in
+        tasks.h are new, and the refresh will insert them.
+        """
+        flags = flags or {}
+        methods = {}
+        for task_name in compiled_task_names:
+            enum_name = f'k{task_name}'
+            if enum_name in method_ids:
+                methods[enum_name] = (method_ids[enum_name], True)
+        for enum_name, method_id in method_ids.items():
+            if method_id < 0:
+                continue
+            if method_id <= 2:
+                # These are required methods
+                methods[enum_name] = (method_id, True)
+            if method_id < 10:
+                # TODO(llogan): Allow bootstrapping special methods
+                continue
+            if enum_name not in methods:
+                methods[enum_name] = (method_id, False)
+        return cls([MethodEntry(enum_name, method_id, compiled, flags.get(enum_name))
+                    for enum_name, (method_id, compiled) in methods.items()])
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, off):
+        return self.entries[off]
+
+    def get(self, enum_name):
+        return self.by_name.get(enum_name)
+
+    def dispatched(self):
+        """
+        The methods with a dispatch case, i.e., with a non-negative id.
+        """
+        return [entry for entry in self.entries if entry.id >= 0]
+
+    def flagged(self, flag):
+        """
+        The dispatched methods that set flag in the methods yaml.
+        """
+        return [entry for entry in self.dispatched() if entry.flags.get(flag)]
+
+    def count(self):
+        """
+        Method::kCount, one past the highest id.
+        """
+        return self.entries[-1].id + 1
@@ -0,0 +1,175 @@
+"""
+Shared output layer for generated files. Files are only rewritten when
+their bytes change, and are swapped in atomically so that readers (and
+concurrent refreshes) never observe a partially written file.
+"""
+
+import contextlib
+import filecmp
+import hashlib
+import os
+import tempfile
+from chimaera_util.util.profile import PROFILER
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_NAME = '.chimaera_repo.lock'
+# The number of bytes write_lines_if_changed buffers between writes
+STREAM_CHUNK = 1 << 16
+_HELD_LOCKS = {}
+# os.umask can only be read by setting it, which races with the threads
+# that write files, so it is read once at import.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_if_changed(path, text):
+    """
+    Writes text to path if the current contents differ. Returns True if
+    the file was rewritten, False if it was already up to date.
+    """
+    with PROFILER.phase('write'):
+        data = text.encode() if isinstance(text, str) else text
+        try:
+            with open(path, 'rb') as fp:
+                old_data = fp.read()
+            PROFILER.count('bytes_read', len(old_data))
+            if old_data == data:
+                PROFILER.count('files_skipped')
+                return False
+        except FileNotFoundError:
+            pass
+        atomic_write(path, data)
+        PROFILER.count('bytes_written', len(data))
+        PROFILER.count('files_rewritten')
+        return True
+
+
+@contextlib.contextmanager
+def stream_if_changed(path):
+    """
+    Yields a text file to stream the new contents of path into. The file
+    is written to a temporary next to path, compared with path in fixed
+    size chunks, and renamed over path only if they differ, so large
+    outputs never have to be held in memory.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirname, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with PROFILER.phase('write'):
+            with os.fdopen(fd, 'w', newline='') as fp:
+                yield fp
+            size = os.path.getsize(tmp_path)
+            if os.path.exists(path) and filecmp.cmp(tmp_path, path, shallow=False):
+                PROFILER.count('bytes_read', size)
+                PROFILER.count('files_skipped')
+                os.remove(tmp_path)
+                return
+            os.chmod(tmp_path, _file_mode(path))
+            os.replace(tmp_path, path)
+            PROFILER.count('bytes_written', size)
+            PROFILER.count('files_rewritten')
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_lines_if_changed(path, lines):
+    """
+    Streams lines, joined by newlines, into path with stream_if_changed,
+    so the lines can be generated as they are written. Lines are written
+    in chunks of about STREAM_CHUNK bytes. Returns the size and sha1 of
+    the contents.
+    """
+    digest = hashlib.sha1()
+    size = 0
+    with stream_if_changed(path) as fp:
+        def flush(chunk):
+            nonlocal size
+            data = ''.join(chunk).encode()
+            digest.update(data)
+            size += len(data)
+            fp.buffer.write(data)
+        chunk = []
+        chunk_len = 0
+        sep = ''
+        for line in lines:
+            # The separator goes before each line after the first
+            chunk.append(sep)
+            chunk.append(line)
+            sep = '\n'
+            chunk_len += len(line) + 1
+            if chunk_len >= STREAM_CHUNK:
+                flush(chunk)
+                chunk = []
+                chunk_len = 0
+        flush(chunk)
+    return size, digest.hexdigest()
+
+
+def atomic_write(path, data):
+    """
+    Writes data to a temporary file next to path and renames it over path.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=dirname, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.chmod(tmp_path, _file_mode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _file_mode(path):
+    """
+    Keep the mode of an existing file, otherwise use the umask default
+    that open() would have used.
+    """
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+class RepoLock:
+    """
+    Advisory lock on a module repository, held for the duration of a
+    with block. The lock is reentrant within a process so that nested
+    operations (e.g., make_repo -> refresh_repo_cmake) do not deadlock.
+    """
+
+    def __init__(self, MOD_REPO_DIR):
+        self.path = os.path.join(os.path.abspath(MOD_REPO_DIR), LOCK_NAME)
+
+    def __enter__(self):
+        held = _HELD_LOCKS.get(self.path)
+        if held is not None:
+            held[1] += 1
+            return self
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        _HELD_LOCKS[self.path] = [fd, 1]
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        held = _HELD_LOCKS[self.path]
+        held[1] -= 1
+        if held[1] == 0:
+            del _HELD_LOCKS[self.path]
+            if fcntl is not None:
+                fcntl.flock(held[0], fcntl.LOCK_UN)
+            os.close(held[0])
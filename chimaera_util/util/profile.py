@@ -0,0 +1,175 @@
+"""
+Lightweight instrumentation for the codegen tools. Records per-module,
+per-phase timings and I/O counters when enabled; when disabled, phase()
+returns a shared no-op context manager and count() returns immediately.
+"""
+
+import json
+import os
+import threading
+import time
+
+COUNTERS = ['bytes_read', 'bytes_written', 'files_rewritten', 'files_skipped']
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    def __init__(self, profiler, name, module):
+        self.profiler = profiler
+        self.name = name
+        self.module = module
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        end = time.perf_counter_ns()
+        self.profiler.events.append({
+            'name': self.name,
+            'module': self.module,
+            'start_ns': self.start,
+            'dur_ns': end - self.start,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+        })
+        return False
+
+
+class Profiler:
+    """
+    Collects phase timings and counters. Phases and counters are
+    attributed to the current module of the calling thread, which is set
+    with the module() context manager.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, enabled=None):
+        if enabled is not None:
+            self.enabled = enabled
+        self.origin_ns = time.perf_counter_ns()
+        self.events = []
+        self.counters = {}
+
+    def current_module(self):
+        return getattr(self.local, 'module', None)
+
+    def module(self, mod_name):
+        """
+        Attributes phases and counters to mod_name within a with block.
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return _ModuleScope(self, mod_name)
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name, self.current_module())
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        module = self.current_module()
+        with self.lock:
+            counters = self.counters.setdefault(module, dict.fromkeys(COUNTERS, 0))
+            counters[name] = counters.get(name, 0) + value
+
+    def drain(self):
+        """
+        Returns and clears what was recorded. Used to ship a worker
+        process's profile back to the parent.
+        """
+        data = {'events': self.events, 'counters': self.counters}
+        self.events = []
+        self.counters = {}
+        return data
+
+    def merge(self, data):
+        self.events += data['events']
+        for module, counters in data['counters'].items():
+            mine = self.counters.setdefault(module, dict.fromkeys(COUNTERS, 0))
+            for name, value in counters.items():
+                mine[name] = mine.get(name, 0) + value
+
+    def report(self):
+        """
+        A JSON-serializable summary: every phase, total time per module and
+        phase, and the I/O counters per module.
+        """
+        summary = {}
+        for event in self.events:
+            phases = summary.setdefault(str(event['module']), {})
+            phases[event['name']] = phases.get(event['name'], 0) + event['dur_ns'] / 1e9
+        return {
+            'total_s': (time.perf_counter_ns() - self.origin_ns) / 1e9,
+            'phases': [{
+                'name': event['name'],
+                'module': event['module'],
+                'start_s': (event['start_ns'] - self.origin_ns) / 1e9,
+                'dur_s': event['dur_ns'] / 1e9,
+                'pid': event['pid'],
+            } for event in self.events],
+            'summary': summary,
+            'counters': {str(module): counters
+                         for module, counters in self.counters.items()},
+        }
+
+    def chrome_trace(self):
+        """
+        The events in Chrome trace event format (chrome://tracing, Perfetto).
+        """
+        trace = [{
+            'name': event['name'],
+            'cat': str(event['module']),
+            'ph': 'X',
+            'ts': (event['start_ns'] - self.origin_ns) / 1e3,
+            'dur': event['dur_ns'] / 1e3,
+            'pid': event['pid'],
+            'tid': event['tid'],
+            'args': {'module': event['module']},
+        } for event in self.events]
+        return {
+            'traceEvents': trace,
+            'displayTimeUnit': 'ms',
+            'otherData': {'counters': {str(module): counters
+                                       for module, counters in self.counters.items()}},
+        }
+
+    def save(self, path, fmt='json'):
+        data = self.chrome_trace() if fmt == 'chrome' else self.report()
+        with open(path, 'w') as fp:
+            json.dump(data, fp, indent=1)
+
+
+class _ModuleScope:
+    def __init__(self, profiler, mod_name):
+        self.profiler = profiler
+        self.mod_name = mod_name
+
+    def __enter__(self):
+        self.prior = self.profiler.current_module()
+        self.profiler.local.module = self.mod_name
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.local.module = self.prior
+        return False
+
+
+PROFILER = Profiler()
@@ -0,0 +1,114 @@
+"""
+Module scaffolding: the module template (~/.chimaera/MOD_NAME) loaded
+into memory, and the manifests that describe many modules to create.
+"""
+
+import os
+import re
+from chimaera_util.util.config import load_yaml
+from chimaera_util.util.template_engine import Template, MODULE_SLOTS, MODULE_PATH_SLOTS
+from chimaera_util.util.method_ids import allocate_ids, split_method_defs
+
+ON_EXISTS = ['prompt', 'skip', 'overwrite', 'error']
+_IDENT_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class ModuleTemplate:
+    """
+    Every file of a module template, read and compiled once. Contents
+    are rendered for a module by replacing chimaera_MOD_NAME with
+    NAMESPACE_MOD_NAME and MOD_NAME with the module name; paths only
+    replace MOD_NAME.
+    """
+
+    def __init__(self, templ_dir):
+        self.templ_dir = templ_dir
+        self.files = []
+        for dirpath, dirnames, filenames in os.walk(templ_dir):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                with open(path) as fp:
+                    text = fp.read()
+                self.files.append((Template(os.path.relpath(path, templ_dir), MODULE_PATH_SLOTS),
+                                   Template(text, MODULE_SLOTS)))
+
+    def render(self, namespace, mod_name):
+        """
+        Returns the [(rel_path, text)] of the module.
+        """
+        values = (f'{namespace}_{mod_name}', mod_name)
+        return [(path_tmpl.render(mod_name), text_tmpl.render(*values))
+                for path_tmpl, text_tmpl in self.files]
+
+
+class ModSpec:
+    """
+    A module to scaffold: its name and the methods to add to its
+    methods yaml, as {method name: id or None}. None ids are assigned
+    the lowest free ids (see method_ids.allocate_ids).
+    """
+
+    def __init__(self, name, methods=None):
+        if not _IDENT_RE.match(name):
+            raise ValueError(f'Invalid module name: {name}')
+        self.name = name
+        if isinstance(methods, list):
+            methods = dict.fromkeys(methods)
+        self.methods = methods or {}
+        for method_name in self.methods:
+            if not _IDENT_RE.match(str(method_name)):
+                raise ValueError(f'Invalid method name in {name}: {method_name}')
+
+
+def load_mod_manifest(path):
+    """
+    Parses a module manifest. Returns (MOD_REPO_DIR, templ_dir, specs);
+    MOD_REPO_DIR and templ_dir are None if the manifest does not set them.
+
+        repo: mods            # relative to the manifest, default: its dir
+        template: ~/.chimaera/MOD_NAME
+        modules:
+          - compress
+          - name: encrypt
+            methods: [kEncrypt, kDecrypt]
+          - name: stats
+            methods: {kCollect: 10, kReport: null}
+    """
+    manifest = load_yaml(path) or {}
+    base_dir = os.path.dirname(os.path.abspath(path))
+    MOD_REPO_DIR = os.path.join(base_dir, os.path.expanduser(manifest.get('repo', '.')))
+    templ_dir = manifest.get('template')
+    if templ_dir is not None:
+        templ_dir = os.path.join(base_dir, os.path.expanduser(templ_dir))
+    specs = []
+    for entry in manifest.get('modules') or []:
+        if isinstance(entry, str):
+            specs.append(ModSpec(entry))
+        else:
+            specs.append(ModSpec(entry['name'], entry.get('methods')))
+    names = [spec.name for spec in specs]
+    dup = sorted({name for name in names if names.count(name) > 1})
+    if dup:
+        raise ValueError(f'Modules listed more than once in {path}: {dup}')
+    return MOD_REPO_DIR, templ_dir, specs
+
+
+def add_methods(methods_yaml, methods):
+    """
+    Appends methods ({name: id or None}) to the text of a methods yaml.
+    Methods already present are left alone.
+    """
+    import yaml
+    defined = yaml.safe_load(methods_yaml) or {}
+    defined.pop('codegen', None)
+    defined, _ = split_method_defs(defined)
+    new = {method_name: method_id for method_name, method_id in methods.items()
+           if method_name not in defined}
+    ids, _ = allocate_ids({**defined, **new})
+    lines = [f'{method_name}: {ids[method_name]}\n' for method_name in new]
+    if not lines:
+        return methods_yaml
+    if methods_yaml and not methods_yaml.endswith('\n'):
+        methods_yaml += '\n'
+    return methods_yaml + ''.join(lines)
@@ -0,0 +1,71 @@
+"""
+Single-pass template rendering. A template is compiled once against a
+fixed list of slot tokens (e.g., ##method_name##) into a printf-style
+format, so rendering substitutes every slot in one C-level pass and
+allocates only the result, however many slots and tokens there are.
+"""
+
+import functools
+import operator
+import re
+
+# Tokens of the method templates in chimaera_util.util.templates
+METHOD_SLOTS = ('##task_name##', '##method_name##', '##method_enum_name##')
+# Tokens of the files of the module template (~/.chimaera/MOD_NAME)
+MODULE_SLOTS = ('chimaera_MOD_NAME', 'MOD_NAME')
+# Tokens of the paths of the module template
+MODULE_PATH_SLOTS = ('MOD_NAME',)
+
+
+class Template:
+    """
+    text compiled against slots. render() takes one value per slot, in
+    the order of slots. Where tokens overlap (chimaera_MOD_NAME and
+    MOD_NAME), the longest token wins.
+    """
+
+    def __init__(self, text, slots):
+        self.slots = tuple(slots)
+        index = {slot: i for i, slot in enumerate(self.slots)}
+        pattern = re.compile('|'.join(
+            re.escape(slot) for slot in sorted(self.slots, key=len, reverse=True)))
+        # The value of each slot occurrence, in order
+        order = [index[match.group()] for match in pattern.finditer(text)]
+        self.fmt = pattern.sub('%s', text.replace('%', '%%'))
+        if len(order) == 1:
+            self.values_of = lambda values: (values[order[0]],)
+        elif order:
+            self.values_of = operator.itemgetter(*order)
+        else:
+            self.values_of = lambda values: ()
+
+    def render(self, *values):
+        return self.fmt % self.values_of(values)
+
+    def render_many(self, rows):
+        """
+        Renders the template once per row of values and concatenates them.
+        """
+        fmt = self.fmt
+        values_of = self.values_of
+        return ''.join([fmt % values_of(row) for row in rows])
+
+    def stream(self, rows, out):
+        """
+        Renders the template once per row of values into out.write.
+        """
+        fmt = self.fmt
+        values_of = self.values_of
+        write = out.write
+        for row in rows:
+            write(fmt % values_of(row))
+
+
+@functools.lru_cache(maxsize=None)
+def method_template(tmpl_str):
+    """
+    A method template (task_template, ...) compiled for
+    render(task_name, method_name, method_enum_name). Like the original
+    renderer, surrounding whitespace is stripped and a newline appended.
+    """
+    return Template(tmpl_str.strip() + '\n', METHOD_SLOTS)
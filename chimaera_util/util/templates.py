@@ -103,7 +103,7 @@ endif()
 if (NOT CHIMAERA_EXPORTED_TARGETS)
   set(CHIMAERA_EXPORTED_TARGETS {camel_ns})
 endif()
-
+{build}
 # ADD SUBDIRECTORIES
 {subdirs}
 
@@ -113,4 +113,100 @@ install(EXPORT ${{CHIMAERA_EXPORTED_TARGETS}}
         NAMESPACE {namespace}::
         DESTINATION cmake
 )
-"""
\ No newline at end of file
+"""
+
+# Emitted into the repo CMakeLists.txt before REPO_BUILD_CMAKE or
+# REPO_LIB_EXEC_CMAKE
+REPO_TARGETS_CMAKE = """
+# Collects the targets defined in DIR and its subdirectories
+function(chi_module_targets DIR OUT)
+  get_property(targets DIRECTORY ${DIR} PROPERTY BUILDSYSTEM_TARGETS)
+  get_property(subdirs DIRECTORY ${DIR} PROPERTY SUBDIRECTORIES)
+  foreach(subdir IN LISTS subdirs)
+    chi_module_targets(${subdir} sub_targets)
+    list(APPEND targets ${sub_targets})
+  endforeach()
+  set(${OUT} ${targets} PARENT_SCOPE)
+endfunction()
+"""
+
+# Emitted into the repo CMakeLists.txt when a module has a generated
+# src/MOD_NAME_lib_exec.cc (lib_exec: source)
+REPO_LIB_EXEC_CMAKE = """
+# GENERATED DISPATCH
+# Adds the generated MOD_NAME_lib_exec.cc of a module to the targets that
+# compile its MOD_NAME_runtime.cc
+function(chi_module_lib_exec MOD_DIR MOD_NAME)
+  chi_module_targets(${MOD_DIR} targets)
+  foreach(target IN LISTS targets)
+    get_target_property(sources ${target} SOURCES)
+    if (sources MATCHES "(^|[;/])${MOD_NAME}_runtime\\\\.cc(;|$)")
+      target_sources(${target} PRIVATE
+                     ${CMAKE_CURRENT_SOURCE_DIR}/${MOD_DIR}/src/${MOD_NAME}_lib_exec.cc)
+    endif()
+  endforeach()
+endfunction()
+"""
+
+# Emitted into the repo CMakeLists.txt when chimaera_repo.yaml has a
+# build: section (see chimaera_util.util.build)
+REPO_BUILD_CMAKE = """
+# BUILD ACCELERATION
+# Enables unity builds and precompiled headers on the targets of a module.
+# Targets compiled with the same type, definitions (including the
+# <target>_EXPORTS of shared libraries), options and libraries share the
+# precompiled header of the first such target. With TIME_TRACE, every
+# compile runs through "chi compile-launcher", which records its time in
+# CHI_COMPILE_TIMES_DIR for "chi compile-time".
+function(chi_accelerate_module MOD_DIR)
+  cmake_parse_arguments(ARG "UNITY;TIME_TRACE" "UNITY_BATCH" "PCH" ${ARGN})
+  if (ARG_TIME_TRACE)
+    find_program(CHI_PROGRAM chi REQUIRED)
+    if (NOT CHI_COMPILE_TIMES_DIR)
+      set(CHI_COMPILE_TIMES_DIR ${CMAKE_BINARY_DIR}/chi_compile_times
+          CACHE PATH "Where chi compile-launcher records compile times")
+    endif()
+  endif()
+  chi_module_targets(${MOD_DIR} targets)
+  foreach(target IN LISTS targets)
+    get_target_property(type ${target} TYPE)
+    if (NOT type MATCHES "^(STATIC_LIBRARY|SHARED_LIBRARY|MODULE_LIBRARY|OBJECT_LIBRARY|EXECUTABLE)$")
+      continue()
+    endif()
+    if (ARG_UNITY)
+      set_target_properties(${target} PROPERTIES
+                            UNITY_BUILD ON
+                            UNITY_BUILD_BATCH_SIZE ${ARG_UNITY_BATCH})
+    endif()
+    if (ARG_PCH)
+      get_target_property(defs ${target} COMPILE_DEFINITIONS)
+      get_target_property(opts ${target} COMPILE_OPTIONS)
+      get_target_property(libs ${target} LINK_LIBRARIES)
+      get_target_property(define_symbol ${target} DEFINE_SYMBOL)
+      if (NOT define_symbol AND type MATCHES "^(SHARED|MODULE)_LIBRARY$")
+        set(define_symbol ${target}_EXPORTS)
+      endif()
+      string(MD5 key "${type};${define_symbol};${defs};${opts};${libs};${ARG_PCH}")
+      get_property(owner GLOBAL PROPERTY CHI_PCH_${key})
+      if (owner)
+        target_precompile_headers(${target} REUSE_FROM ${owner})
+      else()
+        target_precompile_headers(${target} PRIVATE ${ARG_PCH})
+        set_property(GLOBAL PROPERTY CHI_PCH_${key} ${target})
+      endif()
+    endif()
+    if (ARG_TIME_TRACE)
+      set(chi_launcher ${CHI_PROGRAM} compile-launcher ${CHI_COMPILE_TIMES_DIR} ${MOD_DIR} --)
+      # Keep a launcher such as ccache after ours
+      get_target_property(launcher ${target} CXX_COMPILER_LAUNCHER)
+      if (launcher)
+        list(APPEND chi_launcher ${launcher})
+      endif()
+      set_target_properties(${target} PROPERTIES CXX_COMPILER_LAUNCHER "${chi_launcher}")
+      if (CMAKE_CXX_COMPILER_ID MATCHES "Clang")
+        target_compile_options(${target} PRIVATE -ftime-trace)
+      endif()
+    endif()
+  endforeach()
+endfunction()
+"""
@@ -0,0 +1,165 @@
+"""
+Watch mode for chi_refresh_repo. Keeps the repo state in memory and
+regenerates a module whenever one of its inputs (methods yaml, tasks.h,
+client.h, runtime.cc) changes.
+"""
+
+import os
+import time
+from chimaera_util.codegen import ChimaeraCodegen
+from chimaera_util.module import refresh_module
+from chimaera_util.util.fs_events import make_fs_events
+from chimaera_util.util.manifest import RefreshManifest, file_state, mod_inputs
+from chimaera_util.util.output import RepoLock
+
+
+class RepoWatcher:
+    """
+    Watches a module repository. Events are collected until no new event
+    arrives for debounce seconds, so a burst of saves causes a single
+    regeneration. A module is only regenerated if the contents of one of
+    its inputs changed; in particular, the files the codegen writes
+    itself do not retrigger it.
+    """
+
+    def __init__(self, MOD_REPO_DIR, options=None, debounce=0.2,
+                 poll=False, poll_interval=0.5):
+        self.repo_dir = os.path.abspath(MOD_REPO_DIR)
+        self.repo_yaml = os.path.join(self.repo_dir, 'chimaera_repo.yaml')
+        self.options = options or {}
+        self.debounce = debounce
+        self.events = make_fs_events(poll, poll_interval)
+        self.gen = ChimaeraCodegen()
+        # Per-module {input path: file_state} as of the last regeneration
+        self.states = {}
+        self.owner = {}
+        self.repo_state = None
+
+    def run(self, force=False, jobs=1):
+        """
+        Refreshes the whole repo once, then regenerates modules as their
+        inputs change until interrupted.
+        """
+        self.gen.refresh_repo(self.repo_dir, force=force, jobs=jobs,
+                              options=self.options)
+        self.repo_state = file_state(self.repo_yaml)
+        self.sync_modules()
+        print(f'Watching {self.repo_dir} ({type(self.events).__name__}), '
+              f'press Ctrl-C to stop')
+        try:
+            while True:
+                self.handle(self.collect())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.events.close()
+
+    def collect(self):
+        """
+        Blocks for the next event, then gathers events until the repo
+        has been quiet for debounce seconds. Returns the changed paths,
+        or None if events were lost.
+        """
+        paths = self.events.wait()
+        while paths is not None:
+            more = self.events.wait(self.debounce)
+            if more is None:
+                return None
+            if not more:
+                break
+            paths += more
+        return paths
+
+    def sync_modules(self):
+        """
+        Watches every module directory. Returns the names of the modules
+        that were not watched before.
+        """
+        self.events.watch_dir(self.repo_dir)
+        for MOD_NAME in list(self.states):
+            if not os.path.exists(f'{self.repo_dir}/{MOD_NAME}/include'):
+                del self.states[MOD_NAME]
+        new_mods = []
+        for MOD_NAME in sorted(os.listdir(self.repo_dir)):
+            MOD_ROOT = os.path.join(self.repo_dir, MOD_NAME)
+            if MOD_NAME.startswith('.') or not os.path.isdir(MOD_ROOT):
+                continue
+            for path in [MOD_ROOT, f'{MOD_ROOT}/include', f'{MOD_ROOT}/src',
+                         f'{MOD_ROOT}/include/{MOD_NAME}']:
+                if os.path.isdir(path):
+                    self.events.watch_dir(path)
+            if MOD_NAME in self.states or not os.path.exists(f'{MOD_ROOT}/include'):
+                continue
+            for path in mod_inputs(MOD_ROOT):
+                self.owner[path] = MOD_NAME
+            self.states[MOD_NAME] = self.input_states(MOD_ROOT)
+            new_mods.append(MOD_NAME)
+        return new_mods
+
+    def input_states(self, MOD_ROOT, old_states=None):
+        old_states = old_states or {}
+        return {path: file_state(path, old_states.get(path))
+                for path in mod_inputs(MOD_ROOT)}
+
+    def handle(self, paths):
+        # Directory changes may mean a module was added
+        new_mods = []
+        if paths is None or any(path not in self.owner for path in paths):
+            new_mods = self.sync_modules()
+
+        repo_state = file_state(self.repo_yaml, self.repo_state)
+        if repo_state != self.repo_state:
+            # The namespace may have changed, so every module is stale
+            self.repo_state = repo_state
+            self.refresh(sorted(self.states), repo=True)
+            return
+
+        mods = set(new_mods)
+        touched = self.states if paths is None else \
+            {self.owner[path] for path in paths if path in self.owner}
+        for MOD_NAME in touched:
+            MOD_ROOT = os.path.join(self.repo_dir, MOD_NAME)
+            old_states = self.states[MOD_NAME]
+            new_states = self.input_states(MOD_ROOT, old_states)
+            # Keep touched-but-identical files from being hashed again
+            self.states[MOD_NAME] = new_states
+            if any(_content(new_states[path]) != _content(old_states[path])
+                   for path in new_states):
+                mods.add(MOD_NAME)
+        if mods:
+            self.refresh(sorted(mods), repo=bool(new_mods))
+
+    def refresh(self, MOD_NAMES, repo=False):
+        """
+        Regenerates MOD_NAMES in this process and records them in the
+        refresh manifest. With repo, also reloads chimaera_repo.yaml and
+        regenerates the repo CMakeLists.txt.
+        """
+        start = time.perf_counter()
+        results = []
+        with RepoLock(self.repo_dir):
+            if repo:
+                self.gen.load_repo_config(self.repo_dir)
+            manifest = RefreshManifest(self.repo_dir, settings=self.options)
+            for MOD_NAME in MOD_NAMES:
+                MOD_ROOT = os.path.join(self.repo_dir, MOD_NAME)
+                result = refresh_module(MOD_ROOT, self.gen.namespace, self.options)
+                if result.status == 'failed':
+                    manifest.forget(MOD_ROOT)
+                else:
+                    manifest.record(MOD_ROOT)
+                # Snapshot after the refresh so that its own writes are not
+                # mistaken for edits
+                self.states[MOD_NAME] = self.input_states(MOD_ROOT)
+                results.append(result)
+            manifest.save()
+            self.gen.record_artifacts(self.repo_dir, results)
+            if repo:
+                self.gen.refresh_repo_cmake(self.repo_dir)
+        self.gen.print_results(results)
+        print(f'Regenerated {", ".join(MOD_NAMES)} in '
+              f'{(time.perf_counter() - start) * 1e3:.1f}ms')
+
+
+def _content(state):
+    return None if state is None else state[2]
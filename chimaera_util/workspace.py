@@ -0,0 +1,273 @@
+"""
+Workspace mode. A workspace file lists module repositories and the repos
+each one depends on, e.g. chimaera_workspace.yaml:
+
+    repos:
+      core: ../core
+      hermes:
+        path: ../hermes
+        depends: [core]
+    configs:
+      - ../chimaera
+      - {path: ../chimaera_server, binary: true}
+
+Paths are relative to the workspace file. configs are CHI_ROOTs whose
+default config headers are generated as by chi make-config.
+
+A refresh runs every repo in one process. A repo starts once the repos it
+depends on are refreshed, and independent repos are refreshed at the same
+time. Their modules share one process pool, and the parsed configs and
+templates loaded by one repo are reused by the next.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from chimaera_util.codegen import ChimaeraCodegen
+from chimaera_util.util.config import load_yaml
+from chimaera_util.util.profile import PROFILER
+
+WORKSPACE_NAME = 'chimaera_workspace.yaml'
+
+
+class WorkspaceRepo:
+    """
+    A repo of a workspace: its name, absolute path and the names of the
+    repos it depends on.
+    """
+
+    def __init__(self, name, path, depends=None):
+        self.name = name
+        self.path = path
+        self.depends = list(depends or [])
+
+
+class WorkspaceConfig:
+    """
+    A CHI_ROOT of a workspace whose default configs are generated.
+    """
+
+    def __init__(self, path, binary=False):
+        self.path = path
+        self.binary = binary
+
+
+class ConfigResult:
+    """
+    The outcome of generating the configs of a CHI_ROOT.
+    """
+
+    def __init__(self, config, error=None):
+        self.config = config
+        self.error = error
+
+
+class RepoResult:
+    """
+    The outcome of refreshing one repo of a workspace. status is
+    'refreshed', 'failed' (a module or the repo failed) or 'blocked' (a
+    repo it depends on failed, so it was not refreshed).
+    """
+
+    def __init__(self, repo, status, results=None, error=None):
+        self.repo = repo
+        self.status = status
+        self.results = results or []
+        self.error = error
+
+    def modules(self, status):
+        return [result.mod_name for result in self.results if result.status == status]
+
+
+class Workspace:
+    def __init__(self, path, repos, configs=None):
+        self.path = path
+        self.repos = repos
+        self.configs = configs or []
+        self.order = self.topological_order()
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a workspace file. path may also be the directory that holds
+        chimaera_workspace.yaml.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, WORKSPACE_NAME)
+        path = os.path.abspath(path)
+        root = os.path.dirname(path)
+        data = load_yaml(path) or {}
+        unknown = sorted(set(data) - {'repos', 'configs'})
+        if unknown:
+            raise ValueError(f'{path}: unknown keys {unknown}, expected repos or configs')
+        repos = {}
+        if not isinstance(data.get('repos') or {}, dict):
+            raise ValueError(f'{path}: repos must be a mapping of repo names')
+        for name, repo in (data.get('repos') or {}).items():
+            if isinstance(repo, str):
+                repo = {'path': repo}
+            if not isinstance(repo, dict) or not isinstance(repo.get('path'), str):
+                raise ValueError(f'{path}: repo {name} has no path')
+            unknown = sorted(set(repo) - {'path', 'depends'})
+            if unknown:
+                raise ValueError(f'{path}: unknown keys {unknown} in repo {name}, '
+                                 f'expected path or depends')
+            depends = repo.get('depends') or []
+            if not isinstance(depends, list):
+                raise ValueError(f'{path}: depends of repo {name} must be a list of '
+                                 f'repo names, not {depends!r}')
+            for dep in depends:
+                if not isinstance(dep, str):
+                    raise ValueError(f'{path}: depends of repo {name} has {dep!r}, '
+                                     f'which is not a repo name')
+            repos[name] = WorkspaceRepo(name, os.path.join(root, repo['path']),
+                                        repo.get('depends'))
+        if not isinstance(data.get('configs') or [], list):
+            raise ValueError(f'{path}: configs must be a list')
+        configs = []
+        for i, config in enumerate(data.get('configs') or []):
+            if isinstance(config, str):
+                config = {'path': config}
+            if not isinstance(config, dict) or not isinstance(config.get('path'), str):
+                raise ValueError(f'{path}: config {i} has no path')
+            unknown = sorted(set(config) - {'path', 'binary'})
+            if unknown:
+                raise ValueError(f'{path}: unknown keys {unknown} in config {config["path"]}, '
+                                 f'expected path or binary')
+            if not isinstance(config.get('binary', False), bool):
+                raise ValueError(f'{path}: binary of config {config["path"]} must be true or false')
+            configs.append(WorkspaceConfig(os.path.join(root, config['path']),
+                                           config.get('binary', False)))
+        return Workspace(path, repos, configs)
+
+    def topological_order(self):
+        """
+        The repo names, each after the repos it depends on. Ties are
+        broken by name so the order is stable.
+        """
+        for repo in self.repos.values():
+            missing = [dep for dep in repo.depends if dep not in self.repos]
+            if missing:
+                raise ValueError(f'{self.path}: repo {repo.name} depends on '
+                                 f'unknown repos {missing}')
+        order = []
+        done = set()
+        remaining = sorted(self.repos)
+        while remaining:
+            ready = [name for name in remaining
+                     if all(dep in done for dep in self.repos[name].depends)]
+            if not ready:
+                raise ValueError(f'{self.path}: dependency cycle among repos {remaining}')
+            order += ready
+            done.update(ready)
+            remaining = [name for name in remaining if name not in done]
+        return order
+
+    def refresh(self, force=False, jobs=1, options=None, configs=True, binary=False):
+        """
+        Refreshes every repo in dependency order and generates the
+        configs. With jobs > 1, ready repos are refreshed concurrently
+        and their modules share a pool of jobs processes (jobs <= 0 uses
+        every core). Returns the RepoResults in dependency order and the
+        ConfigResults.
+        """
+        if jobs <= 0:
+            jobs = os.cpu_count() or 1
+        config_results = []
+        if configs:
+            config_results = [self.make_configs(config, binary) for config in self.configs]
+        if jobs == 1 or len(self.repos) == 0:
+            results = {}
+            for name in self.order:
+                results[name] = self.refresh_repo(self.repos[name], results, force, options)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as pool, \
+                    ThreadPoolExecutor(max_workers=len(self.repos)) as threads:
+                results = self.refresh_concurrent(threads, pool, force, options)
+        return [results[name] for name in self.order], config_results
+
+    def refresh_concurrent(self, threads, pool, force, options):
+        """
+        Starts each repo in a thread as soon as the repos it depends on
+        are done. Returns {repo name: RepoResult}.
+        """
+        results = {}
+        running = {}
+        waiting = list(self.order)
+        while waiting or running:
+            ready = [name for name in waiting
+                     if all(dep in results for dep in self.repos[name].depends)]
+            for name in ready:
+                waiting.remove(name)
+                future = threads.submit(self.refresh_repo, self.repos[name],
+                                        results, force, options, pool)
+                running[future] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results[running.pop(future)] = future.result()
+        return results
+
+    def refresh_repo(self, repo, results, force, options, pool=None):
+        """
+        Refreshes one repo, unless a repo it depends on failed.
+        """
+        blocked = [dep for dep in repo.depends if results[dep].status != 'refreshed']
+        if blocked:
+            return RepoResult(repo, 'blocked', error=f'depends on {blocked}, which did not refresh')
+        gen = ChimaeraCodegen()
+        try:
+            with PROFILER.module(repo.name):
+                mod_results = gen.refresh_repo(repo.path, force=force, options=options,
+                                               pool=pool, quiet=True)
+        except Exception as e:
+            return RepoResult(repo, 'failed', error=f'{type(e).__name__}: {e}')
+        if any(result.status == 'failed' for result in mod_results):
+            return RepoResult(repo, 'failed', mod_results)
+        return RepoResult(repo, 'refreshed', mod_results)
+
+    def make_configs(self, config, binary=False):
+        try:
+            with PROFILER.phase('make_configs'):
+                ChimaeraCodegen().make_configs(config.path, binary=binary or config.binary)
+        except Exception as e:
+            return ConfigResult(config, f'{type(e).__name__}: {e}')
+        return ConfigResult(config)
+
+
+def print_workspace_results(repo_results, config_results=None):
+    """
+    Prints the log of each repo in dependency order, then a summary of
+    what changed in every repo.
+    """
+    gen = ChimaeraCodegen()
+    for config_result in config_results or []:
+        if config_result.error is not None:
+            print(f'[{config_result.config.path}] make-config FAILED: {config_result.error}')
+    for repo_result in repo_results:
+        print(f'== {repo_result.repo.name} ({repo_result.repo.path})')
+        if repo_result.results:
+            gen.print_results(repo_result.results)
+        if repo_result.error is not None:
+            print(f'{repo_result.status.upper()}: {repo_result.error}')
+    print('Summary:')
+    totals = {'refreshed': 0, 'skipped': 0, 'failed': 0}
+    for repo_result in repo_results:
+        counts = {status: repo_result.modules(status) for status in totals}
+        for status, mods in counts.items():
+            totals[status] += len(mods)
+        line = (f"  {repo_result.repo.name}: {repo_result.status}, "
+                f"{len(counts['refreshed'])} refreshed, "
+                f"{len(counts['skipped'])} unchanged, "
+                f"{len(counts['failed'])} failed")
+        changed = sorted(counts['refreshed'] + counts['failed'])
+        if changed:
+            line += f" ({', '.join(changed)})"
+        print(line)
+    repos_failed = sum(repo_result.status == 'failed' for repo_result in repo_results)
+    repos_blocked = sum(repo_result.status == 'blocked' for repo_result in repo_results)
+    configs_failed = sum(config_result.error is not None
+                         for config_result in config_results or [])
+    print(f"Refreshed {totals['refreshed']} modules in {len(repo_results)} repos, "
+          f"skipped {totals['skipped']} unchanged, {totals['failed']} failed; "
+          f"{repos_failed} repos failed, {repos_blocked} blocked, "
+          f"{configs_failed} configs failed")